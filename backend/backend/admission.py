@@ -0,0 +1,176 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .monitoring import LoopLagMonitor
+
+
+class ConcurrencyLimit:
+    '''
+    Limits how many requests to a route are handled at once, queueing the rest for a bounded time.
+
+    Unlike asyncio.Semaphore, this isn't bound to the event loop it was first used in.
+    '''
+
+    def __init__(self, concurrency: int, queue_timeout: float, max_queue: Optional[int] = None, sheddable: bool = True):
+        '''
+        Args:
+            concurrency (int): How many requests may be handled at once.
+            queue_timeout (float): How long, in seconds, a request may wait for its turn before it's rejected.
+            max_queue (int | None, optional): How many requests may wait at once. Defaults to 4 * concurrency.
+            sheddable (bool, optional): Whether requests are rejected outright while the server is overloaded.
+                Defaults to True.
+        '''
+
+        self.concurrency = concurrency
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue if max_queue is not None else 4 * concurrency
+        self.sheddable = sheddable
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> bool:
+        '''
+        Waits for a turn, returning whether one was given before the queue timeout (or whether there was room to queue at all).
+        '''
+
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.max_queue:
+            return False
+
+        turn = asyncio.get_running_loop().create_future()
+        self.waiters.append(turn)
+        try:
+            await asyncio.wait_for(turn, self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            # the turn may have been handed over just before the cancellation
+            if turn.done() and not turn.cancelled():
+                self.release()
+            raise
+        finally:
+            if not turn.done() or turn.cancelled():
+                try:
+                    self.waiters.remove(turn)
+                except ValueError:
+                    pass
+
+    def release(self):
+        # hand the turn straight to the next waiter, if there is one
+        while self.waiters:
+            turn = self.waiters.popleft()
+            if not turn.done():
+                turn.set_result(None)
+                return
+        self.active -= 1
+
+
+class OverloadDetector:
+    '''
+    Decides whether the server is overloaded, from how long requests wait for a database connection
+    and how far behind the event loop is running.
+
+    Connection waits are only measured when a request borrows one, which shed requests never do, so
+    the smoothed wait also decays with time. Otherwise the server would shed load forever once it started.
+    '''
+
+    def __init__(self, lag_monitor: LoopLagMonitor, max_pool_wait: float = 0.1, max_loop_lag: float = 0.25, smoothing: float = 0.2, half_life: float = 1):
+        '''
+        Args:
+            lag_monitor (LoopLagMonitor): Where the event loop's lag is read from.
+            max_pool_wait (float, optional): The smoothed connection wait, in seconds, above which the server is overloaded. Defaults to 0.1.
+            max_loop_lag (float, optional): The smoothed event loop lag, in seconds, above which the server is overloaded. Defaults to 0.25.
+            smoothing (float, optional): How much weight each new connection wait gets. Defaults to 0.2.
+            half_life (float, optional): How long, in seconds, the smoothed connection wait takes to halve
+                without any new ones. Defaults to 1.
+        '''
+
+        self.lag_monitor = lag_monitor
+        self.max_pool_wait = max_pool_wait
+        self.max_loop_lag = max_loop_lag
+        self.smoothing = smoothing
+        self.half_life = half_life
+        self._pool_wait = 0.0
+        self.sampled_at = time.monotonic()
+
+    @property
+    def pool_wait(self) -> float:
+        return self._pool_wait * 0.5 ** ((time.monotonic() - self.sampled_at) / self.half_life)
+
+    def record_pool_wait(self, seconds: float):
+        pool_wait = self.pool_wait
+        self._pool_wait = pool_wait + self.smoothing * (seconds - pool_wait)
+        self.sampled_at = time.monotonic()
+
+    def overloaded(self) -> bool:
+        return self.pool_wait > self.max_pool_wait or self.lag_monitor.lag > self.max_loop_lag
+
+
+class AdmissionMiddleware:
+    '''
+    Applies a ConcurrencyLimit to each route, and turns requests away with a fast 503 (and a Retry-After)
+    when their route's queue is full, when they've queued for too long, or while the server is overloaded.
+    '''
+
+    def __init__(self, app: ASGIApp, limits: dict[str, ConcurrencyLimit], default_limit: ConcurrencyLimit, detector: OverloadDetector, retry_after: int = 1):
+        '''
+        Args:
+            app (ASGIApp): The app to admit requests to.
+            limits (dict[str, ConcurrencyLimit]): Limits by path prefix. The longest matching prefix is used.
+            default_limit (ConcurrencyLimit): The limit for paths that don't match any prefix.
+            detector (OverloadDetector): Decides when sheddable requests are rejected outright.
+            retry_after (int, optional): The Retry-After sent with rejections, in seconds. Defaults to 1.
+        '''
+
+        self.app = app
+        self.limits = sorted(limits.items(), key=lambda limit: len(limit[0]), reverse=True)
+        self.default_limit = default_limit
+        self.detector = detector
+        self.retry_after = retry_after
+        self.rejected = 0
+
+    def limit_for(self, path: str) -> ConcurrencyLimit:
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return self.default_limit
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        limit = self.limit_for(scope['path'])
+        if limit.sheddable and self.detector.overloaded():
+            await self.reject(send)
+            return
+        if not await limit.acquire():
+            await self.reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limit.release()
+
+    async def reject(self, send: Send):
+        self.rejected += 1
+        body = json.dumps({'detail': 'The server is busy. Please try again shortly.'}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(self.retry_after).encode()),
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import math
+from typing import Awaitable, Callable, Optional
+
+from .batching import BatchFlusher
+
+logger = logging.getLogger(__name__)
+
+# 2 ** 10 one byte registers, which estimates unique viewers to within about 3%
+HLL_PRECISION = 10
+
+
+class HyperLogLog:
+    '''
+    Estimates how many distinct keys have been added, in a fixed amount of memory, without keeping the keys.
+
+    Each key is hashed, and the hash's first few bits pick a register, which keeps the longest run of
+    leading zeros seen in the rest of the hashes that picked it. Two HyperLogLogs are combined by taking
+    the larger of each register, so a key that's added to both is still only counted once.
+    '''
+
+    def __init__(self, registers: Optional[bytes] = None, precision: int = HLL_PRECISION):
+        self.precision = precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << precision)
+
+    def add(self, key: str):
+        hashed = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+        bits = 64 - self.precision
+        index = hashed >> bits
+        rank = bits - (hashed & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: 'HyperLogLog'):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # for small counts, how many registers are still empty is the better estimate
+            return round(m * math.log(m / zeros))
+        return round(estimate)
+
+
+class SiteAnalytics(BatchFlusher):
+    '''
+    Estimates each website's unique viewers in memory, and combines them with what's in the database every
+    few seconds, so a popular website costs one upsert per interval rather than a write per view. (Its hits
+    are counted from the audit log's views, rather than a second time here.)
+
+    Attributes:
+        pending (dict[int, HyperLogLog]): The viewers that haven't been saved, by website ID.
+        dropped (int): How many views weren't counted, since too many websites were waiting to be saved.
+    '''
+
+    def __init__(self, save: Callable[[dict[int, HyperLogLog]], Awaitable[None]], interval: float = 10, max_websites: int = 10000):
+        '''
+        Args:
+            save (Callable): Combines websites' viewers with what's saved, raising if it couldn't.
+            interval (float, optional): How often, in seconds, viewers are saved. Defaults to 10.
+            max_websites (int, optional): The most websites counted in memory at once (each takes about
+                a kilobyte). Views of any others aren't counted until the next save. Defaults to 10000.
+        '''
+
+        super().__init__(interval)
+        self.save = save
+        self.max_websites = max_websites
+        self.pending: dict[int, HyperLogLog] = {}
+        # the viewers being saved, which still count until they have been
+        self.saving: dict[int, HyperLogLog] = {}
+        self.dropped = 0
+
+    def record(self, website_id: int, viewer: str):
+        viewers = self.pending.get(website_id)
+        if viewers is None:
+            if len(self.pending) >= self.max_websites:
+                self.dropped += 1
+                self.ready.set()
+                return
+            viewers = self.pending[website_id] = HyperLogLog()
+        viewers.add(viewer)
+
+    def unsaved(self, website_id: int) -> HyperLogLog:
+        '''
+        Returns a website's viewers that haven't been saved yet.
+        '''
+
+        unsaved = HyperLogLog()
+        for viewers in (self.saving, self.pending):
+            if website_id in viewers:
+                unsaved.merge(viewers[website_id])
+        return unsaved
+
+    async def write_pending(self) -> bool:
+        # views that come in while the viewers are saved are counted afresh. if they can't be saved,
+        # they're kept to be saved with the next ones
+        if not self.pending:
+            return True
+        self.saving, self.pending = self.pending, {}
+        try:
+            await self.save(self.saving)
+        except Exception:
+            logger.exception('Could not save analytics for %s websites', len(self.saving))
+            self.restore()
+            return False
+        except BaseException:
+            self.restore()
+            raise
+        self.saving = {}
+        return True
+
+    def restore(self):
+        # puts the viewers that weren't saved back with the ones that have come in since
+        for website_id, viewers in self.saving.items():
+            if website_id in self.pending:
+                viewers.merge(self.pending[website_id])
+            self.pending[website_id] = viewers
+        self.saving = {}
@@ -0,0 +1,329 @@
+import hashlib
+import mimetypes
+import posixpath
+import re
+from typing import Callable, Optional
+
+from .responses import brotli, compress
+from .store import ContentStore
+
+# the minifiers are deliberately conservative - they only remove comments and whitespace
+# that can't change how a page renders or behaves, since nobody checks the output by hand
+
+RAW_HTML_BLOCK = re.compile(r'(<(pre|textarea|script|style)\b[^>]*>)(.*?)(</\2\s*>)', re.IGNORECASE | re.DOTALL)
+HTML_COMMENT = re.compile(r'<!--(?!\[if).*?-->', re.DOTALL)
+# a comment, or a tag along with its (possibly quoted) attributes
+HTML_MARKUP = re.compile(HTML_COMMENT.pattern + r'''|<[^\s<>"'][^<>"']*(?:(?:"[^"]*"|'[^']*')[^<>"']*)*>''', re.DOTALL)
+QUOTED_VALUE = re.compile(r'''("[^"]*"|'[^']*')''')
+JS_SCRIPT_TYPES = {'', 'text/javascript', 'application/javascript', 'module'}
+SCRIPT_TYPE = re.compile(r'''\btype\s*=\s*["']?([^"'\s>]*)''', re.IGNORECASE)
+
+# spaces next to these characters never separate two tokens that would otherwise merge
+CSS_TIGHT = set('{};,>')
+# what ends the current rule or declaration, skipping over strings
+CSS_STATEMENT_END = re.compile(r'''"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|[{};]''')
+JS_TIGHT = set('{}()[];,:=<>!&|*%^~')
+# a slash after one of these (or a keyword like return) starts a regular expression rather than a division
+JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw', 'case', 'do', 'else'}
+
+HTML_REFERENCE = re.compile(r'''(\b(?:src|href)\s*=\s*)(["']?)([^"'\s>]+)\2''', re.IGNORECASE)
+CSS_REFERENCE = re.compile(r'''(url\(\s*|@import\s+)(["']?)([^"')\s;]+)\2''', re.IGNORECASE)
+
+COMPRESSIBLE_TYPES = {'application/javascript', 'text/javascript', 'application/json', 'image/svg+xml'}
+
+
+def in_declaration(css: str, i: int, depth: int) -> bool:
+    '''
+    Whether position i is part of a declaration (eg. color: red), rather than a selector or an at-rule's
+    prelude. It's in a declaration if it's inside a block, and what follows ends with ; or } rather
+    than opening a block of its own (as a nested rule's selector would).
+    '''
+
+    if not depth:
+        return False
+    for end in CSS_STATEMENT_END.finditer(css, i):
+        if end.group() in '{};':
+            return end.group() != '{'
+    return True
+
+
+def minify_css(css: str) -> str:
+    out: list[str] = []
+    i = 0
+    depth = 0
+    pending_space = False
+    while i < len(css):
+        c = css[i]
+        if css.startswith('/*', i):
+            end = css.find('*/', i + 2)
+            i = len(css) if end == -1 else end + 2
+            pending_space = True
+            continue
+        if c in '"\'':
+            end = i + 1
+            while end < len(css) and css[end] != c:
+                end += 2 if css[end] == '\\' else 1
+            if pending_space and out and out[-1][-1] not in CSS_TIGHT and out[-1][-1] != ':':
+                out.append(' ')
+            pending_space = False
+            out.append(css[i:end + 1])
+            i = end + 1
+            continue
+        if c.isspace():
+            pending_space = True
+            i += 1
+            continue
+        # spaces before a colon are only removed in declarations, since in a selector (a :hover) they matter
+        tight = c in CSS_TIGHT or (c == ':' and in_declaration(css, i, depth))
+        if pending_space and out and out[-1][-1] not in CSS_TIGHT and out[-1][-1] != ':' and not tight:
+            out.append(' ')
+        pending_space = False
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth = max(depth - 1, 0)
+            if out and out[-1] == ';':
+                # the last declaration in a block doesn't need its semicolon
+                out.pop()
+        out.append(c)
+        i += 1
+    return ''.join(out)
+
+
+def minify_js(js: str) -> str:
+    '''
+    Removes comments and redundant whitespace from JavaScript. Line breaks are kept (though blank lines
+    aren't), since automatic semicolon insertion depends on them.
+    '''
+
+    out: list[str] = []
+    i = 0
+    pending = ''
+    previous = ''
+    word = ''
+
+    def flush_whitespace(next_char: str):
+        nonlocal pending
+        if pending == '\n':
+            if out and out[-1] != '\n':
+                out.append('\n')
+        elif pending and out and out[-1] != '\n' and out[-1][-1] not in JS_TIGHT and next_char not in JS_TIGHT:
+            out.append(' ')
+        pending = ''
+
+    while i < len(js):
+        c = js[i]
+        if js.startswith('//', i):
+            end = js.find('\n', i)
+            i = len(js) if end == -1 else end
+            continue
+        if js.startswith('/*', i):
+            end = js.find('*/', i + 2)
+            comment = js[i:len(js) if end == -1 else end + 2]
+            i = len(js) if end == -1 else end + 2
+            pending = '\n' if '\n' in comment or pending == '\n' else pending or ' '
+            continue
+        if c.isspace():
+            pending = '\n' if c == '\n' or pending == '\n' else pending or ' '
+            i += 1
+            continue
+
+        is_regex = c == '/' and (not previous or previous in JS_REGEX_PRECEDERS or word in JS_REGEX_KEYWORDS)
+        if c in '"\'`' or is_regex:
+            # strings, template literals and regular expressions are copied as they are
+            end = i + 1
+            in_class = False
+            while end < len(js):
+                if js[end] == '\\':
+                    end += 2
+                    continue
+                if is_regex and js[end] == '[':
+                    in_class = True
+                elif is_regex and js[end] == ']':
+                    in_class = False
+                elif js[end] == c and not in_class:
+                    break
+                elif js[end] == '\n' and c != '`':
+                    break
+                end += 1
+            if is_regex:
+                # the regular expression's flags
+                end += 1
+                while end < len(js) and (js[end].isalnum() or js[end] == '_'):
+                    end += 1
+                end -= 1
+            flush_whitespace(c)
+            out.append(js[i:end + 1])
+            previous = c
+            word = ''
+            i = end + 1
+            continue
+
+        flush_whitespace(c)
+        out.append(c)
+        if c.isalnum() or c in '_$':
+            word = word + c if previous and (previous.isalnum() or previous in '_$') else c
+        else:
+            word = ''
+        previous = c
+        i += 1
+    return ''.join(out).strip('\n')
+
+
+def minify_html(html: str) -> str:
+    '''
+    Removes comments and collapses whitespace in HTML. Whitespace is collapsed to a single space
+    rather than removed, since it's significant between inline elements. Quoted attribute values and
+    the contents of pre and textarea elements are left alone, and inline scripts and styles are
+    minified as JavaScript and CSS.
+    '''
+
+    def collapse_whitespace(text: str) -> str:
+        return re.sub(r'\s+', ' ', text)
+
+    def collapse(text: str) -> str:
+        out: list[str] = []
+        # text either side of a comment is collapsed together, as if the comment was never there
+        between = ''
+        position = 0
+        for markup in HTML_MARKUP.finditer(text):
+            between += text[position:markup.start()]
+            position = markup.end()
+            if HTML_COMMENT.fullmatch(markup.group()):
+                continue
+            out.append(collapse_whitespace(between))
+            between = ''
+            # every other part is a quoted value, eg. a title, which is shown as it's written
+            parts = QUOTED_VALUE.split(markup.group())
+            out.append(''.join(part if n % 2 else collapse_whitespace(part) for n, part in enumerate(parts)))
+        out.append(collapse_whitespace(between + text[position:]))
+        return ''.join(out)
+
+    out: list[str] = []
+    position = 0
+    for block in RAW_HTML_BLOCK.finditer(html):
+        out.append(collapse(html[position:block.start()]))
+        opening, tag, contents, closing = block.group(1), block.group(2).lower(), block.group(3), block.group(4)
+        if tag == 'style':
+            contents = minify_css(contents)
+        elif tag == 'script':
+            script_type = SCRIPT_TYPE.search(opening)
+            if (script_type.group(1).lower() if script_type else '') in JS_SCRIPT_TYPES:
+                contents = minify_js(contents)
+        out.append(collapse(opening) + contents + closing)
+        position = block.end()
+    out.append(collapse(html[position:]))
+    return ''.join(out).strip()
+
+
+def minify_xml(xml: str) -> str:
+    # used for SVGs, where whitespace between elements isn't rendered
+    return re.sub(r'>\s+<', '><', re.sub(r'\s+', ' ', HTML_COMMENT.sub('', xml))).strip()
+
+
+MINIFIERS: dict[str, Callable[[str], str]] = {
+    'text/html': minify_html,
+    'text/css': minify_css,
+    'application/javascript': minify_js,
+    'text/javascript': minify_js,
+    'image/svg+xml': minify_xml,
+}
+
+
+def media_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or 'text/plain'
+
+
+def hashed_name(path: str, data: bytes) -> str:
+    '''
+    Adds (part of) the contents' hash to a filename, eg. styles.css becomes styles.1a2b3c4d.css.
+    '''
+
+    stem, extension = posixpath.splitext(path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:8]}{extension}'
+
+
+def resolve_reference(source: str, reference: str, files: dict[str, str]) -> Optional[str]:
+    # only relative references to the site's own files are rewritten
+    if ':' in reference or reference.startswith(('/', '#', '//')):
+        return None
+    path = reference.split('#')[0].split('?')[0]
+    resolved = posixpath.normpath(posixpath.join(posixpath.dirname(source), path))
+    return resolved if resolved in files else None
+
+
+def optimize_site(files: dict[str, str], store_root: str) -> list[dict]:
+    '''
+    Minifies a website's files, gives everything but its pages content-hashed names (rewriting the
+    references to them), and writes the results and their gzip and brotli versions to a content store.
+    This is meant to be run in a worker process.
+
+    Args:
+        files (dict[str, str]): The website's files' contents, by filename.
+        store_root (str): The content store's directory.
+
+    Returns:
+        list[dict]: A manifest of what was written, with each file's path, source, digest, media type and sizes.
+    '''
+
+    store = ContentStore(store_root)
+    served_names: dict[str, str] = {}
+    outputs: dict[str, bytes] = {}
+    resolving: set[str] = set()
+
+    def rewrite(source: str, text: str, pattern: re.Pattern) -> str:
+        def replace(match: re.Match) -> str:
+            target = resolve_reference(source, match.group(3), files)
+            if target is None or target in resolving:
+                return match.group(0)
+            served = resolve(target)
+            relative = posixpath.relpath(served, posixpath.dirname(source) or '.')
+            suffix = match.group(3)[len(match.group(3).split('#')[0].split('?')[0]):]
+            return f'{match.group(1)}{match.group(2)}{relative}{suffix}{match.group(2)}'
+        return pattern.sub(replace, text)
+
+    def resolve(path: str) -> str:
+        # files are resolved depth first, since a file's hash depends on the names it refers to
+        if path in served_names:
+            return served_names[path]
+        resolving.add(path)
+        kind = media_type(path)
+        text = files[path]
+        if kind == 'text/html':
+            text = rewrite(path, text, HTML_REFERENCE)
+        elif kind == 'text/css':
+            text = rewrite(path, text, CSS_REFERENCE)
+        data = MINIFIERS.get(kind, lambda text: text)(text).encode()
+        served = path if kind == 'text/html' else hashed_name(path, data)
+        resolving.discard(path)
+        served_names[path] = served
+        outputs[served] = data
+        return served
+
+    manifest = []
+    for path in sorted(files):
+        served = resolve(path)
+        data = outputs[served]
+        kind = media_type(path)
+        entry = {
+            'path': served,
+            'source': path,
+            'digest': store.put(data),
+            'media_type': kind,
+            'original_size': len(files[path].encode()),
+            'size': len(data),
+            'gzip_size': None,
+            'brotli_size': None
+        }
+        if kind.startswith('text/') or kind in COMPRESSIBLE_TYPES:
+            # compressed versions are only kept if they're smaller
+            for encoding, key in (('gzip', 'gzip_size'), ('br', 'brotli_size')):
+                if encoding == 'br' and brotli is None:
+                    continue
+                compressed = compress(data, encoding, thorough=True)
+                if len(compressed) < len(data):
+                    store.put(compressed, encoding=encoding, digest=entry['digest'])
+                    entry[key] = len(compressed)
+        manifest.append(entry)
+    return manifest
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import logging
+import os
+from collections import Counter, deque
+from datetime import date, datetime
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from .batching import BatchFlusher
+
+logger = logging.getLogger(__name__)
+
+# details (eg. the username of a failed login) are cut short, so the buffer's size bounds its memory
+MAX_DETAIL_LENGTH = 200
+
+
+class AuditEvent(NamedTuple):
+    occurred_time: datetime
+    # eg. 'login', 'login_failed', 'register', 'create_website' or 'view'
+    kind: str
+    account_id: Optional[int] = None
+    website_id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class AuditLog(BatchFlusher):
+    '''
+    Collects audit events (eg. logins) and page views in a fixed size ring buffer, and writes them out
+    in batches from a background task, so handlers never wait on a write of their own.
+
+    Loss is bounded rather than memory: once the buffer is full, each new event pushes out the oldest.
+    Events that are lost are counted, and the count is written with the next batch (as a 'dropped'
+    event), so the log says where it has gaps.
+
+    Attributes:
+        dropped (int): How many events have been lost, since the buffer was full.
+        written (int): How many events have been written.
+    '''
+
+    def __init__(self, write: Callable[[list[AuditEvent]], Awaitable[None]], capacity: int = 10000, batch_size: int = 1000, interval: float = 2):
+        '''
+        Args:
+            write (Callable): Writes a batch of events, raising if it couldn't.
+            capacity (int, optional): How many events are held before the oldest are dropped. Defaults to 10000.
+            batch_size (int, optional): The most events written at once. A full batch is written straight away,
+                rather than at the next interval. Defaults to 1000.
+            interval (float, optional): How often, in seconds, events are written. Defaults to 2.
+        '''
+
+        super().__init__(interval)
+        self.write = write
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.buffer: deque[AuditEvent] = deque(maxlen=capacity)
+        # the batch being written, which hasn't been until it has
+        self.writing: list[AuditEvent] = []
+        self.dropped = 0
+        # dropped since the last batch was written
+        self.unreported = 0
+        self.written = 0
+
+    def record(self, kind: str, account_id: Optional[int] = None, website_id: Optional[int] = None, detail: Optional[str] = None):
+        if len(self.buffer) == self.capacity:
+            self.dropped += 1
+            self.unreported += 1
+        if detail is not None:
+            detail = detail[:MAX_DETAIL_LENGTH]
+        self.buffer.append(AuditEvent(datetime.utcnow(), kind, account_id, website_id, detail))
+        if len(self.buffer) >= self.batch_size:
+            self.ready.set()
+
+    def unwritten_views(self, website_id: int) -> int:
+        '''
+        Counts a website's page views that haven't been written yet (and so aren't in Website_Views).
+        '''
+
+        return sum(event.kind == 'view' and event.website_id == website_id for events in (self.writing, self.buffer) for event in events)
+
+    async def write_pending(self) -> bool:
+        # everything in the buffer is written, a batch at a time. batches that couldn't be
+        # written go back in the buffer, as far as there's room
+        while self.buffer or self.unreported:
+            self.writing = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+            unreported = self.unreported
+            batch = self.writing + [AuditEvent(datetime.utcnow(), 'dropped', detail=str(unreported))] if unreported else self.writing
+            try:
+                await self.write(batch)
+            except Exception:
+                logger.exception('Could not write %s audit events', len(batch))
+                self.requeue()
+                return False
+            except BaseException:
+                # eg. cancelled, in which case the batch is left for the next flush
+                self.requeue()
+                raise
+            self.writing = []
+            self.unreported -= unreported
+            self.written += len(batch)
+        return True
+
+    def requeue(self):
+        # the batch is older than anything recorded since, so it's the first to go if there isn't room
+        batch, self.writing = self.writing, []
+        room = self.capacity - len(self.buffer)
+        kept = batch[len(batch) - room:] if room < len(batch) else batch
+        self.buffer.extendleft(reversed(kept))
+        self.dropped += len(batch) - len(kept)
+        self.unreported += len(batch) - len(kept)
+
+
+def view_counts(events: list[AuditEvent]) -> list[tuple[int, date, int]]:
+    '''
+    Rolls a batch's page views up into how many each website had on each day.
+
+    Returns:
+        list[tuple[int, date, int]]: Each website's ID, the day and its views, in order (so concurrent
+            writers update rows in the same order, and can't deadlock).
+    '''
+
+    counts = Counter((event.website_id, event.occurred_time.date()) for event in events if event.kind == 'view')
+    return sorted((website_id, day, views) for (website_id, day), views in counts.items())
+
+
+class RotatingFileSink:
+    '''
+    Writes events to a file as lines of JSON. Once the file would go over max_bytes, it's renamed to
+    path.1 (and any path.1 to path.2, and so on), keeping at most backups old files.
+    '''
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    async def write(self, events: list[AuditEvent]):
+        lines = ''.join(json.dumps(event._asdict(), default=str) + '\n' for event in events)
+        # the file's written in a thread, so a slow disk doesn't hold up the event loop
+        await asyncio.to_thread(self.append, lines.encode())
+
+    def append(self, data: bytes):
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self.max_bytes:
+            self.rotate()
+        with open(self.path, 'ab') as file:
+            file.write(data)
+
+    def rotate(self):
+        for backup in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{backup}'):
+                os.replace(f'{self.path}.{backup}', f'{self.path}.{backup + 1}')
+        if self.backups:
+            os.replace(self.path, f'{self.path}.1')
+        else:
+            os.remove(self.path)
@@ -0,0 +1,67 @@
+import asyncio
+from typing import Optional
+
+
+class BatchFlusher:
+    '''
+    Holds work in memory, and writes it out from a background task every few seconds (or sooner, once
+    ready is set), so handlers never wait on a write of their own. Whatever's left is written once more
+    when it's stopped.
+
+    Subclasses keep the work, and write it out in write_pending(). Writes are made one at a time, under
+    the lock, and the task is only cancelled between them, never part way through one.
+    '''
+
+    def __init__(self, interval: float):
+        '''
+        Args:
+            interval (float): How often, in seconds, the work is written.
+        '''
+
+        self.interval = interval
+        self.ready = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            async with self.lock:
+                self.task.cancel()
+                try:
+                    await self.task
+                except asyncio.CancelledError:
+                    pass
+            self.task = None
+        # whatever's left gets one last try
+        await self.flush()
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> bool:
+        '''
+        Writes out the work that's waiting.
+
+        Returns:
+            bool: Whether it was all written. Work that wasn't is kept for the next flush.
+        '''
+
+        async with self.lock:
+            self.ready.clear()
+            return await self.write_pending()
+
+    async def write_pending(self) -> bool:
+        '''
+        Writes out the work that's waiting, returning whether it was all written. If a write fails, or
+        is cancelled, the work has to be kept for the next flush.
+        '''
+
+        raise NotImplementedError
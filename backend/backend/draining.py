@@ -0,0 +1,92 @@
+import asyncio
+import json
+import logging
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class Drainer:
+    '''
+    Keeps track of the requests being handled, so that shutting down can wait for them to finish.
+
+    Attributes:
+        in_flight (int): How many requests are being handled.
+        draining (bool): Whether the server is shutting down, ie. new requests are being turned away.
+    '''
+
+    def __init__(self):
+        self.in_flight = 0
+        self.draining = False
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def enter(self):
+        self.in_flight += 1
+        self.idle.clear()
+
+    def exit(self):
+        self.in_flight -= 1
+        if not self.in_flight:
+            self.idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        '''
+        Turns new requests away, and waits for the ones being handled to finish.
+
+        Args:
+            timeout (float): The longest to wait, in seconds.
+
+        Returns:
+            bool: Whether they all finished in time.
+        '''
+
+        self.draining = True
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning('Shutting down with %s requests still being handled.', self.in_flight)
+            return False
+
+
+class DrainMiddleware:
+    '''
+    Counts requests in and out with a Drainer, and turns them away with a 503 once it's draining. The
+    503 asks for the connection to be closed, so the client (or fly.io's proxy) retries somewhere else.
+    '''
+
+    def __init__(self, app: ASGIApp, drainer: Drainer, retry_after: int = 1):
+        self.app = app
+        self.drainer = drainer
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        if self.drainer.draining:
+            await self.reject(send)
+            return
+
+        self.drainer.enter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.drainer.exit()
+
+    async def reject(self, send: Send):
+        body = json.dumps({'detail': 'The server is restarting. Please try again shortly.'}).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode()),
+                (b'retry-after', str(self.retry_after).encode()),
+                (b'connection', b'close'),
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,183 @@
+import hashlib
+import posixpath
+import re
+import struct
+import zlib
+from typing import AsyncIterator, NamedTuple, Optional
+
+# files are stored in archives rather than compressed, so an archive's length (and where each of
+# its files is) can be worked out from the files' sizes, before any of them are read. that's
+# what lets a download be resumed part way through, with a Range request
+ZIP_STORED = 0
+# bit 11 means the paths are UTF-8
+ZIP_UTF8_FLAG = 0x800
+ZIP_VERSION = 20
+# zip timestamps can't be before 1980, and webpages don't have one of their own. every file gets
+# the same one (1 January 1980, in DOS format), so the same files always make the same archive
+ZIP_DOS_TIME = 0
+ZIP_DOS_DATE = (1 << 5) | 1
+ZIP_FILE_ATTRIBUTES = 0o100644 << 16
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<IHHHHIIH')
+
+# without the zip64 extensions, which aren't needed for websites this small
+MAX_ZIP_FILES = 0xFFFF
+MAX_ZIP_BYTES = 0xFFFFFFFF
+
+
+class ArchiveChanged(Exception):
+    '''
+    Raised when a file differs from what an archive was laid out with, ie. it changed while the archive was being sent.
+    '''
+
+
+class ZipEntry(NamedTuple):
+    path: str
+    size: int
+    crc32: int
+
+
+class ZipLayout:
+    '''
+    Lays out a zip archive from its files' paths, sizes and checksums, without reading the files.
+
+    Attributes:
+        entries (list[ZipEntry]): The files, in the order they're stored.
+        length (int): The archive's length in bytes.
+        etag (str): A strong ETag, which changes whenever any file's path or contents do.
+    '''
+
+    def __init__(self, entries: list[ZipEntry]):
+        if len(entries) > MAX_ZIP_FILES:
+            raise ValueError(f'Archives can have at most {MAX_ZIP_FILES} files.')
+
+        self.entries = entries
+        self.headers: list[bytes] = []
+        # where each file's header starts
+        self.offsets: list[int] = []
+        directory: list[bytes] = []
+        offset = 0
+        for entry in entries:
+            path = entry.path.encode()
+            self.headers.append(LOCAL_HEADER.pack(
+                0x04034b50, ZIP_VERSION, ZIP_UTF8_FLAG, ZIP_STORED, ZIP_DOS_TIME, ZIP_DOS_DATE,
+                entry.crc32, entry.size, entry.size, len(path), 0) + path)
+            directory.append(CENTRAL_HEADER.pack(
+                0x02014b50, ZIP_VERSION, ZIP_VERSION, ZIP_UTF8_FLAG, ZIP_STORED, ZIP_DOS_TIME, ZIP_DOS_DATE,
+                entry.crc32, entry.size, entry.size, len(path), 0, 0, 0, 0, ZIP_FILE_ATTRIBUTES, offset) + path)
+            self.offsets.append(offset)
+            offset += len(self.headers[-1]) + entry.size
+        if offset > MAX_ZIP_BYTES:
+            raise ValueError(f'Archives can be at most {MAX_ZIP_BYTES} bytes.')
+
+        central_directory = b''.join(directory)
+        self.directory = central_directory + END_OF_CENTRAL_DIRECTORY.pack(
+            0x06054b50, 0, 0, len(entries), len(entries), len(central_directory), offset, 0)
+        self.length = offset + len(self.directory)
+        # the directory has every file's path, size and checksum, so it identifies the whole archive
+        self.etag = '"' + hashlib.sha256(self.directory).hexdigest()[:32] + '"'
+
+    def _data_span(self, index: int) -> tuple[int, int]:
+        start = self.offsets[index] + len(self.headers[index])
+        return start, start + self.entries[index].size
+
+    def files_in(self, start: int, end: int) -> list[int]:
+        '''
+        Returns the indexes of the files whose contents are (at least partly) in a range of the archive.
+
+        Args:
+            start (int): The range's first byte.
+            end (int): The byte after the range's last.
+        '''
+
+        return [index for index in range(len(self.entries))
+                if self.entries[index].size and self._data_span(index)[0] < end and self._data_span(index)[1] > start]
+
+    async def stream(self, start: int, end: int, contents: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+        '''
+        Yields a range of the archive's bytes.
+
+        Args:
+            start (int): The range's first byte.
+            end (int): The byte after the range's last.
+            contents (AsyncIterator[bytes]): The contents of the files returned by files_in(start, end), in order.
+
+        Raises:
+            ArchiveChanged: If a file's contents don't match its size and checksum.
+        '''
+
+        def clip(data: bytes, offset: int) -> bytes:
+            return data[max(start - offset, 0):max(min(end, offset + len(data)) - offset, 0)]
+
+        for index, entry in enumerate(self.entries):
+            if self.offsets[index] >= end:
+                return
+            data_start, data_end = self._data_span(index)
+            if data_end <= start:
+                continue
+            header = clip(self.headers[index], self.offsets[index])
+            if header:
+                yield header
+            if entry.size and data_start < end:
+                data = await anext(contents, None)
+                if data is None or len(data) != entry.size or zlib.crc32(data) != entry.crc32:
+                    raise ArchiveChanged(f'{entry.path} changed while it was being archived.')
+                yield clip(data, data_start)
+        directory = clip(self.directory, self.length - len(self.directory))
+        if directory:
+            yield directory
+
+
+def parse_range(range_header: Optional[str], length: int) -> Optional[tuple[int, int]]:
+    '''
+    Parses a Range header asking for one range of bytes.
+
+    Args:
+        range_header (str | None): The request's Range header, if it has one.
+        length (int): The length of what's being sent.
+
+    Returns:
+        tuple[int, int] | None: The range's first byte and the byte after its last, or None if the whole thing
+            should be sent (ie. there's no Range header, or it's one this doesn't understand, like several ranges).
+
+    Raises:
+        ValueError: If the range is entirely past the end, so none of it can be sent.
+    '''
+
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', range_header or '')
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    if match.group(1) == '':
+        # the last n bytes
+        suffix = int(match.group(2))
+        if suffix == 0:
+            raise ValueError('Range is empty.')
+        return max(length - suffix, 0), length
+    start = int(match.group(1))
+    if match.group(2) and int(match.group(2)) < start:
+        # not a valid range, so it's ignored
+        return None
+    if start >= length:
+        raise ValueError('Range starts past the end.')
+    end = int(match.group(2)) + 1 if match.group(2) else length
+    return start, min(end, length)
+
+
+def slugify(text: str, default: str) -> str:
+    slug = re.sub(r'[^a-z0-9]+', '-', text.lower()).strip('-')[:40].strip('-')
+    return slug or default
+
+
+def archive_path(*parts: str) -> str:
+    '''
+    Joins the parts of a path in an archive, so that none of them (eg. a filename with ../ in it) can
+    point outside the folder it's meant to be in when the archive is extracted.
+    '''
+
+    return '/'.join(posixpath.normpath('/' + part).lstrip('/') or '_' for part in parts)
+
+
+def website_folder(website_id: int, title: str) -> str:
+    return f'{website_id}-{slugify(title, "website")}'
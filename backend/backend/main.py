@@ -1,13 +1,15 @@
 from pydantic import BaseModel, ConfigDict
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Annotated, Optional
+from typing import Annotated, AsyncIterator, Callable, Optional
 
 from dotenv import load_dotenv
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import Depends, FastAPI, Header, HTTPException, Request, Response, status
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from jose import JWTError, jwt
+from starlette.datastructures import UploadFile
+from jose import JWTError
 from passlib.context import CryptContext
 from psycopg import DataError, IntegrityError, AsyncConnection, sql
 from psycopg.errors import UniqueViolation
@@ -15,10 +17,37 @@ from psycopg_pool import AsyncConnectionPool
 
 from .models import (TokenData, ProposedWebsite, RegisteringStudentRequest,
                      RegisteringUser, RegisteringFullUser, RegisteringFullUserRequest,
-                     LoggingInUser, UserInDB, LoggedInUser, StudentOrAdministrator)
-
+                     LoggingInUser, UserInDB, LoggedInUser, StudentOrAdministrator,
+                     RefreshingToken, RefreshedToken, SearchResult, PublishedFile, Publication,
+                     StorageLimits, StorageUsage, StorageReport, ProposedCamp, CampLogin, CreatedCamp, GalleryWebsite,
+                     DailyViews, WebsiteViews, WebsiteStats)
+from . import queries
+from .singleflight import SingleFlight
+from .responses import CompressionMiddleware, choose_encoding, etag_matches, weak_etag
+from .admission import AdmissionMiddleware, ConcurrencyLimit, OverloadDetector
+from .monitoring import LoopLagMonitor
+from .profiler import BlockingWatchdog, format_collapsed, sample_stacks
+from .tokens import TokenVerifier, parse_keys
+from .search import searchable_text
+from .publishing import Publisher
+from .audit import AuditEvent, AuditLog, RotatingFileSink, view_counts
+from .analytics import HyperLogLog, SiteAnalytics
+from .draining import Drainer, DrainMiddleware
+from .thumbnails import THUMBNAIL_MEDIA_TYPES, find_renderer
+from .exports import ZipEntry, ZipLayout, archive_path, parse_range, slugify, website_folder
+
+import asyncio
+import hashlib
+import logging
+import mimetypes
 import os
+import random
+import re
+import secrets
 import sys
+import threading
+import time
+import zlib
 
 load_dotenv()
 
@@ -32,17 +61,132 @@ if SECRET_KEY == None:
 
 ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# access tokens last between 80% and 100% of ACCESS_TOKEN_EXPIRE_MINUTES, so that
+# a class who all logged in at once don't all need to refresh at once
+ACCESS_TOKEN_EXPIRE_JITTER = 0.2
+REFRESH_TOKEN_EXPIRE_HOURS = 12
+
+# tokens are signed with SECRET_KEY, and say so with SECRET_KEY_ID. to rotate keys, move the old
+# key into PREVIOUS_SECRET_KEYS (as 'id:key,id:key') and set a new SECRET_KEY and SECRET_KEY_ID.
+# tokens signed with a previous key stay valid until they expire
+SECRET_KEY_ID = os.getenv('SECRET_KEY_ID', '1')
+token_verifier = TokenVerifier(
+    parse_keys(os.getenv('PREVIOUS_SECRET_KEYS')) | {SECRET_KEY_ID: SECRET_KEY},
+    current_kid=SECRET_KEY_ID,
+    algorithm=ALGORITHM
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
+# reads are allowed anonymously, so a missing token isn't an error for them
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token', auto_error=False)
 
 pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 
+logger = logging.getLogger(__name__)
+
 db_pool = None
+# only set if a read replica is configured (ie. DB_REPLICA_HOST)
+read_pool = None
+
+# after a user writes, their reads go to the primary for this many seconds,
+# which is comfortably longer than the replica should take to catch up
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# username -> time.monotonic() of their most recent write
+recent_writes: dict[str, float] = {}
+
+# a shared showcase link means many viewers asking for the same website at once,
+# so identical concurrent reads share a single query
+website_reads = SingleFlight()
+webpage_reads = SingleFlight()
+
+# requests are turned away with a 503 once connections take this long to borrow,
+# or the event loop falls this far behind (both smoothed, in milliseconds)
+SHED_POOL_WAIT_MS = float(os.getenv('SHED_POOL_WAIT_MS', 100))
+SHED_LOOP_LAG_MS = float(os.getenv('SHED_LOOP_LAG_MS', 250))
+
+lag_monitor = LoopLagMonitor()
+
+# handlers that hold the event loop for longer than this are logged, with a stack
+BLOCKING_THRESHOLD_MS = float(os.getenv('BLOCKING_THRESHOLD_MS', 100))
+blocking_watchdog = BlockingWatchdog(BLOCKING_THRESHOLD_MS / 1000)
+
+# the /debug endpoints only exist if this is set
+PROFILER_TOKEN = os.getenv('PROFILER_TOKEN')
+
+# how much each kind of account can store. usage is counted as websites are created and files
+# are uploaded, so checking it is a single row lookup
+STORAGE_LIMITS = {
+    'student': StorageLimits(
+        bytes=int(os.getenv('STUDENT_MAX_BYTES', 5 * 1024 * 1024)),
+        files=int(os.getenv('STUDENT_MAX_FILES', 100)),
+        websites=int(os.getenv('STUDENT_MAX_WEBSITES', 10))
+    ),
+    'administrator': StorageLimits(
+        bytes=int(os.getenv('ADMINISTRATOR_MAX_BYTES', 50 * 1024 * 1024)),
+        files=int(os.getenv('ADMINISTRATOR_MAX_FILES', 1000)),
+        websites=int(os.getenv('ADMINISTRATOR_MAX_WEBSITES', 100))
+    ),
+}
+MAX_WEBPAGE_BYTES = int(os.getenv('MAX_WEBPAGE_BYTES', 1024 * 1024))
+# a multipart body carries a boundary and the part's headers as well as the file
+MULTIPART_OVERHEAD_BYTES = 1024
+
+# websites are optimized for serving whenever their files change, in a worker process.
+# the results go in a content store on disk, so the directory should be on a volume
+PUBLISHED_DIR = os.getenv('PUBLISHED_DIR', 'published')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# websites' thumbnails are screenshots if THUMBNAIL_RENDERER names a headless browser to take them with, or drawings if not
+THUMBNAIL_RENDERER = find_renderer()
+THUMBNAIL_NAME = re.compile(r'([0-9a-f]{64})\.(png|svg)')
+# thumbnails are drawn by the server, but an SVG opened on its own can still run scripts, so they're not allowed to
+THUMBNAIL_CONTENT_SECURITY_POLICY = "default-src 'none'; style-src 'unsafe-inline'"
+
+# camps' students are given generated passwords, without lookalike characters (eg. l and 1) since they're read off a printout
+CAMP_PASSWORD_ALPHABET = 'abcdefghjkmnpqrstuvwxyz23456789'
+CAMP_PASSWORD_LENGTH = 8
+# and each camp's passwords are hashed this many at a time, so one camp doesn't take every thread (and the CPU)
+CAMP_HASHING_THREADS = int(os.getenv('CAMP_HASHING_THREADS', 2))
+# archived students' passwords are replaced with this, which isn't a hash so no password matches it
+LOCKED_PASSWORD = '!'
+# camps are archived and purged this many students per transaction, so locks are only held briefly
+CAMP_BATCH_SIZE = int(os.getenv('CAMP_BATCH_SIZE', 50))
+# exports read files from the database in chunks of about this many bytes (or one file, if it's bigger)
+EXPORT_CHUNK_BYTES = 256 * 1024
+
+# logins, registrations, new websites and page views are kept in memory and written in batches. if they
+# come in faster than they can be written, the oldest are dropped (and counted) once this many are waiting
+AUDIT_BUFFER_SIZE = int(os.getenv('AUDIT_BUFFER_SIZE', 10000))
+AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 1000))
+AUDIT_FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', 2))
+# if this is set, the log goes to rotating files instead of the database (views are still counted in the database)
+AUDIT_LOG_FILE = os.getenv('AUDIT_LOG_FILE')
+audit_file = RotatingFileSink(AUDIT_LOG_FILE, max_bytes=int(os.getenv('AUDIT_LOG_FILE_BYTES', 10 * 1024 * 1024)),
+                              backups=int(os.getenv('AUDIT_LOG_FILE_BACKUPS', 5))) if AUDIT_LOG_FILE else None
+VIEWS_MAX_DAYS = 366
+# websites' unique viewers are estimated in memory, and combined with the database's this often
+ANALYTICS_FLUSH_SECONDS = float(os.getenv('ANALYTICS_FLUSH_SECONDS', 10))
+ANALYTICS_MAX_WEBSITES = int(os.getenv('ANALYTICS_MAX_WEBSITES', 10000))
+# behind a proxy, the viewer's address is in a header the proxy sets (eg. Fly-Client-IP on fly.io)
+CLIENT_IP_HEADER = os.getenv('CLIENT_IP_HEADER')
+
+# fly.io stops idle machines (with a SIGTERM), so the server is shut down often. requests and publishes that
+# are still running get SHUTDOWN_TIMEOUT_SECONDS to finish, and then buffered logs and counts get
+# SHUTDOWN_FLUSH_SECONDS to be written, before the pool is closed. fly.toml's kill_timeout allows for both,
+# on top of uvicorn's own --timeout-graceful-shutdown (in the Procfile)
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv('SHUTDOWN_TIMEOUT_SECONDS', 10))
+SHUTDOWN_FLUSH_SECONDS = float(os.getenv('SHUTDOWN_FLUSH_SECONDS', 5))
+drainer = Drainer()
+
+# titles and usernames are only fuzzy matched if the database has pg_trgm, which is checked on startup
+search_trigrams = False
+SEARCH_MAX_RESULTS = 100
+overload = OverloadDetector(lag_monitor, max_pool_wait=SHED_POOL_WAIT_MS / 1000, max_loop_lag=SHED_LOOP_LAG_MS / 1000)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global db_pool
+    global db_pool, read_pool, search_trigrams
     # runs on server startup, before the application takes requests
     if not os.getenv("DB_HOST") or not os.getenv("DB_PORT") or not os.getenv("DB_NAME") or not os.getenv("DB_USER") or not os.getenv("DB_PASSWORD"):
         sys.exit("Could not find required database environment variables (ie. DB_HOST, DB_PORT, DB_NAME, DB_USER, or DB_PASSWORD).")
@@ -57,12 +201,141 @@ async def lifespan(app: FastAPI):
     )
 
     await db_pool.open()
+
+    async with db_pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'has_extension', {'name': 'pg_trgm'})
+            search_trigrams = (await cur.fetchone())[0]
+    if not search_trigrams:
+        logger.warning('pg_trgm is not installed, so search will not fuzzy match titles or usernames.')
+
+    if os.getenv('DB_REPLICA_HOST'):
+        # the replica defaults to the primary's port and credentials
+        replica_conninfo = f'host={os.getenv("DB_REPLICA_HOST")} port={os.getenv("DB_REPLICA_PORT", os.getenv("DB_PORT"))} dbname={os.getenv("DB_REPLICA_NAME", os.getenv("DB_NAME"))} user={os.getenv("DB_REPLICA_USER", os.getenv("DB_USER"))} password={os.getenv("DB_REPLICA_PASSWORD", os.getenv("DB_PASSWORD"))}'
+
+        read_pool = AsyncConnectionPool(
+            min_size=1,
+            max_size=10,
+            open=False,
+            conninfo=replica_conninfo
+        )
+
+        await read_pool.open()
+
+    publisher.start(PUBLISHED_DIR, THUMBNAIL_RENDERER)
+    audit_log.start()
+    site_analytics.start()
+    lag_monitor.start()
+    blocking_watchdog.start()
     yield
-    # runs on server shutdown
+    # runs on server shutdown. uvicorn has stopped taking connections by now, and requests on the ones
+    # still open are turned away, so the requests and publishes that are running are left to finish
+    deadline = time.monotonic() + SHUTDOWN_TIMEOUT_SECONDS
+    await drainer.drain(SHUTDOWN_TIMEOUT_SECONDS)
+    await publisher.stop(timeout=max(deadline - time.monotonic(), 0))
+    # then what they logged and counted is written, while there's still a pool to write it with
+    try:
+        await asyncio.wait_for(asyncio.gather(audit_log.stop(), site_analytics.stop()), SHUTDOWN_FLUSH_SECONDS)
+    except asyncio.TimeoutError:
+        logger.error('Shut down without writing %s audit events, or analytics for %s websites.', len(audit_log.buffer), len(site_analytics.pending))
+    await blocking_watchdog.stop()
+    await lag_monitor.stop()
     await db_pool.close()
+    if read_pool:
+        await read_pool.close()
+        read_pool = None
+
+async def load_website_files(website_id: int) -> dict[str, str]:
+    async with borrow_connection(db_pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_website_files', {'website_id': website_id})
+            return dict(await cur.fetchall())
+
+
+async def save_published_files(website_id: int, manifest: list[dict]):
+    # the website's files are replaced all at once, so readers never see half of a publish
+    async with borrow_connection(db_pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'delete_published_files', {'website_id': website_id})
+            await queries.execute_many(cur, 'insert_published_file', [entry | {'website_id': website_id} for entry in manifest])
+        await conn.commit()
+
+
+async def save_website_thumbnail(website_id: int, thumbnail: Optional[dict]):
+    async with borrow_connection(db_pool) as conn:
+        async with conn.cursor() as cur:
+            if thumbnail:
+                await queries.execute(cur, 'upsert_website_thumbnail', {'website_id': website_id} | thumbnail)
+            else:
+                # the website doesn't have an index page (any more)
+                await queries.execute(cur, 'delete_website_thumbnail', {'website_id': website_id})
+        await conn.commit()
+
+
+publisher = Publisher(load_website_files, save_published_files, save_website_thumbnail)
+
+
+async def write_audit_events(events: list[AuditEvent]):
+    # the batch is copied in, and its views added to the daily counts, in one transaction. if the log goes
+    # to a file, it's written before the views are committed, so a batch the file couldn't take (and
+    # which is written again later) hasn't had its views counted
+    views = view_counts(events)
+    async with borrow_connection(db_pool) as conn:
+        async with conn.cursor() as cur:
+            if not audit_file:
+                async with cur.copy(queries.QUERIES['copy_audit_log']) as copy:
+                    for event in events:
+                        await copy.write_row(event)
+            if views:
+                website_ids, days, counts = zip(*views)
+                await queries.execute(cur, 'add_website_views', {'website_ids': list(website_ids), 'days': list(days), 'views': list(counts)})
+        if audit_file:
+            await audit_file.write(events)
+        await conn.commit()
+
+
+audit_log = AuditLog(write_audit_events, capacity=AUDIT_BUFFER_SIZE, batch_size=AUDIT_BATCH_SIZE, interval=AUDIT_FLUSH_SECONDS)
+
+
+async def save_website_stats(viewers: dict[int, HyperLogLog]):
+    website_ids = sorted(viewers)
+    async with borrow_connection(db_pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'add_website_stats', {
+                'website_ids': website_ids,
+                'viewers': [bytes(viewers[website_id].registers) for website_id in website_ids]
+            })
+        await conn.commit()
+
+
+site_analytics = SiteAnalytics(save_website_stats, interval=ANALYTICS_FLUSH_SECONDS, max_websites=ANALYTICS_MAX_WEBSITES)
+
+
+def record_view(request: Request, website_id: int, filename: str):
+    # viewers are told apart by their address and browser, which are only kept hashed (in a HyperLogLog)
+    address = request.headers.get(CLIENT_IP_HEADER) if CLIENT_IP_HEADER else None
+    if not address:
+        address = request.client.host if request.client else ''
+    audit_log.record('view', website_id=website_id, detail=filename)
+    site_analytics.record(website_id, f'{address} {request.headers.get("user-agent", "")}')
 
 app = FastAPI(lifespan=lifespan)
 
+# the server is a single shared CPU with 256 MB of memory, so work is admitted
+# in bounded amounts rather than queueing without limit. logging in, registering and
+# creating camps are tight because bcrypt is CPU-bound, and the health check is never shed.
+# a camp's other routes (eg. /camp/1/export) are the longer prefix, so they share the default limit
+DEFAULT_LIMIT = ConcurrencyLimit(concurrency=20, queue_timeout=1)
+ROUTE_LIMITS = {
+    '/login': ConcurrencyLimit(concurrency=2, queue_timeout=2),
+    '/register': ConcurrencyLimit(concurrency=2, queue_timeout=2),
+    '/camp': ConcurrencyLimit(concurrency=1, queue_timeout=2),
+    '/camp/': DEFAULT_LIMIT,
+    '/healthcheck': ConcurrencyLimit(concurrency=50, queue_timeout=1, sheddable=False),
+}
+
+app.add_middleware(AdmissionMiddleware, limits=ROUTE_LIMITS, default_limit=DEFAULT_LIMIT, detector=overload)
+
 origins = [
     "https://webdevcamp.day"
 ]
@@ -75,16 +348,74 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(CompressionMiddleware, minimum_size=500)
+# outermost, so that a request is counted from when it arrives until its response is sent
+app.add_middleware(DrainMiddleware, drainer=drainer)
+
+
+@asynccontextmanager
+async def borrow_connection(pool: AsyncConnectionPool):
+    # how long the pool takes to hand over a connection is one of the signals used to shed load
+    start = time.monotonic()
+    async with pool.connection() as conn:
+        overload.record_pool_wait(time.monotonic() - start)
+        yield conn
+
 
 async def get_connection():
-    async with db_pool.connection() as conn:
-        try:
-            yield conn
-        finally:
-            await conn.close()
+    # the connection goes back to the pool afterwards (rather than being closed)
+    # so that the statements it has already prepared can be reused
+    async with borrow_connection(db_pool) as conn:
+        yield conn
+
+
+def record_write(username: str):
+    '''
+    Sends the user's reads to the primary for the next REPLICA_STICKY_SECONDS, so that they see their own writes.
+
+    Args:
+        username (str): The user who just committed a write.
+    '''
+
+    now = time.monotonic()
+    recent_writes[username] = now
+    # forget users whose window has passed, so the dict only holds recent writers
+    if len(recent_writes) > 1000:
+        for expired in [u for u, t in recent_writes.items() if now - t > REPLICA_STICKY_SECONDS]:
+            del recent_writes[expired]
+
+
+def wrote_recently(username: Optional[str]) -> bool:
+    if username is None or username not in recent_writes:
+        return False
+    return time.monotonic() - recent_writes[username] <= REPLICA_STICKY_SECONDS
+
+
+def get_token_username(token: Optional[str]) -> Optional[str]:
+    if token is None:
+        return None
+    try:
+        return token_verifier.decode(token).get('sub')
+    except JWTError:
+        return None
+
+
+def get_read_pool(token: Optional[str]) -> AsyncConnectionPool:
+    # reads go to the replica if there is one, unless the reader has just written
+    # something - the replica may not have it yet
+    if read_pool is None or (recent_writes and wrote_recently(get_token_username(token))):
+        return db_pool
+    return read_pool
+
+
+async def get_read_connection(token: Annotated[Optional[str], Depends(optional_oauth2_scheme)]):
+    async with borrow_connection(get_read_pool(token)) as conn:
+        yield conn
 
 
 def verify_password(plain_password: str, hashed_password, registration_time: datetime):
+    if hashed_password == LOCKED_PASSWORD:
+        return False
     salted_password = plain_password + str(registration_time)
     return pwd_context.verify(salted_password, hashed_password)
 
@@ -95,9 +426,7 @@ def get_password_hash(password, registration_time: datetime):
 
 async def get_user_from_username(username: str, conn: AsyncConnection) -> Optional[UserInDB]:
     async with conn.cursor() as cur:
-        await cur.execute('''
-                        select * from get_user_from_username(%(username)s)
-                    ''', {'username': username})
+        await queries.execute(cur, 'get_user_from_username', {'username': username})
         user_data = await cur.fetchone()
         if not user_data:
             return None
@@ -120,9 +449,7 @@ async def get_user_from_username(username: str, conn: AsyncConnection) -> Option
 
 async def get_user_from_email(email: str, conn: AsyncConnection) -> Optional[UserInDB]:
     async with conn.cursor() as cur:
-        await cur.execute('''
-                        select get_user_from_email(%(email)s)
-                    ''', {'email': email})
+        await queries.execute(cur, 'get_user_from_email', {'email': email})
         user_data: UserInDB = await cur.fetchone()
         if not user_data:
             return None
@@ -132,9 +459,7 @@ async def get_user_from_email(email: str, conn: AsyncConnection) -> Optional[Use
 
 async def get_user_type(id: int, conn: AsyncConnection) -> Optional[StudentOrAdministrator]:
     async with conn.cursor() as cur:
-        await cur.execute('''
-                        select * from get_user_type(%(id)s)
-                    ''', {'id': id})
+        await queries.execute(cur, 'get_user_type', {'id': id})
         res = await cur.fetchone()
         user_type = res[0]
         if not user_type:
@@ -146,9 +471,12 @@ async def get_user_type(id: int, conn: AsyncConnection) -> Optional[StudentOrAdm
 async def authenticate_user(username: str, password: str, conn: AsyncConnection):
     user: UserInDB = await get_user_from_username(username, conn)
     if not user:
+        audit_log.record('login_failed', detail=username)
         return None
     if not verify_password(password, user['hashed_password'], user['registration_time']):
+        audit_log.record('login_failed', account_id=user['account_id'], detail=username)
         return False
+    audit_log.record('login', account_id=user['account_id'])
     return user
 
 
@@ -160,7 +488,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], conn:
     )
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_verifier.decode(token)
         # 'sub' is the subject of the JWT token
         # user identification is typically stored as the subject
         username: str = payload.get('sub')
@@ -196,25 +524,241 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({'exp': expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = token_verifier.encode(to_encode)
     return encoded_jwt
 
 
+def create_jittered_access_token(username: str) -> tuple[str, int]:
+    '''
+    Creates an access token for a user, expiring a random amount of time before ACCESS_TOKEN_EXPIRE_MINUTES is up.
+
+    Args:
+        username (str): The user the access token is for.
+
+    Returns:
+        tuple[str, int]: The encoded access token, and the number of seconds until it expires.
+    '''
+
+    expires_delta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES) * random.uniform(1 - ACCESS_TOKEN_EXPIRE_JITTER, 1)
+    access_token = create_access_token(data={'sub': username}, expires_delta=expires_delta)
+    return access_token, int(expires_delta.total_seconds())
+
+
+def hash_refresh_token(refresh_token: str) -> str:
+    # refresh tokens are random and long, so unlike passwords they don't need a slow hash
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
 @app.get('/items/')
 async def read_items(token: Annotated[str, Depends(oauth2_scheme)]):
     return {'token': token}
 
 
+async def fetch_website(pool: AsyncConnectionPool, website_id: int) -> Optional[tuple]:
+    async with borrow_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_website', {'website_id': website_id})
+            return await cur.fetchone()
+
+
+async def fetch_webpage(pool: AsyncConnectionPool, website_id: int, filename: str) -> Optional[tuple]:
+    async with borrow_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_webpage', {'website_id': website_id, 'filename': filename})
+            return await cur.fetchone()
+
+
 @app.get('/website/{website_id}')
-async def get_website(website_id: int, conn: AsyncConnection = Depends(get_connection)):
-    async with conn.cursor() as cur:
-        cur.execute('''
-                    select  title
-                    from    websites
-                    where   id = %s
-                ''', (website_id))
-        website_data = cur.fetchone()
-        return website_data
+async def get_website(website_id: int, token: Annotated[Optional[str], Depends(optional_oauth2_scheme)], if_none_match: Annotated[Optional[str], Header()] = None):
+    # connections are borrowed inside the shared read, so requests that are
+    # coalesced into it don't take one from the pool at all
+    pool = get_read_pool(token)
+    website_data = await website_reads.do((website_id, pool is db_pool), lambda: fetch_website(pool, website_id))
+    if not website_data:
+        raise HTTPException(
+            status_code=404, detail='Website does not exist.')
+
+    # the row's xmin changes whenever it's updated, so it doubles as a version
+    etag = weak_etag('website', website_id, website_data[1])
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={'ETag': etag})
+    return JSONResponse({'website_id': website_id, 'title': website_data[0]}, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
+
+async def webpages_contents(pool: AsyncConnectionPool, webpage_ids: list[int], sizes: list[int]) -> AsyncIterator[bytes]:
+    # the response outlives the request's connection, and a slow download would keep one of its own for as long
+    # as it takes. so each chunk of files is read with a connection that goes back to the pool before it's sent
+    position = 0
+    while position < len(sizes):
+        count, chunk_bytes = 1, sizes[position]
+        while position + count < len(sizes) and chunk_bytes + sizes[position + count] <= EXPORT_CHUNK_BYTES:
+            chunk_bytes += sizes[position + count]
+            count += 1
+        async with borrow_connection(pool) as conn:
+            async with conn.cursor() as cur:
+                await queries.execute(cur, 'get_webpages_contents', {'webpage_ids': webpage_ids[position:position + count]})
+                rows = await cur.fetchall()
+        for (contents,) in rows:
+            yield contents.encode()
+        # a file that's been deleted since is missing, which the zip notices
+        if len(rows) < count:
+            return
+        position += count
+
+
+def export_response(pool: AsyncConnectionPool, rows: list[tuple], path: Callable[[tuple], tuple[str, ...]], filename: str, range_header: Optional[str], if_range: Optional[str]) -> Response:
+    '''
+    Sends a zip of exported files, or the range of it that was asked for.
+
+    Args:
+        pool (AsyncConnectionPool): The pool to read the files' contents from.
+        rows (list[tuple]): The files, from one of the export queries.
+        path (Callable): Gives the parts of a file's path in the zip, from its row.
+        filename (str): What the zip is downloaded as.
+        range_header (str | None): The request's Range header, if it has one.
+        if_range (str | None): The request's If-Range header, if it has one.
+
+    Returns:
+        Response: The zip (or part of it), or a 416 if the range is past its end.
+    '''
+
+    files = [row for row in rows if row[3] is not None]
+    layout = ZipLayout([ZipEntry(archive_path(*path(row)), row[5], row[6]) for row in files])
+    headers = {'Accept-Ranges': 'bytes', 'ETag': layout.etag, 'Content-Disposition': f'attachment; filename="{filename}"'}
+
+    # a download is only resumed if the zip hasn't changed since it started, otherwise the whole zip is sent again
+    try:
+        byte_range = parse_range(range_header, layout.length) if if_range in (None, layout.etag) else None
+    except ValueError:
+        return Response(status_code=416, headers={'Content-Range': f'bytes */{layout.length}'})
+    start, end = byte_range or (0, layout.length)
+    headers['Content-Length'] = str(end - start)
+    if byte_range:
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{layout.length}'
+
+    # only the files in the range are read
+    read = layout.files_in(start, end)
+    contents = webpages_contents(pool, [files[index][3] for index in read], [files[index][5] for index in read])
+    return StreamingResponse(layout.stream(start, end, contents), status_code=206 if byte_range else 200,
+                             media_type='application/zip', headers=headers)
+
+
+# before /website/{website_id}/{filename}, which would otherwise take this path for a file called export
+@app.get('/website/{website_id}/export')
+async def export_website(website_id: int, token: Annotated[Optional[str], Depends(optional_oauth2_scheme)], range_header: Annotated[Optional[str], Header(alias='Range')] = None, if_range: Annotated[Optional[str], Header()] = None):
+    """
+    Downloads a website's files as a zip. Downloads can be resumed with a Range request.
+
+    Returns:
+        StreamingResponse: The zip, or the range of it asked for.
+    """
+    pool = get_read_pool(token)
+    async with borrow_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_website_export', {'website_id': website_id})
+            rows = await cur.fetchall()
+    if not rows:
+        raise HTTPException(
+            status_code=404, detail='Website does not exist.')
+
+    folder = website_folder(rows[0][1], rows[0][2])
+    return export_response(pool, rows, lambda row: (folder, row[4]), f'{folder}.zip', range_header, if_range)
+
+
+@app.get('/student/{student_id}/export')
+async def export_student(student_id: int, token: Annotated[Optional[str], Depends(optional_oauth2_scheme)], range_header: Annotated[Optional[str], Header(alias='Range')] = None, if_range: Annotated[Optional[str], Header()] = None):
+    """
+    Downloads all of a student's websites as a zip, with a folder for each. Downloads can be resumed with a Range request.
+
+    Returns:
+        StreamingResponse: The zip, or the range of it asked for.
+    """
+    pool = get_read_pool(token)
+    async with borrow_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_student_export', {'student_id': student_id})
+            rows = await cur.fetchall()
+    if not rows:
+        raise HTTPException(
+            status_code=404, detail='Student does not exist.')
+
+    # usernames can have any characters in them, which a header can't
+    return export_response(pool, rows, lambda row: (website_folder(row[1], row[2]), row[4]), f'{slugify(rows[0][0], "student")}.zip', range_header, if_range)
+
+
+# also before /website/{website_id}/{filename}
+@app.get('/website/{website_id}/stats')
+async def get_website_stats(website_id: int, conn: AsyncConnection = Depends(get_connection)) -> WebsiteStats:
+    """
+    Counts a website's hits (ie. page views) and estimates its unique viewers, including those not yet saved to the database.
+
+    Returns:
+        WebsiteStats: The website's hits and unique viewers, since it was made.
+    """
+    # the primary is asked, rather than a replica, so counts that were just saved aren't missing from both
+    async with conn.pipeline():
+        async with conn.cursor() as website_cur, conn.cursor() as cur:
+            await queries.execute(website_cur, 'get_website', {'website_id': website_id})
+            await queries.execute(cur, 'get_website_stats', {'website_id': website_id})
+            website = await website_cur.fetchone()
+            saved = await cur.fetchone()
+    if not website:
+        raise HTTPException(
+            status_code=404, detail='Website does not exist.')
+
+    saved_hits, saved_viewers = saved
+    viewers = site_analytics.unsaved(website_id)
+    if saved_viewers:
+        viewers.merge(HyperLogLog(saved_viewers))
+    return WebsiteStats(website_id=website_id, hits=saved_hits + audit_log.unwritten_views(website_id), unique_viewers=viewers.count())
+
+
+@app.get('/website/{website_id}/views')
+async def get_website_views(website_id: int, days: int = 30, conn: AsyncConnection = Depends(get_read_connection)) -> WebsiteViews:
+    """
+    Counts a website's page views on each of the last few days. Views are counted in batches, so the latest few seconds' aren't included yet.
+
+    Parameters:
+        days: How many days to count, including today (in UTC), up to 366.
+
+    Returns:
+        WebsiteViews: The website's views on each day it had any, and their total.
+    """
+    if not 0 < days <= VIEWS_MAX_DAYS:
+        raise HTTPException(
+            status_code=400, detail=f'Views can be counted for up to {VIEWS_MAX_DAYS} days.')
+
+    async with conn.pipeline():
+        async with conn.cursor() as website_cur, conn.cursor() as cur:
+            await queries.execute(website_cur, 'get_website', {'website_id': website_id})
+            await queries.execute(cur, 'get_website_views', {'website_id': website_id, 'days': days})
+            website = await website_cur.fetchone()
+            rows = await cur.fetchall()
+    if not website:
+        raise HTTPException(
+            status_code=404, detail='Website does not exist.')
+
+    return WebsiteViews(website_id=website_id, total=sum(views for _, views in rows),
+                        days=[DailyViews(day=day, views=views) for day, views in rows])
+
+
+@app.get('/website/{website_id}/{filename}')
+async def get_webpage(website_id: int, filename: str, request: Request, token: Annotated[Optional[str], Depends(optional_oauth2_scheme)], if_none_match: Annotated[Optional[str], Header()] = None):
+    pool = get_read_pool(token)
+    webpage_data = await webpage_reads.do((website_id, filename, pool is db_pool), lambda: fetch_webpage(pool, website_id, filename))
+    if not webpage_data:
+        raise HTTPException(
+            status_code=404, detail='Webpage does not exist.')
+
+    media_type = mimetypes.guess_type(filename)[0] or 'text/plain'
+    # only pages count as views, not the stylesheets and scripts they load
+    if media_type == 'text/html':
+        record_view(request, website_id, filename)
+
+    etag = weak_etag('webpage', webpage_data[2], webpage_data[1])
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={'ETag': etag})
+    return Response(content=webpage_data[0], media_type=media_type, headers={'ETag': etag, 'Cache-Control': 'no-cache'})
 
 
 class websiteIDModel(BaseModel):
@@ -223,44 +767,157 @@ class websiteIDModel(BaseModel):
 
 @app.post('/website')
 async def create_website(website: ProposedWebsite, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)):
-    owner_type = await get_user_type(current_user['account_id'], conn)
-    async with conn.cursor() as cur:
-        try:
-            res = await cur.execute('''
-                insert into website (title)
-                values (%(title)s)
-                returning id;
-            ''', {'title': website.title})
-
-            res = await res.fetchone()
-            website_id = res[0]
+    # the owner's type and the new website don't depend on each other,
+    # so both statements are sent to the database in the same flush
+    async with conn.pipeline():
+        async with conn.cursor() as type_cur, conn.cursor() as cur:
+            await queries.execute(type_cur, 'get_user_type', {'id': current_user['account_id']})
             try:
-                await cur.execute(sql.SQL('''
-                    insert into {owner_type}_Owns_Website ({owner_type}_id, website_id)
-                    values ({owner_id}, {website_id})
-                ''').format(
-                    owner_type=sql.SQL(owner_type),
-                    owner_id=sql.Literal(current_user['account_id']),
-                    website_id=sql.Literal(website_id)
-                ))
-
-                await conn.commit()
-                return {'website_id': website_id}
-            except IntegrityError as e:
-                if 'not present' in e.diag.message_detail:
-                    raise HTTPException(
-                        status_code=400, detail=f'The user does not exist or they are not a {owner_type}.')
-                else:
-                    raise HTTPException(status_code=400, detail=e)
+                await queries.execute(cur, 'insert_website', {'title': website.title})
+
+                owner_type = (await type_cur.fetchone())[0]
+                website_id = (await cur.fetchone())[0]
+                try:
+                    await queries.execute(cur, f'insert_{owner_type}_owns_website', {
+                        'owner_id': current_user['account_id'],
+                        'website_id': website_id
+                    })
+                    await queries.execute(type_cur, 'add_website_usage', {'account_id': current_user['account_id']})
+                    if (await type_cur.fetchone())[0] > STORAGE_LIMITS[owner_type].websites:
+                        await conn.rollback()
+                        raise HTTPException(
+                            status_code=403, detail=f'Website limit reached ({STORAGE_LIMITS[owner_type].websites} websites).')
+
+                    await conn.commit()
+                    record_write(current_user['username'])
+                    audit_log.record('create_website', account_id=current_user['account_id'], website_id=website_id)
+                    return {'website_id': website_id}
+                except IntegrityError as e:
+                    if 'not present' in e.diag.message_detail:
+                        raise HTTPException(
+                            status_code=400, detail=f'The user does not exist or they are not a {owner_type}.')
+                    else:
+                        raise HTTPException(status_code=400, detail=e)
+
+            except IntegrityError:
+                raise HTTPException(
+                    status_code=400, detail='Website already exists.')
+
+
+# the body is parsed by hand, after the quota's been checked, so its schema is given here for the docs
+@app.post('/website/{website_id}', openapi_extra={'requestBody': {'required': True, 'content': {'multipart/form-data': {'schema': {
+    'type': 'object', 'required': ['webpage'], 'properties': {'webpage': {'type': 'string', 'format': 'binary'}}}}}}})
+async def upload_webpage(website_id: int, request: Request, content_length: Annotated[Optional[int], Header()] = None, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)):
+    """
+    Uploads a webpage (as the multipart form field 'webpage') to a website the user owns, replacing any with the same filename.
 
-        except IntegrityError:
-            raise HTTPException(
-                status_code=400, detail='Website already exists.')
+    Uploads that can't fit in the user's storage quota are turned away using their Content-Length,
+    before their body is read.
 
+    Returns:
+        dict: The webpage's ID.
+    """
+    if content_length is None:
+        raise HTTPException(
+            status_code=411, detail='Uploads must have a Content-Length.')
 
-@app.post('/website/{website_id}')
-async def upload_webpage(website_id: int, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)):
-    return {'webpage_id': 5}
+    account_id = current_user['account_id']
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'get_upload_allowance', {'account_id': account_id, 'website_id': website_id})
+        account_type, used_bytes, largest_file = await cur.fetchone()
+    if account_type is None:
+        raise HTTPException(
+            status_code=403, detail='Only students and administrators can upload webpages.')
+    limits = STORAGE_LIMITS[account_type]
+    # the upload might replace the website's largest file, which would free its space
+    allowance = min(MAX_WEBPAGE_BYTES, limits.bytes - used_bytes + largest_file)
+    if content_length > allowance + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(
+            status_code=413, detail=f'Upload is too large. Webpages can be up to {MAX_WEBPAGE_BYTES} bytes, and {max(0, limits.bytes - used_bytes)} bytes of storage are left.')
+
+    form = await request.form(max_files=1, max_fields=0)
+    webpage = form.get('webpage')
+    if not isinstance(webpage, UploadFile):
+        raise HTTPException(
+            status_code=422, detail='Uploads must have a file in the webpage field.')
+    raw_contents = await webpage.read()
+    try:
+        contents = raw_contents.decode('utf-8')
+    except UnicodeDecodeError:
+        raise HTTPException(
+            status_code=400, detail='Webpages must be UTF-8 text.')
+
+    # parsing a big page's HTML takes a while, so it's done in a thread
+    text = await asyncio.to_thread(searchable_text, webpage.filename, contents)
+
+    # the usage row is locked before it's updated, so the size of the file being replaced
+    # is read after any concurrent upload by the same user has committed
+    async with conn.pipeline():
+        async with conn.cursor() as lock_cur, conn.cursor() as usage_cur, conn.cursor() as cur:
+            await queries.execute(lock_cur, 'lock_storage_usage', {'account_id': account_id})
+            await queries.execute(usage_cur, 'add_webpage_usage', {
+                'account_id': account_id,
+                'website_id': website_id,
+                'filename': webpage.filename,
+                'size': len(raw_contents)
+            })
+            await queries.execute(cur, 'upsert_owned_webpage', {
+                'website_id': website_id,
+                'title': webpage.filename,
+                'filename': webpage.filename,
+                'contents': contents,
+                'crc32': zlib.crc32(raw_contents),
+                'text': text,
+                'owner_id': account_id
+            })
+            used_bytes, used_files = await usage_cur.fetchone()
+            res = await cur.fetchone()
+
+    if not res:
+        await conn.rollback()
+        raise HTTPException(
+            status_code=403, detail='The website does not exist or the user does not own it.')
+    if len(raw_contents) > MAX_WEBPAGE_BYTES or used_bytes > limits.bytes:
+        await conn.rollback()
+        raise HTTPException(
+            status_code=413, detail=f'Upload is too large. Webpages can be up to {MAX_WEBPAGE_BYTES} bytes, and accounts can store up to {limits.bytes} bytes.')
+    if used_files > limits.files:
+        await conn.rollback()
+        raise HTTPException(
+            status_code=403, detail=f'File limit reached ({limits.files} files).')
+
+    await conn.commit()
+    record_write(current_user['username'])
+    publisher.request(website_id)
+    return {'webpage_id': res[0]}
+
+
+@app.get('/usage')
+async def get_storage_usage(current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)) -> StorageReport:
+    """
+    Reports how much storage an administrator and each of their students are using, and their limits.
+
+    Returns:
+        StorageReport: The administrator's usage, and their students' usage.
+    """
+    async with conn.pipeline():
+        async with conn.cursor() as type_cur, conn.cursor() as cur, conn.cursor() as students_cur:
+            await queries.execute(type_cur, 'get_upload_allowance', {'account_id': current_user['account_id'], 'website_id': None})
+            await queries.execute(cur, 'get_storage_usage', {'account_id': current_user['account_id']})
+            await queries.execute(students_cur, 'get_students_storage_usage', {'account_id': current_user['account_id']})
+            account_type = (await type_cur.fetchone())[0]
+            administrator = await cur.fetchone()
+            students = await students_cur.fetchall()
+
+    if account_type != 'administrator':
+        raise HTTPException(
+            status_code=403, detail='Only administrators can see storage usage.')
+
+    def usage(row: tuple, account_type: str) -> StorageUsage:
+        account_id, username, bytes, files, websites = row
+        return StorageUsage(account_id=account_id, username=username, bytes=bytes, files=files, websites=websites, limits=STORAGE_LIMITS[account_type])
+
+    return StorageReport(administrator=usage(administrator, 'administrator'), students=[usage(student, 'student') for student in students])
 
 
 @app.post('/login')
@@ -283,14 +940,59 @@ async def login_endpoint(user_data: LoggingInUser, conn: AsyncConnection = Depen
             headers={'WWW-Authenticate': 'Bearer'}
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token, expires_in = create_jittered_access_token(user['username'])
+
+    # each login starts a new family of refresh tokens
+    refresh_token = secrets.token_urlsafe(32)
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'insert_refresh_token', {
+            'account_id': user['account_id'],
+            'family': secrets.token_hex(16),
+            'token_hash': hash_refresh_token(refresh_token),
+            'lifetime': timedelta(hours=REFRESH_TOKEN_EXPIRE_HOURS)
+        })
+    await conn.commit()
 
-    access_token: str = create_access_token(
-        data={'sub': user['username']},
-        expires_delta=access_token_expires
+    return {'account_id': user['account_id'], 'access_token': access_token, 'refresh_token': refresh_token, 'expires_in': expires_in, 'username': user['username'], 'given_name': user['given_name'], 'family_name': user['family_name'], 'email': user['email'], 'phone_number': user['phone_number']}
+
+
+@app.post('/token/refresh')
+async def refresh_token_endpoint(token_data: RefreshingToken, conn: AsyncConnection = Depends(get_connection)) -> RefreshedToken:
+    """
+    Exchanges a refresh token for a new access token and a new refresh token, without needing the user's password.
+
+    Parameters:
+        RefreshingToken: The refresh token, which can only be used once.
+
+    Returns:
+        RefreshedToken: A dictionary containing the new access token and refresh token.
+    """
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail='Invalid refresh token',
+        headers={'WWW-Authenticate': 'Bearer'},
     )
 
-    return {'account_id': user['account_id'], 'access_token': access_token, 'username': user['username'], 'given_name': user['given_name'], 'family_name': user['family_name'], 'email': user['email'], 'phone_number': user['phone_number']}
+    token_hash = hash_refresh_token(token_data.refresh_token)
+    refresh_token = secrets.token_urlsafe(32)
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'rotate_refresh_token', {
+            'token_hash': token_hash,
+            'new_token_hash': hash_refresh_token(refresh_token)
+        })
+        res = await cur.fetchone()
+
+        if not res:
+            await queries.execute(cur, 'revoke_reused_refresh_token', {'token_hash': token_hash})
+            if await cur.fetchone():
+                logger.warning('Refresh token reused; revoked its family.')
+            await conn.commit()
+            raise credentials_exception
+
+        await conn.commit()
+
+    access_token, expires_in = create_jittered_access_token(res[0])
+    return {'access_token': access_token, 'refresh_token': refresh_token, 'expires_in': expires_in}
 
 
 @app.post('/register/student')
@@ -298,73 +1000,63 @@ async def register_student_endpoint(user_data: RegisteringStudentRequest, conn:
     if user_data.user.account_type != 'student':
         raise HTTPException(
             status_code=400, detail='Only students may register via /register/student. Use /register.')
-    # check that administrator exists
-    async with conn.cursor() as cur:
-        await cur.execute('''
-            select *
-            from   administrator
-            where  id = %(administrator_id)s
-        ''', {'administrator_id': user_data.administrator_id})
-        administrator = await cur.fetchone()
-        if not administrator:
-            raise HTTPException(
-                status_code=400, detail=f'Administrator {user_data.administrator_id} does not exist.')
 
-    student_id = await create_account(user_data.user, conn)
-    try:
-        async with conn.cursor() as cur:
-            await cur.execute('''
-                insert into Teaches (administrator_id, student_id)
-                values (%(administrator_id)s, %(student_id)s)
-            ''', {'administrator_id': user_data.administrator_id, 'student_id': student_id})
-            await conn.commit()
-            return {'student_id': student_id}
-    except Exception as e:
-        raise HTTPException(
-            status_code=500, detail=str(e)
-        )
+    # the administrator is checked as part of creating the account
+    student_id = await create_account(user_data.user, conn, administrator_id=user_data.administrator_id)
+    await conn.commit()
+    return {'student_id': student_id}
+
+
+async def create_account(user_data: RegisteringUser, conn: AsyncConnection, administrator_id: Optional[int] = None):
+    '''
+    Creates an account, and the student or administrator row that goes with it, without committing.
+
+    Args:
+        user_data (RegisteringUser): The user to create an account for.
+        conn (AsyncConnection): The connection whose transaction the account is created in.
+        administrator_id (int | None, optional): The administrator who teaches the new student. Defaults to None.
+
+    Returns:
+        int: The new account's ID.
 
+    Raises:
+        HTTPException: If the user already exists, the username is too long, or the administrator does not exist.
+    '''
+
+    account = {'given_name': user_data.given_name,
+               'family_name': user_data.family_name,
+               'username': user_data.username}
 
-async def create_account(user_data: RegisteringUser, conn: AsyncConnection):
     async with conn.cursor() as cur:
         try:
-            await cur.execute('''
-                    insert into account (given_name, family_name, hashed_password, username)
-                    values (%(given_name)s, %(family_name)s, 'temp', %(username)s)
-                    returning id, registration_time;
-                ''', {'given_name': user_data.given_name,
-                      'family_name': user_data.family_name,
-                      'username': user_data.username})
-
-            response = await cur.fetchall()
-            account_id = response[0][0]
-            registration_time: datetime = response[0][1]
+            if administrator_id is None:
+                await queries.execute(cur, 'insert_account', account)
+            else:
+                await queries.execute(cur, 'insert_taught_account', account | {'administrator_id': administrator_id})
+
+            response = await cur.fetchone()
+            if not response:
+                raise HTTPException(
+                    status_code=400, detail=f'Administrator {administrator_id} does not exist.')
+            account_id = response[0]
+            registration_time: datetime = response[1]
 
             # insert hashed password now that registration time is known
-            user_data.hashed_password = get_password_hash(
+            hashed_password = get_password_hash(
                 user_data.hashed_password,
                 registration_time
             )
 
-            await conn.commit()
-
-            await cur.execute('''
-                    update account
-                    set hashed_password = %(hashed_password)s
-                    where id = %(account_id)s
-                ''', {'account_id': account_id, 'hashed_password': user_data.hashed_password})
-
-            await conn.commit()
+            # none of the remaining statements return anything,
+            # so they can all go to the database in one flush
+            async with conn.pipeline():
+                await queries.execute(cur, 'set_hashed_password', {'account_id': account_id, 'hashed_password': hashed_password})
+                await queries.execute(cur, f'insert_{user_data.account_type.value}', {'account_id': account_id})
+                if administrator_id is not None:
+                    await queries.execute(cur, 'insert_teaches', {'administrator_id': administrator_id, 'student_id': account_id})
 
-            async with conn.cursor() as cur2:
-                await cur2.execute(
-                    sql.SQL('''
-                        insert into {} (id)
-                        values (%s)
-                    ''').format(sql.Identifier(user_data.account_type)), [account_id])
-                await conn.commit()
-
-                return account_id
+            audit_log.record('register', account_id=account_id, detail=user_data.account_type.value)
+            return account_id
 
         except IntegrityError as e:
             raise HTTPException(
@@ -377,10 +1069,7 @@ async def create_account(user_data: RegisteringUser, conn: AsyncConnection):
 async def register_full_account(user_data: RegisteringFullUserRequest, conn: AsyncConnection):
     async with conn.cursor() as cur:
         try:
-            await cur.execute('''
-                    insert into Full_Account (id, email, phone_number)
-                    values (%(id)s, %(email)s, %(phone_number)s)
-                ''', {'id': user_data['id'], 'email': user_data['user'].email, 'phone_number': user_data['user'].phone_number})
+            await queries.execute(cur, 'insert_full_account', {'id': user_data['id'], 'email': user_data['user'].email, 'phone_number': user_data['user'].phone_number})
             await conn.commit()
         except UniqueViolation:
             raise HTTPException(
@@ -393,8 +1082,15 @@ async def register_full_account_endpoint(user_data: RegisteringFullUser, conn: A
         raise HTTPException(
             status_code=400, detail='Students cannot register via /register. Use /register/student.')
 
-    # if either function returns a value other than None, the user exists
-    if (await get_user_from_username(user_data.username, conn) or await get_user_from_email(user_data.email, conn)):
+    # if either lookup returns a row, the user exists
+    # both lookups are sent before either result is waited on
+    async with conn.pipeline():
+        async with conn.cursor() as username_cur, conn.cursor() as email_cur:
+            await queries.execute(username_cur, 'get_user_from_username', {'username': user_data.username})
+            await queries.execute(email_cur, 'get_user_from_email', {'email': user_data.email})
+            user_exists = await username_cur.fetchone() or await email_cur.fetchone()
+
+    if user_exists:
         raise HTTPException(
             status_code=400, detail='User already exists.'
         )
@@ -408,6 +1104,357 @@ async def register_full_account_endpoint(user_data: RegisteringFullUser, conn: A
         return {'account_id': account_id}
 
 
+async def get_administrators_camp(camp_id: int, current_user: UserInDB, conn: AsyncConnection) -> tuple:
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'get_camp', {'camp_id': camp_id, 'administrator_id': current_user['account_id']})
+        camp = await cur.fetchone()
+    if not camp:
+        raise HTTPException(
+            status_code=404, detail='The camp does not exist or the user does not run it.')
+    return camp
+
+
+@app.post('/camp')
+async def create_camp(camp: ProposedCamp, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)) -> CreatedCamp:
+    """
+    Creates a camp, and logins for all of its students, who are taught by the administrator creating it.
+
+    Parameters:
+        ProposedCamp: The camp's title, how many students it has, and the prefix for their usernames.
+
+    Returns:
+        CreatedCamp: The camp's ID, and each student's username and password. The passwords aren't shown again.
+    """
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'is_administrator', {'account_id': current_user['account_id']})
+        if not (await cur.fetchone())[0]:
+            raise HTTPException(
+                status_code=403, detail='Only administrators can create camps.')
+
+    # every student shares a registration time, so their passwords can all be hashed before any
+    # account exists. bcrypt releases the GIL, so the hashes are worked out in threads, a few at a time
+    registration_time = datetime.now()
+    passwords = [''.join(secrets.choice(CAMP_PASSWORD_ALPHABET) for _ in range(CAMP_PASSWORD_LENGTH))
+                 for _ in range(camp.students)]
+    hashing = asyncio.Semaphore(CAMP_HASHING_THREADS)
+
+    async def hash_password(password: str) -> str:
+        async with hashing:
+            return await asyncio.to_thread(get_password_hash, password, registration_time)
+
+    hashed_passwords = await asyncio.gather(*map(hash_password, passwords))
+
+    async with conn.cursor() as cur:
+        try:
+            await queries.execute(cur, 'insert_camp', {
+                'administrator_id': current_user['account_id'],
+                'title': camp.title,
+                'username_prefix': camp.username_prefix,
+                'registration_time': registration_time,
+                'hashed_passwords': hashed_passwords
+            })
+            rows = await cur.fetchall()
+        except IntegrityError:
+            await conn.rollback()
+            raise HTTPException(
+                status_code=400, detail='Some of the usernames are taken. Try another prefix.')
+    await conn.commit()
+    record_write(current_user['username'])
+
+    return CreatedCamp(camp_id=rows[0][0], title=camp.title, students=[
+        CampLogin(student_id=student_id, username=username, password=passwords[number - 1])
+        for _, student_id, username, number in rows
+    ])
+
+
+@app.get('/camp/{camp_id}/export')
+async def export_camp(camp_id: int, token: Annotated[str, Depends(oauth2_scheme)], range_header: Annotated[Optional[str], Header(alias='Range')] = None, if_range: Annotated[Optional[str], Header()] = None):
+    """
+    Downloads every website made at a camp as a zip, with a folder for each student and one inside it for each of their websites.
+
+    Returns:
+        StreamingResponse: The zip, or the range of it asked for.
+    """
+    # the connection (or the user, which needs one) isn't a dependency, since those are only
+    # given back once the response has been sent, which for a big zip could be a long time
+    async with borrow_connection(db_pool) as conn:
+        current_user = await get_current_user(token, conn)
+        title, _, _ = await get_administrators_camp(camp_id, current_user, conn)
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_camp_export', {'camp_id': camp_id})
+            rows = await cur.fetchall()
+    return export_response(db_pool, rows, lambda row: (row[0], website_folder(row[1], row[2]), row[4]),
+                           f'{slugify(title, "camp")}.zip', range_header, if_range)
+
+
+@app.post('/camp/{camp_id}/archive')
+async def archive_camp(camp_id: int, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)):
+    """
+    Archives a camp once it's over. Its students can no longer log in, but their websites stay up.
+
+    Returns:
+        dict: The camp's ID, and how many students were locked out.
+    """
+    await get_administrators_camp(camp_id, current_user, conn)
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'archive_camp', {'camp_id': camp_id})
+        await conn.commit()
+
+        locked_out = 0
+        while True:
+            await queries.execute(cur, 'lock_out_camp_students', {'camp_id': camp_id, 'locked_password': LOCKED_PASSWORD, 'batch_size': CAMP_BATCH_SIZE})
+            batch = await cur.fetchall()
+            await conn.commit()
+            if not batch:
+                break
+            locked_out += len(batch)
+
+    return {'camp_id': camp_id, 'students': locked_out}
+
+
+@app.delete('/camp/{camp_id}')
+async def purge_camp(camp_id: int, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)):
+    """
+    Deletes a camp, its students' accounts, and everything they made. Students are deleted a batch at a time,
+    so if this is interrupted, it can be run again to finish.
+
+    Returns:
+        dict: The camp's ID, and how many students were deleted.
+    """
+    await get_administrators_camp(camp_id, current_user, conn)
+    purged = 0
+    async with conn.cursor() as cur:
+        while True:
+            await queries.execute(cur, 'get_camp_student_batch', {'camp_id': camp_id, 'batch_size': CAMP_BATCH_SIZE})
+            student_ids = [row[0] for row in await cur.fetchall()]
+            if not student_ids:
+                break
+            async with conn.pipeline():
+                for name in queries.PURGE_STUDENTS:
+                    await queries.execute(cur, name, {'student_ids': student_ids})
+            await conn.commit()
+            purged += len(student_ids)
+
+        await queries.execute(cur, 'delete_camp', {'camp_id': camp_id})
+        await conn.commit()
+
+    return {'camp_id': camp_id, 'students': purged}
+
+
+@app.get('/published/{website_id}')
+async def get_publication(website_id: int, conn: AsyncConnection = Depends(get_read_connection)) -> Publication:
+    """
+    Reports what a website's files were optimized into when it was last published, and how many bytes that saves.
+
+    Returns:
+        Publication: Each published file's sizes (before and after minifying, and compressed), and their totals.
+    """
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'get_published_files', {'website_id': website_id})
+        rows = await cur.fetchall()
+    if not rows:
+        raise HTTPException(
+            status_code=404, detail='Website has not been published.')
+
+    files = [PublishedFile(path=path, source=source, media_type=media_type, original_size=original_size, size=size,
+                           gzip_size=gzip_size, brotli_size=brotli_size)
+             for path, source, media_type, original_size, size, gzip_size, brotli_size, _ in rows]
+    original_bytes = sum(file.original_size for file in files)
+    transferred_bytes = sum(min(size for size in (file.size, file.gzip_size, file.brotli_size) if size is not None) for file in files)
+    return Publication(
+        website_id=website_id,
+        published_time=max(row[7] for row in rows),
+        files=files,
+        original_bytes=original_bytes,
+        optimized_bytes=sum(file.size for file in files),
+        transferred_bytes=transferred_bytes,
+        saved_bytes=original_bytes - transferred_bytes
+    )
+
+
+@app.get('/published/{website_id}/{path:path}')
+async def get_published_file(website_id: int, path: str, request: Request, conn: AsyncConnection = Depends(get_read_connection), accept_encoding: Annotated[str, Header()] = '', if_none_match: Annotated[Optional[str], Header()] = None):
+    """
+    Serves a file from a website's latest publish, precompressed if the client accepts it. Files with
+    content-hashed names never change, so they can be cached forever.
+    """
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'get_published_file', {'website_id': website_id, 'path': path})
+        published_file = await cur.fetchone()
+    if not published_file:
+        raise HTTPException(
+            status_code=404, detail='File has not been published.')
+    source, digest, media_type, gzip_size, brotli_size = published_file
+
+    if not publisher.store.exists(digest):
+        # eg. the store was lost with the machine it was on, so it's rebuilt from the database
+        publisher.request(website_id)
+        raise HTTPException(
+            status_code=503, detail='Website is being republished.', headers={'Retry-After': '1'})
+    if media_type.startswith('text/html'):
+        record_view(request, website_id, source)
+
+    etag = weak_etag('published', digest)
+    headers = {
+        'ETag': etag,
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if path != source else 'no-cache',
+        'Vary': 'Accept-Encoding'
+    }
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    available = tuple(encoding for encoding, size in (('br', brotli_size), ('gzip', gzip_size)) if size is not None)
+    encoding = choose_encoding(accept_encoding, available)
+    if encoding and publisher.store.exists(digest, encoding):
+        headers['Content-Encoding'] = encoding
+    else:
+        encoding = None
+    return FileResponse(publisher.store.path(digest, encoding), media_type=media_type, headers=headers)
+
+
+def thumbnail_url(website_id: int, version: str, extension: str) -> str:
+    return f'/thumbnails/{website_id}/{version}.{extension}'
+
+
+@app.get('/thumbnails/{website_id}')
+async def get_latest_thumbnail(website_id: int, conn: AsyncConnection = Depends(get_read_connection)):
+    """
+    Redirects to the thumbnail of the website's latest version. Galleries should link to that instead, since it can be cached forever.
+    """
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'get_website_thumbnail', {'website_id': website_id})
+        thumbnail = await cur.fetchone()
+    if not thumbnail:
+        raise HTTPException(
+            status_code=404, detail='Website does not have a thumbnail.')
+    return Response(status_code=307, headers={'Location': thumbnail_url(website_id, *thumbnail), 'Cache-Control': 'no-cache'})
+
+
+@app.get('/thumbnails/{website_id}/{name}')
+async def get_thumbnail(website_id: int, name: str, conn: AsyncConnection = Depends(get_read_connection), if_none_match: Annotated[Optional[str], Header()] = None):
+    """
+    Serves the thumbnail of a version of a website. A version's thumbnail never changes, so it can be cached forever.
+    """
+    match = THUMBNAIL_NAME.fullmatch(name)
+    if not match:
+        raise HTTPException(
+            status_code=404, detail='Thumbnail does not exist.')
+    version, extension = match.groups()
+    kind = f'thumbnail.{extension}'
+
+    if not publisher.store.exists(version, kind):
+        # the database is only asked about thumbnails that aren't in the store, eg. if the store was
+        # lost with the machine it was on, in which case the website's latest one is rendered again
+        async with conn.cursor() as cur:
+            await queries.execute(cur, 'get_website_thumbnail', {'website_id': website_id})
+            if await cur.fetchone() == (version, extension):
+                publisher.request(website_id)
+                raise HTTPException(
+                    status_code=503, detail='Thumbnail is being rendered.', headers={'Retry-After': '1'})
+        raise HTTPException(
+            status_code=404, detail='Thumbnail does not exist.')
+
+    etag = weak_etag('thumbnail', version, extension)
+    headers = {'ETag': etag, 'Cache-Control': IMMUTABLE_CACHE_CONTROL, 'Content-Security-Policy': THUMBNAIL_CONTENT_SECURITY_POLICY}
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(publisher.store.path(version, kind), media_type=THUMBNAIL_MEDIA_TYPES[extension], headers=headers)
+
+
+@app.get('/camp/{camp_id}/gallery')
+async def get_camp_gallery(camp_id: int, conn: AsyncConnection = Depends(get_read_connection)) -> list[GalleryWebsite]:
+    """
+    Lists every website made at a camp, with where its thumbnail is. The thumbnails can be cached forever,
+    so showing a gallery only costs the browser a request for each thumbnail it hasn't seen before.
+
+    Returns:
+        list[GalleryWebsite]: The camp's websites, by student.
+    """
+    async with conn.pipeline():
+        async with conn.cursor() as exists_cur, conn.cursor() as cur:
+            await queries.execute(exists_cur, 'camp_exists', {'camp_id': camp_id})
+            await queries.execute(cur, 'get_camp_gallery', {'camp_id': camp_id})
+            exists = (await exists_cur.fetchone())[0]
+            rows = await cur.fetchall()
+    if not exists:
+        raise HTTPException(
+            status_code=404, detail='Camp does not exist.')
+
+    return [GalleryWebsite(website_id=website_id, title=title, username=username,
+                           thumbnail=thumbnail_url(website_id, version, extension) if version else None)
+            for website_id, title, username, version, extension in rows]
+
+
+@app.get('/search')
+async def search(q: str, limit: int = 20, current_user: UserInDB = Depends(get_current_user), conn: AsyncConnection = Depends(get_connection)) -> list[SearchResult]:
+    """
+    Searches the websites the user can see, by their title, their owner's username and the text of their webpages.
+
+    Parameters:
+        q: What to search for. Quoted phrases, 'or' and '-' (for excluding words) are understood.
+        limit: The most results to return, up to 100.
+
+    Returns:
+        list[SearchResult]: The matching websites and webpages, best first. Matches on a website's
+        title or owner have no filename.
+    """
+    query = q.strip()
+    if not query or not 0 < limit <= SEARCH_MAX_RESULTS:
+        raise HTTPException(
+            status_code=400, detail=f'Searches need some text, and can return up to {SEARCH_MAX_RESULTS} results.')
+
+    # usernames are matched by prefix without trigrams, so the query mustn't be read as a pattern
+    username_prefix = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    async with conn.cursor() as cur:
+        await queries.execute(cur, 'search' if search_trigrams else 'search_without_trigrams', {
+            'account_id': current_user['account_id'],
+            'query': query,
+            'username_prefix': username_prefix,
+            'limit': limit
+        })
+        return [SearchResult(website_id=website_id, title=title, owner_username=owner_username, filename=filename, rank=rank)
+                for website_id, title, owner_username, filename, rank in await cur.fetchall()]
+
+
+def require_profiler_token(x_profiler_token: Annotated[Optional[str], Header()] = None):
+    if not PROFILER_TOKEN:
+        raise HTTPException(status_code=404, detail='Not Found')
+    if x_profiler_token is None or not secrets.compare_digest(x_profiler_token, PROFILER_TOKEN):
+        raise HTTPException(
+            status_code=403, detail='Invalid profiler token.')
+
+
+@app.get('/debug/loop', dependencies=[Depends(require_profiler_token)])
+def loop_stats():
+    return {
+        'lag_ms': round(lag_monitor.lag * 1000, 1),
+        'max_lag_ms': round(lag_monitor.max_lag * 1000, 1),
+        'stalls': list(blocking_watchdog.stalls)
+    }
+
+
+@app.get('/debug/profile', dependencies=[Depends(require_profiler_token)])
+async def profile(seconds: float = 10, interval_ms: float = 5):
+    """
+    Samples the event loop's stack for a while, and returns what it was doing in the collapsed-stack format
+    flame graph tools read (eg. flamegraph.pl, speedscope).
+
+    Parameters:
+        seconds: How long to sample for, up to a minute.
+        interval_ms: How long to wait between samples.
+
+    Returns:
+        str: One line per distinct stack, with the number of times it was seen.
+    """
+    if not 0 < seconds <= 60 or interval_ms < 1:
+        raise HTTPException(
+            status_code=400, detail='Profiles must be up to 60 seconds long, with samples at least 1 ms apart.')
+
+    # the sampler runs in its own thread, so it sees the loop while this handler is waiting on it
+    samples = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds, interval_ms / 1000)
+    return PlainTextResponse(format_collapsed(samples))
+
+
 @app.get('/healthcheck')
 def healthcheck():
     return {'status': 'ok'}
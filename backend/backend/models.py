@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from pydantic import BaseModel, Field
 from enum import Enum
 from typing import Union
@@ -18,6 +18,9 @@ class User(BaseModel):
 class LoggedInUser(User):
     account_id: int
     access_token: str
+    refresh_token: str
+    # seconds until the access token expires
+    expires_in: int
     # following fields depend on account_type
     email: str | None = None
     phone_number: str | None = None
@@ -62,9 +65,115 @@ class Token(BaseModel):
     token_type: str
 
 
+class RefreshingToken(BaseModel):
+    refresh_token: str
+
+
+class RefreshedToken(BaseModel):
+    access_token: str
+    refresh_token: str
+    expires_in: int
+
+
 class TokenData(BaseModel):
     username: Union[str, None] = None
 
 
 class ProposedWebsite(BaseModel):
     title: str = Field(..., min_length=1)
+
+
+class ProposedCamp(BaseModel):
+    title: str = Field(..., min_length=1)
+    # how many student logins to make
+    students: int = Field(..., ge=1, le=100)
+    # the students' usernames are this and a number, eg. dinos-1. defaults to 'camp' and the camp's ID
+    username_prefix: str | None = Field(None, pattern=r'^[a-z0-9]{1,15}$')
+
+
+class CampLogin(BaseModel):
+    student_id: int
+    username: str
+    password: str
+
+
+class CreatedCamp(BaseModel):
+    camp_id: int
+    title: str
+    students: list[CampLogin]
+
+
+class GalleryWebsite(BaseModel):
+    website_id: int
+    title: str
+    username: str
+    # where the website's thumbnail is, which never changes, or None if it doesn't have one yet
+    thumbnail: str | None = None
+
+
+class SearchResult(BaseModel):
+    website_id: int
+    title: str
+    owner_username: str | None = None
+    filename: str | None = None
+    rank: float
+
+
+class PublishedFile(BaseModel):
+    path: str
+    source: str
+    media_type: str
+    original_size: int
+    size: int
+    gzip_size: int | None = None
+    brotli_size: int | None = None
+
+
+class Publication(BaseModel):
+    website_id: int
+    published_time: datetime
+    files: list[PublishedFile]
+    original_bytes: int
+    optimized_bytes: int
+    # what the files take to send with the best compression for each, ie. what a browser downloads
+    transferred_bytes: int
+    saved_bytes: int
+
+
+class DailyViews(BaseModel):
+    day: date
+    views: int
+
+
+class WebsiteViews(BaseModel):
+    website_id: int
+    # in the days asked for. days without any views are left out
+    total: int
+    days: list[DailyViews]
+
+
+class WebsiteStats(BaseModel):
+    website_id: int
+    hits: int
+    # estimated, to within a few percent
+    unique_viewers: int
+
+
+class StorageLimits(BaseModel):
+    bytes: int
+    files: int
+    websites: int
+
+
+class StorageUsage(BaseModel):
+    account_id: int
+    username: str
+    bytes: int
+    files: int
+    websites: int
+    limits: StorageLimits
+
+
+class StorageReport(BaseModel):
+    administrator: StorageUsage
+    students: list[StorageUsage]
@@ -0,0 +1,44 @@
+import asyncio
+from typing import Optional
+
+
+class LoopLagMonitor:
+    '''
+    Measures how late the event loop wakes up from a short sleep, ie. how long ready callbacks
+    (and so every in-flight request) are being held up.
+
+    Attributes:
+        lag (float): The smoothed lag, in seconds.
+        max_lag (float): The largest single lag seen, in seconds.
+    '''
+
+    def __init__(self, interval: float = 0.1, smoothing: float = 0.2):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.lag = 0.0
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(0.0, loop.time() - start - self.interval))
+
+    def record(self, lag: float):
+        self.lag += self.smoothing * (lag - self.lag)
+        self.max_lag = max(self.max_lag, lag)
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from types import FrameType
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def frame_name(frame: FrameType) -> str:
+    return f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}'
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    '''
+    Formats a stack as a single line of frames, outermost first and separated by semicolons,
+    which is the format flamegraph.pl (and speedscope, etc.) reads.
+    '''
+
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def sample_stacks(thread_id: int, seconds: float, interval: float = 0.005) -> Counter:
+    '''
+    Samples a thread's stack at regular intervals. This is meant to be run in a different thread to the one being sampled.
+
+    Args:
+        thread_id (int): The thread to sample, eg. the event loop's.
+        seconds (float): How long to sample for.
+        interval (float, optional): How long to wait between samples, in seconds. Defaults to 0.005.
+
+    Returns:
+        Counter: How many times each collapsed stack was seen.
+    '''
+
+    samples = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        if frame is not None:
+            samples[collapse_stack(frame)] += 1
+        del frame
+        time.sleep(interval)
+    return samples
+
+
+def format_collapsed(samples: Counter) -> str:
+    return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common())
+
+
+def blocking_location(frame: Optional[FrameType]) -> str:
+    # the innermost frame from this package is usually the handler (or helper) to blame
+    while frame is not None:
+        if os.path.abspath(frame.f_code.co_filename).startswith(PACKAGE_DIR):
+            return f'{frame_name(frame)} (line {frame.f_lineno})'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class BlockingWatchdog:
+    '''
+    Watches the event loop from another thread, and logs (with a stack) whenever the loop
+    is blocked for longer than a threshold, eg. by bcrypt or JWT work in a handler.
+
+    Attributes:
+        stalls (deque): The most recent stalls, as dictionaries with their duration, location and stack.
+    '''
+
+    def __init__(self, threshold: float, max_stalls: int = 50):
+        '''
+        Args:
+            threshold (float): How long, in seconds, the loop can be blocked before it's reported.
+            max_stalls (int, optional): How many stalls are kept for inspection. Defaults to 50.
+        '''
+
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self.stalls: deque[dict] = deque(maxlen=max_stalls)
+        self.heartbeat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopping.clear()
+        self.heartbeat_task = asyncio.create_task(self.beat())
+        self.thread = threading.Thread(target=self.watch, name='blocking-watchdog', daemon=True)
+        self.thread.start()
+
+    async def stop(self):
+        self.stopping.set()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+        if self.thread:
+            await asyncio.to_thread(self.thread.join)
+            self.thread = None
+
+    async def beat(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def watch(self):
+        stall: Optional[dict] = None
+        while not self.stopping.wait(self.interval):
+            last_beat = self.heartbeat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            if stall is None and blocked_for > self.threshold:
+                # the stack is captured while the loop is still blocked, so it shows the culprit
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stall = {
+                    'since': last_beat,
+                    'location': blocking_location(frame),
+                    'stack': ''.join(traceback.format_stack(frame)) if frame else ''
+                }
+                del frame
+            elif stall is not None and last_beat != stall['since']:
+                self.report(stall, last_beat - stall['since'] - self.interval)
+                stall = None
+
+    def report(self, stall: dict, duration: float):
+        stall = {
+            'duration_ms': round(duration * 1000, 1),
+            'location': stall['location'],
+            'stack': stall['stack']
+        }
+        self.stalls.append(stall)
+        logger.warning('Event loop was blocked for %.0f ms in %s\n%s',
+                       stall['duration_ms'], stall['location'], stall['stack'])
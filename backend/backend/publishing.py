@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+from .assets import optimize_site
+from .store import ContentStore
+from .thumbnails import render_thumbnail
+
+logger = logging.getLogger(__name__)
+
+
+class Publisher:
+    '''
+    Optimizes websites' files, and renders their thumbnails, in a worker process whenever they change,
+    so that the work never holds up the event loop. Changes to a website that arrive while it's being
+    published are coalesced into one more publish once the current one finishes.
+
+    Attributes:
+        tasks (set[asyncio.Task]): The publishes that are running.
+        published (int): How many publishes have finished.
+    '''
+
+    def __init__(self, load_files: Callable[[int], Awaitable[dict[str, str]]], save_manifest: Callable[[int, list[dict]], Awaitable[None]], save_thumbnail: Optional[Callable[[int, Optional[dict]], Awaitable[None]]] = None, max_workers: int = 1):
+        '''
+        Args:
+            load_files (Callable): Loads a website's files' contents, by filename.
+            save_manifest (Callable): Records what a website was published as.
+            save_thumbnail (Callable | None, optional): Records a website's thumbnail (or that it has none). Defaults to None,
+                ie. thumbnails aren't rendered.
+            max_workers (int, optional): How many worker processes optimize files. Defaults to 1.
+        '''
+
+        self.load_files = load_files
+        self.save_manifest = save_manifest
+        self.save_thumbnail = save_thumbnail
+        # the headless browser thumbnails are rendered with, if there is one
+        self.renderer: Optional[str] = None
+        self.max_workers = max_workers
+        self.store: Optional[ContentStore] = None
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.tasks: set[asyncio.Task] = set()
+        self.running: dict[int, asyncio.Task] = {}
+        self.stale: set[int] = set()
+        self.published = 0
+
+    def start(self, store_root: str, renderer: Optional[str] = None):
+        self.store = ContentStore(store_root)
+        self.renderer = renderer
+        # spawned rather than forked, since the server has threads (eg. the pool's) that a fork would copy mid-flight
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def stop(self, timeout: Optional[float] = None) -> bool:
+        '''
+        Waits for the publishes that are running (and any they've coalesced) to finish, then stops the worker processes.
+
+        Args:
+            timeout (float | None, optional): The longest to wait, in seconds. Publishes still running then are
+                cancelled, leaving their websites as they were last published. Defaults to None, ie. no limit.
+
+        Returns:
+            bool: Whether every publish finished.
+        '''
+
+        finished = True
+        try:
+            await asyncio.wait_for(self.idle(), timeout)
+        except asyncio.TimeoutError:
+            finished = False
+            logger.warning('Stopped before publishing websites %s', sorted(self.running))
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        if self.executor:
+            # a worker that's part way through a file is left to finish it, rather than waited for
+            self.executor.shutdown(wait=finished, cancel_futures=True)
+            self.executor = None
+        return finished
+
+    def request(self, website_id: int):
+        '''
+        Publishes a website soon, or once more after its current publish if one is running.
+        '''
+
+        if website_id in self.running:
+            self.stale.add(website_id)
+            return
+        task = asyncio.create_task(self.publish(website_id))
+        self.running[website_id] = task
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def idle(self):
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def publish(self, website_id: int):
+        try:
+            while True:
+                self.stale.discard(website_id)
+                try:
+                    files = await self.load_files(website_id)
+                    loop = asyncio.get_running_loop()
+                    manifest = await loop.run_in_executor(self.executor, optimize_site, files, self.store.root)
+                    await self.save_manifest(website_id, manifest)
+                    # the thumbnail comes second, since the website can be served without it
+                    if self.save_thumbnail:
+                        thumbnail = await loop.run_in_executor(self.executor, render_thumbnail, files, self.store.root, self.renderer)
+                        await self.save_thumbnail(website_id, thumbnail)
+                    self.published += 1
+                except Exception:
+                    logger.exception('Could not publish website %s', website_id)
+                if website_id not in self.stale:
+                    break
+        finally:
+            del self.running[website_id]
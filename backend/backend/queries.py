@@ -0,0 +1,639 @@
+from typing import Any, Mapping, Optional, Sequence
+
+from psycopg import AsyncCursor
+
+# every statement the handlers send lives here, under a name, so that the same
+# query text is always used and psycopg can prepare it once per pooled connection
+# and reuse the server-side plan on every later request served by that connection
+
+# the websites an account can see: their own, their students', their children's,
+# their friends', and any they've been given access to
+VISIBLE_WEBSITES = '''
+            select  website_id from Student_Owns_Website where student_id = %(account_id)s
+            union
+            select  website_id from Administrator_Owns_Website where administrator_id = %(account_id)s
+            union
+            select  o.website_id
+            from    Teaches t
+            join    Student_Owns_Website o
+            on      o.student_id = t.student_id
+            where   t.administrator_id = %(account_id)s
+            union
+            select  o.website_id
+            from    Has_Child h
+            join    Student_Owns_Website o
+            on      o.student_id = h.student_id
+            where   h.guardian_id = %(account_id)s
+            union
+            select  o.website_id
+            from    Friendship f
+            join    Student_Owns_Website o
+            on      o.student_id = f.student_id
+            where   f.friend_id = %(account_id)s
+            union
+            select  website_id from Can_View_Website where account_id = %(account_id)s
+'''
+
+# pages are matched on their text, and websites on their title or their owner's username.
+# only the caller's visible websites are searched, which is usually a few dozen, so they're
+# found first and everything else is filtered down to them
+SEARCH = '''
+        with    visible as materialized ({visible}
+        ),
+        owners as (
+            select  website_id, student_id as owner_id, 0 as precedence
+            from    Student_Owns_Website
+            where   website_id in (select website_id from visible)
+            union all
+            select  website_id, administrator_id, 1
+            from    Administrator_Owns_Website
+            where   website_id in (select website_id from visible)
+        ),
+        matches as (
+            select  p.website_id, p.filename, ts_rank(p.search_vector, q) as rank
+            from    Webpage p, websearch_to_tsquery('english', %(query)s) q
+            where   p.website_id in (select website_id from visible) and p.search_vector @@ q
+            union all
+            select  s.id, null, {title_rank}
+            from    Website s, websearch_to_tsquery('english', %(query)s) q
+            where   s.id in (select website_id from visible) and ({title_match})
+            union all
+            select  o.website_id, null, {username_rank}
+            from    owners o
+            join    Account a
+            on      a.id = o.owner_id
+            where   {username_match}
+        ),
+        best as (
+            select  website_id, filename, max(rank) as rank
+            from    matches
+            group by website_id, filename
+            order by rank desc, website_id, filename
+            limit   %(limit)s
+        )
+        -- a website that's shared is shown once, as its student's (or its first administrator's)
+        select  b.website_id, s.title, owner.username, b.filename, b.rank
+        from    best b
+        join    Website s
+        on      s.id = b.website_id
+        left join lateral (
+            select  a.username
+            from    owners o
+            join    Account a
+            on      a.id = o.owner_id
+            where   o.website_id = b.website_id
+            order by o.precedence, o.owner_id
+            limit   1
+        ) owner on true
+        order by b.rank desc, b.website_id, b.filename
+'''
+
+QUERIES: dict[str, str] = {
+    'get_user_from_username': '''
+        select * from get_user_from_username(%(username)s)
+    ''',
+    'get_user_from_email': '''
+        select get_user_from_email(%(email)s)
+    ''',
+    'get_user_type': '''
+        select * from get_user_type(%(id)s)
+    ''',
+    'get_website': '''
+        select  title, xmin::text
+        from    Website
+        where   id = %(website_id)s
+    ''',
+    'get_webpage': '''
+        select  contents, xmin::text, id
+        from    Webpage
+        where   website_id = %(website_id)s and filename = %(filename)s
+    ''',
+    # only writes the webpage if the uploader owns the website. the search vector
+    # is rebuilt from the page's text (without its HTML) whenever it's replaced
+    'upsert_owned_webpage': '''
+        insert into Webpage (website_id, title, filename, contents, crc32, search_vector)
+        select  %(website_id)s, %(title)s, %(filename)s, %(contents)s, %(crc32)s, webpage_search_vector(%(title)s, %(text)s)
+        where   exists (select 1 from Student_Owns_Website where student_id = %(owner_id)s and website_id = %(website_id)s)
+                or exists (select 1 from Administrator_Owns_Website where administrator_id = %(owner_id)s and website_id = %(website_id)s)
+        on conflict (website_id, filename) do update
+        set     title = excluded.title, contents = excluded.contents, crc32 = excluded.crc32, search_vector = excluded.search_vector
+        returning id
+    ''',
+    # what the uploader can still store, and the most an upload to the website could free by replacing a file
+    'get_upload_allowance': '''
+        select  case
+                    when exists (select 1 from Student where id = %(account_id)s) then 'student'
+                    when exists (select 1 from Administrator where id = %(account_id)s) then 'administrator'
+                end,
+                coalesce((select bytes from Storage_Usage where account_id = %(account_id)s), 0),
+                coalesce((select max(octet_length(contents)) from Webpage where website_id = %(website_id)s), 0)
+    ''',
+    # locks the account's usage for the rest of the transaction, so concurrent uploads are counted one at a time
+    'lock_storage_usage': '''
+        insert into Storage_Usage (account_id)
+        values (%(account_id)s)
+        on conflict (account_id) do update
+        set     account_id = excluded.account_id
+    ''',
+    # replacing a file only counts the difference in size
+    'add_webpage_usage': '''
+        with old as (
+            select  octet_length(contents) as size
+            from    Webpage
+            where   website_id = %(website_id)s and filename = %(filename)s
+        )
+        update  Storage_Usage
+        set     bytes = bytes + %(size)s - coalesce((select size from old), 0),
+                files = files + (case when exists (select 1 from old) then 0 else 1 end)
+        where   account_id = %(account_id)s
+        returning bytes, files
+    ''',
+    'add_website_usage': '''
+        insert into Storage_Usage (account_id, websites)
+        values (%(account_id)s, 1)
+        on conflict (account_id) do update
+        set     websites = Storage_Usage.websites + 1
+        returning websites
+    ''',
+    'get_storage_usage': '''
+        select  a.id, a.username, coalesce(u.bytes, 0), coalesce(u.files, 0), coalesce(u.websites, 0)
+        from    Account a
+        left join Storage_Usage u
+        on      u.account_id = a.id
+        where   a.id = %(account_id)s
+    ''',
+    'get_students_storage_usage': '''
+        select  a.id, a.username, coalesce(u.bytes, 0), coalesce(u.files, 0), coalesce(u.websites, 0)
+        from    Teaches t
+        join    Account a
+        on      a.id = t.student_id
+        left join Storage_Usage u
+        on      u.account_id = a.id
+        where   t.administrator_id = %(account_id)s
+        order by a.username
+    ''',
+    'get_website_files': '''
+        select  filename, contents
+        from    Webpage
+        where   website_id = %(website_id)s
+    ''',
+    'delete_published_files': '''
+        delete from Published_File
+        where   website_id = %(website_id)s
+    ''',
+    'insert_published_file': '''
+        insert into Published_File (website_id, path, source, digest, media_type, original_size, size, gzip_size, brotli_size)
+        values (%(website_id)s, %(path)s, %(source)s, %(digest)s, %(media_type)s, %(original_size)s, %(size)s, %(gzip_size)s, %(brotli_size)s)
+    ''',
+    'get_published_file': '''
+        select  source, digest, media_type, gzip_size, brotli_size
+        from    Published_File
+        where   website_id = %(website_id)s and path = %(path)s
+    ''',
+    'get_published_files': '''
+        select  path, source, media_type, original_size, size, gzip_size, brotli_size, published_time
+        from    Published_File
+        where   website_id = %(website_id)s
+        order by path
+    ''',
+    'upsert_website_thumbnail': '''
+        insert into Website_Thumbnail (website_id, version, extension)
+        values (%(website_id)s, %(version)s, %(extension)s)
+        on conflict (website_id) do update
+        set     version = excluded.version, extension = excluded.extension, rendered_time = current_timestamp
+    ''',
+    'delete_website_thumbnail': '''
+        delete from Website_Thumbnail
+        where   website_id = %(website_id)s
+    ''',
+    'get_website_thumbnail': '''
+        select  version, extension
+        from    Website_Thumbnail
+        where   website_id = %(website_id)s
+    ''',
+    # not executed (and so not prepared) like the others, since it's a copy
+    'copy_audit_log': '''
+        copy Audit_Log (occurred_time, kind, account_id, website_id, detail) from stdin
+    ''',
+    # views for websites that have since been deleted are skipped
+    'add_website_views': '''
+        insert into Website_Views (website_id, day, views)
+        select  v.website_id, v.day, v.views
+        from    unnest(%(website_ids)s::integer[], %(days)s::date[], %(views)s::bigint[]) as v(website_id, day, views)
+        join    Website w
+        on      w.id = v.website_id
+        order by v.website_id, v.day
+        on conflict (website_id, day) do update
+        set     views = Website_Views.views + excluded.views
+    ''',
+    'get_website_views': '''
+        select  day, views
+        from    Website_Views
+        where   website_id = %(website_id)s and day > (current_timestamp at time zone 'utc')::date - %(days)s::integer
+        order by day
+    ''',
+    # viewers are combined with what's already been counted
+    'add_website_stats': '''
+        insert into Website_Stats (website_id, viewers)
+        select  s.website_id, s.viewers
+        from    unnest(%(website_ids)s::integer[], %(viewers)s::bytea[]) as s(website_id, viewers)
+        join    Website w
+        on      w.id = s.website_id
+        order by s.website_id
+        on conflict (website_id) do update
+        set     viewers = hll_merge(Website_Stats.viewers, excluded.viewers)
+    ''',
+    # hits are the website's views, from every day it's had them
+    'get_website_stats': '''
+        select  (select coalesce(sum(views), 0) from Website_Views where website_id = %(website_id)s),
+                (select viewers from Website_Stats where website_id = %(website_id)s)
+    ''',
+    'camp_exists': '''
+        select exists (select 1 from Camp where id = %(camp_id)s)
+    ''',
+    # every website made at a camp, with its thumbnail if it has one
+    'get_camp_gallery': '''
+        select  w.id, w.title, a.username, t.version, t.extension
+        from    Attends c
+        join    Account a
+        on      a.id = c.student_id
+        join    Student_Owns_Website o
+        on      o.student_id = c.student_id
+        join    Website w
+        on      w.id = o.website_id
+        left join Website_Thumbnail t
+        on      t.website_id = w.id
+        where   c.camp_id = %(camp_id)s
+        order by a.username, w.id
+    ''',
+    'has_extension': '''
+        select exists (select 1 from pg_extension where extname = %(name)s)
+    ''',
+    'search': SEARCH.format(
+        visible=VISIBLE_WEBSITES,
+        title_rank='greatest(ts_rank(s.search_vector, q), word_similarity(%(query)s, s.title))',
+        title_match='s.search_vector @@ q or %(query)s <%% s.title',
+        username_rank='word_similarity(%(query)s, a.username)',
+        username_match='%(query)s <%% a.username'
+    ),
+    # for databases without pg_trgm, which can only match whole words in titles and the start of usernames
+    'search_without_trigrams': SEARCH.format(
+        visible=VISIBLE_WEBSITES,
+        title_rank='ts_rank(s.search_vector, q)',
+        title_match='s.search_vector @@ q',
+        username_rank='0.5',
+        username_match='a.username ilike %(username_prefix)s'
+    ),
+    'insert_website': '''
+        insert into Website (title)
+        values (%(title)s)
+        returning id
+    ''',
+    'insert_student_owns_website': '''
+        insert into Student_Owns_Website (student_id, website_id)
+        values (%(owner_id)s, %(website_id)s)
+    ''',
+    'insert_administrator_owns_website': '''
+        insert into Administrator_Owns_Website (administrator_id, website_id)
+        values (%(owner_id)s, %(website_id)s)
+    ''',
+    'insert_account': '''
+        insert into Account (given_name, family_name, hashed_password, username)
+        values (%(given_name)s, %(family_name)s, 'temp', %(username)s)
+        returning id, registration_time
+    ''',
+    # only inserts the account if the administrator exists, so the
+    # administrator check doesn't need a round trip of its own
+    'insert_taught_account': '''
+        insert into Account (given_name, family_name, hashed_password, username)
+        select  %(given_name)s, %(family_name)s, 'temp', %(username)s
+        where   exists (select 1 from Administrator where id = %(administrator_id)s)
+        returning id, registration_time
+    ''',
+    'set_hashed_password': '''
+        update  Account
+        set     hashed_password = %(hashed_password)s
+        where   id = %(account_id)s
+    ''',
+    'insert_student': '''
+        insert into Student (id)
+        values (%(account_id)s)
+    ''',
+    'insert_administrator': '''
+        insert into Administrator (id)
+        values (%(account_id)s)
+    ''',
+    'insert_teaches': '''
+        insert into Teaches (administrator_id, student_id)
+        values (%(administrator_id)s, %(student_id)s)
+    ''',
+    'insert_full_account': '''
+        insert into Full_Account (id, email, phone_number)
+        values (%(id)s, %(email)s, %(phone_number)s)
+    ''',
+    # the account's expired tokens (used or not) are deleted as a new one is issued, so the table doesn't
+    # keep every token ever issued. presenting one of them again is then just an unknown token
+    'insert_refresh_token': '''
+        with expired as (
+            delete from Refresh_Token
+            where   account_id = %(account_id)s and expiry_time <= current_timestamp
+        )
+        insert into Refresh_Token (account_id, family, token_hash, expiry_time)
+        values (%(account_id)s, %(family)s, %(token_hash)s, current_timestamp + %(lifetime)s)
+    ''',
+    # marks the presented token used and issues its replacement in one statement,
+    # returning nothing if the token is unknown, expired, used or revoked.
+    # the replacement keeps the family's expiry, so the lifetime bounds the whole login however often
+    # it's refreshed. the family's expired tokens are deleted at the same time
+    'rotate_refresh_token': '''
+        with used as (
+            update  Refresh_Token
+            set     used = true
+            where   token_hash = %(token_hash)s and not used and not revoked
+                    and expiry_time > current_timestamp
+            returning account_id, family, expiry_time
+        ), expired as (
+            delete from Refresh_Token
+            where   family = (select family from used) and expiry_time <= current_timestamp
+        ), issued as (
+            insert into Refresh_Token (account_id, family, token_hash, expiry_time)
+            select  account_id, family, %(new_token_hash)s, expiry_time
+            from    used
+            returning account_id
+        )
+        select  a.username
+        from    issued
+        join    Account a
+        on      a.id = issued.account_id
+    ''',
+    # a used token being presented again means it was stolen (or leaked),
+    # so every token descended from the same login is revoked
+    'revoke_reused_refresh_token': '''
+        update  Refresh_Token
+        set     revoked = true
+        where   family = (select family from Refresh_Token where token_hash = %(token_hash)s and used)
+        returning id
+    ''',
+    # makes a camp and all of its students' accounts in one statement. the usernames are the
+    # prefix (or the camp's ID) and each student's number, eg. camp12-3
+    'insert_camp': '''
+        with camp as (
+            insert into Camp (administrator_id, title)
+            values (%(administrator_id)s, %(title)s)
+            returning id
+        ), numbered as (
+            select  coalesce(%(username_prefix)s, 'camp' || camp.id) || '-' || s.number as username,
+                    s.hashed_password, s.number
+            from    camp, unnest(%(hashed_passwords)s::text[]) with ordinality as s(hashed_password, number)
+        ), accounts as (
+            insert into Account (given_name, family_name, username, hashed_password, registration_time)
+            select  'Student', '', username, hashed_password, %(registration_time)s
+            from    numbered
+            returning id, username
+        ), students as (
+            insert into Student (id)
+            select  id from accounts
+        ), teaches as (
+            insert into Teaches (administrator_id, student_id)
+            select  %(administrator_id)s, id from accounts
+        ), attends as (
+            insert into Attends (student_id, camp_id)
+            select  accounts.id, camp.id from accounts, camp
+        )
+        select  camp.id, accounts.id, accounts.username, numbered.number
+        from    camp, accounts
+        join    numbered
+        on      numbered.username = accounts.username
+        order by numbered.number
+    ''',
+    'is_administrator': '''
+        select exists (select 1 from Administrator where id = %(account_id)s)
+    ''',
+    'get_camp': '''
+        select  title, start_time, archived_time
+        from    Camp
+        where   id = %(camp_id)s and administrator_id = %(administrator_id)s
+    ''',
+    'archive_camp': '''
+        update  Camp
+        set     archived_time = coalesce(archived_time, current_timestamp)
+        where   id = %(camp_id)s
+    ''',
+    # what goes in an export: the owner's username, the website, and each of its files' size and checksum
+    # (but not its contents, which are read separately, only if they're needed). a website without
+    # files still has a row, with nulls for the file
+    'get_website_export': '''
+        select  a.username, w.id, w.title, p.id, p.filename, octet_length(p.contents), p.crc32
+        from    Website w
+        left join Student_Owns_Website o
+        on      o.website_id = w.id
+        left join Account a
+        on      a.id = o.student_id
+        left join Webpage p
+        on      p.website_id = w.id
+        where   w.id = %(website_id)s
+        order by p.filename
+    ''',
+    'get_student_export': '''
+        select  a.username, w.id, w.title, p.id, p.filename, octet_length(p.contents), p.crc32
+        from    Student s
+        join    Account a
+        on      a.id = s.id
+        left join Student_Owns_Website o
+        on      o.student_id = s.id
+        left join Website w
+        on      w.id = o.website_id
+        left join Webpage p
+        on      p.website_id = w.id
+        where   s.id = %(student_id)s
+        order by w.id, p.filename
+    ''',
+    'get_camp_export': '''
+        select  a.username, w.id, w.title, p.id, p.filename, octet_length(p.contents), p.crc32
+        from    Attends c
+        join    Account a
+        on      a.id = c.student_id
+        join    Student_Owns_Website o
+        on      o.student_id = c.student_id
+        join    Website w
+        on      w.id = o.website_id
+        join    Webpage p
+        on      p.website_id = w.id
+        where   c.camp_id = %(camp_id)s
+        order by a.username, w.id, p.filename
+    ''',
+    # files' contents, in the order their IDs are given
+    'get_webpages_contents': '''
+        select  p.contents
+        from    unnest(%(webpage_ids)s::integer[]) with ordinality as e(id, position)
+        join    Webpage p
+        on      p.id = e.id
+        order by e.position
+    ''',
+    # locks a batch of the camp's students out, by replacing their passwords with one no password
+    # matches and revoking their refresh tokens. returns nothing once they're all locked out
+    'lock_out_camp_students': '''
+        with batch as (
+            select  a.id
+            from    Attends c
+            join    Account a
+            on      a.id = c.student_id
+            where   c.camp_id = %(camp_id)s and a.hashed_password <> %(locked_password)s
+            order by a.id
+            limit   %(batch_size)s
+            for update of a
+        ), revoked as (
+            update  Refresh_Token
+            set     revoked = true
+            where   account_id in (select id from batch) and not revoked
+        )
+        update  Account
+        set     hashed_password = %(locked_password)s
+        where   id in (select id from batch)
+        returning id
+    ''',
+    'get_camp_student_batch': '''
+        select  student_id
+        from    Attends
+        where   camp_id = %(camp_id)s
+        order by student_id
+        limit   %(batch_size)s
+    ''',
+    # the statements in PURGE_STUDENTS, which delete students and everything that refers to them.
+    # their websites are locked first, so a publish that finishes meanwhile can't add files back
+    'lock_students_websites': '''
+        select  id
+        from    Website
+        where   id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+        for update
+    ''',
+    # websites an administrator also owns are kept, for them. the students are just taken off them first, so
+    # that the rest only delete the students' own websites (and leave the administrators' usage as it was)
+    'leave_students_shared_websites': '''
+        delete from Student_Owns_Website
+        where   student_id = any(%(student_ids)s)
+        and     website_id in (select website_id from Administrator_Owns_Website)
+    ''',
+    'delete_students_published_files': '''
+        delete from Published_File
+        where   website_id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+    ''',
+    'delete_students_website_thumbnails': '''
+        delete from Website_Thumbnail
+        where   website_id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+    ''',
+    'delete_students_website_views': '''
+        delete from Website_Views
+        where   website_id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+    ''',
+    'delete_students_website_stats': '''
+        delete from Website_Stats
+        where   website_id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+    ''',
+    'delete_students_website_viewers': '''
+        delete from Can_View_Website
+        where   website_id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+    ''',
+    'delete_students_webpages': '''
+        delete from Webpage
+        where   website_id in (select website_id from Student_Owns_Website where student_id = any(%(student_ids)s))
+    ''',
+    'delete_students_websites': '''
+        with owned as (
+            delete from Student_Owns_Website
+            where   student_id = any(%(student_ids)s)
+            returning website_id
+        )
+        delete from Website
+        where   id in (select website_id from owned)
+    ''',
+    'delete_students_refresh_tokens': '''
+        delete from Refresh_Token
+        where   account_id = any(%(student_ids)s)
+    ''',
+    'delete_students_storage_usage': '''
+        delete from Storage_Usage
+        where   account_id = any(%(student_ids)s)
+    ''',
+    'delete_students_friendships': '''
+        delete from Friendship
+        where   student_id = any(%(student_ids)s) or friend_id = any(%(student_ids)s)
+    ''',
+    'delete_students_guardians': '''
+        delete from Has_Child
+        where   student_id = any(%(student_ids)s)
+    ''',
+    'delete_students_teachers': '''
+        delete from Teaches
+        where   student_id = any(%(student_ids)s)
+    ''',
+    'delete_students_camps': '''
+        delete from Attends
+        where   student_id = any(%(student_ids)s)
+    ''',
+    'delete_students': '''
+        delete from Student
+        where   id = any(%(student_ids)s)
+    ''',
+    'delete_student_accounts': '''
+        delete from Account
+        where   id = any(%(student_ids)s)
+    ''',
+    'delete_camp': '''
+        delete from Camp
+        where   id = %(camp_id)s
+    ''',
+}
+
+# in the order they have to run in, since rows that refer to others have to go first
+PURGE_STUDENTS = [
+    'lock_students_websites',
+    'leave_students_shared_websites',
+    'delete_students_published_files',
+    'delete_students_website_thumbnails',
+    'delete_students_website_views',
+    'delete_students_website_stats',
+    'delete_students_website_viewers',
+    'delete_students_webpages',
+    'delete_students_websites',
+    'delete_students_refresh_tokens',
+    'delete_students_storage_usage',
+    'delete_students_friendships',
+    'delete_students_guardians',
+    'delete_students_teachers',
+    'delete_students_camps',
+    'delete_students',
+    'delete_student_accounts',
+]
+
+
+async def execute(cur: AsyncCursor, name: str, params: Optional[Mapping[str, Any] | Sequence[Any]] = None) -> AsyncCursor:
+    '''
+    Executes a query from the registry, preparing it on the cursor's connection if it hasn't been already.
+
+    Args:
+        cur (AsyncCursor): The cursor to execute the query with.
+        name (str): The query's name in QUERIES.
+        params (Mapping | Sequence | None, optional): The query's parameters. Defaults to None.
+
+    Returns:
+        AsyncCursor: The cursor, so results can be fetched from it.
+
+    Raises:
+        KeyError: If no query is registered under the given name.
+    '''
+
+    return await cur.execute(QUERIES[name], params, prepare=True)
+
+
+async def execute_many(cur: AsyncCursor, name: str, params_seq: Sequence[Mapping[str, Any] | Sequence[Any]]):
+    '''
+    Executes a query from the registry once for each set of parameters, in a single pipeline.
+
+    Args:
+        cur (AsyncCursor): The cursor to execute the query with.
+        name (str): The query's name in QUERIES.
+        params_seq (Sequence): The parameters for each execution.
+    '''
+
+    await cur.executemany(QUERIES[name], params_seq)
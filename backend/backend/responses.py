@@ -0,0 +1,185 @@
+import gzip
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    # without brotli, clients that ask for it get gzip instead
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'application/json', 'application/javascript', 'application/xml', 'image/svg+xml'}
+
+
+def weak_etag(*parts) -> str:
+    '''
+    Builds a weak ETag from the parts identifying a version of a resource, eg. its type, ID and row version.
+    '''
+
+    return 'W/"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    '''
+    Checks an If-None-Match header against an ETag, using weak comparison (as If-None-Match requires).
+
+    Args:
+        etag (str): The current ETag of the resource.
+        if_none_match (str | None): The request's If-None-Match header, if it has one.
+
+    Returns:
+        bool: Whether the client's copy is current, ie. a 304 can be sent instead.
+    '''
+
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque_tag = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == opaque_tag for tag in if_none_match.split(','))
+
+
+def choose_encoding(accept_encoding: str, available: tuple[str, ...] = ('br', 'gzip')) -> Optional[str]:
+    '''
+    Picks the best encoding the client accepts from those available (eg. the precompressed versions of a file), or None if there isn't one.
+    '''
+
+    accepted: dict[str, float] = {}
+    for coding in accept_encoding.split(','):
+        name, _, params = coding.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    for encoding in ('br', 'gzip'):
+        if encoding not in available or (encoding == 'br' and brotli is None):
+            continue
+        if accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, thorough: bool = False) -> bytes:
+    # bodies that are going to be cached are worth compressing harder,
+    # since that only happens once per version
+    if encoding == 'br':
+        return brotli.compress(body, quality=9 if thorough else 4)
+    return gzip.compress(body, compresslevel=9 if thorough else 6)
+
+
+class CompressedBodyCache:
+    '''
+    A least-recently-used cache of compressed response bodies, bounded by their total size.
+    '''
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.bodies: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+    def get(self, key: tuple[str, str]) -> Optional[bytes]:
+        body = self.bodies.get(key)
+        if body is not None:
+            self.bodies.move_to_end(key)
+        return body
+
+    def put(self, key: tuple[str, str], body: bytes):
+        if len(body) > self.max_bytes:
+            return
+        if key in self.bodies:
+            self.size -= len(self.bodies.pop(key))
+        self.bodies[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self.bodies.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class CompressionMiddleware:
+    '''
+    Compresses responses with brotli or gzip, depending on what the client accepts.
+
+    Responses with an ETag have their compressed bodies cached under it, so hot responses are only
+    compressed once per version. This relies on ETags identifying the resource as well as its version,
+    which weak_etag is used to ensure. Streamed responses are passed through untouched.
+    '''
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 500, cache_bytes: int = 8 * 1024 * 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.cache = CompressedBodyCache(cache_bytes)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if encoding is None:
+            async def send_uncompressed(message: Message):
+                if message['type'] == 'http.response.start':
+                    self.vary(MutableHeaders(raw=message['headers']))
+                await send(message)
+
+            await self.app(scope, receive, send_uncompressed)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def send_compressed(message: Message):
+            nonlocal start_message, passthrough
+            if message['type'] == 'http.response.start':
+                # held back until the body shows whether the headers need changing
+                start_message = message
+                return
+            if message['type'] != 'http.response.body' or passthrough:
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            headers = MutableHeaders(raw=start_message['headers'])
+            if message.get('more_body', False) or not self.should_compress(headers, body):
+                passthrough = True
+                self.vary(headers)
+                await send(start_message)
+                await send(message)
+                return
+
+            etag = headers.get('etag')
+            compressed = self.cache.get((etag, encoding)) if etag else None
+            if compressed is None:
+                compressed = compress(body, encoding, thorough=etag is not None)
+                if etag:
+                    self.cache.put((etag, encoding), compressed)
+
+            self.vary(headers)
+            headers['Content-Encoding'] = encoding
+            headers['Content-Length'] = str(len(compressed))
+            await send(start_message)
+            await send({'type': 'http.response.body', 'body': compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+    def should_compress(self, headers: MutableHeaders, body: bytes) -> bool:
+        return self.compressible(headers) and len(body) >= self.minimum_size
+
+    def compressible(self, headers: MutableHeaders) -> bool:
+        if 'content-encoding' in headers:
+            return False
+        content_type = headers.get('content-type', '').split(';')[0].strip()
+        return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+    def vary(self, headers: MutableHeaders):
+        # a response that could have been compressed depends on Accept-Encoding whether it was or not, otherwise
+        # a cache could keep one sent uncompressed (to a client that doesn't accept it) and give it to everyone
+        if self.compressible(headers):
+            headers.add_vary_header('Accept-Encoding')
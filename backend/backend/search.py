@@ -0,0 +1,60 @@
+import mimetypes
+from html.parser import HTMLParser
+
+# the text inside these is code or metadata, not something anyone reads on the page
+SKIPPED_TAGS = {'script', 'style', 'template', 'noscript', 'head'}
+# text either side of these isn't part of the same word
+BLOCK_TAGS = {'p', 'div', 'br', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'td', 'th', 'tr',
+              'table', 'section', 'article', 'header', 'footer', 'nav', 'main', 'blockquote', 'pre', 'hr'}
+
+
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append(' ')
+        if tag == 'img':
+            # alt text is read out by screen readers, so it counts as the page's text
+            alt = dict(attrs).get('alt')
+            if alt:
+                self.parts.append(f' {alt} ')
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append(' ')
+
+    def handle_data(self, data):
+        if not self.skipping:
+            self.parts.append(data)
+
+
+def searchable_text(filename: str, contents: str) -> str:
+    '''
+    Returns the text of a webpage as its visitors read it, to be indexed for search.
+
+    Args:
+        filename (str): The webpage's filename, which decides how its contents are read.
+        contents (str): The webpage's contents.
+
+    Returns:
+        str: The page's text with the HTML stripped, or an empty string if the file isn't a page (eg. CSS or JS).
+    '''
+
+    media_type = mimetypes.guess_type(filename)[0]
+    if media_type == 'text/plain':
+        return contents
+    if media_type != 'text/html':
+        return ''
+
+    extractor = TextExtractor()
+    extractor.feed(contents)
+    extractor.close()
+    return ' '.join(''.join(extractor.parts).split())
@@ -0,0 +1,55 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls that share a key, so that only the first one does the work
+    and the rest wait for its result.
+
+    Attributes:
+        calls (int): How many calls actually did the work.
+        coalesced (int): How many calls waited on another call's result instead.
+    '''
+
+    def __init__(self):
+        self.in_flight: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        '''
+        Runs fn, unless a call with the same key is already running, in which case its result is shared.
+
+        Args:
+            key (Hashable): Identifies calls whose results are interchangeable.
+            fn (Callable[[], Awaitable[T]]): Does the work. It shouldn't depend on anything belonging to
+                the caller (eg. a connection), since its result may be handed to other callers.
+
+        Returns:
+            T: The result of fn, whichever call ran it.
+
+        Raises:
+            Exception: Whatever fn raised, for every call that waited on it.
+        '''
+
+        task = self.in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        else:
+            self.coalesced += 1
+        # shielded so that one caller going away (eg. a client disconnecting)
+        # doesn't cancel the work for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        # mark the exception as retrieved, in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,54 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+
+class ContentStore:
+    '''
+    Stores files on disk by the hash of their contents, so identical files are only stored once and
+    a stored file never changes (which is what lets it be cached forever). Compressed versions of a
+    file are stored alongside it, as are the thumbnails of a version of a website.
+    '''
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str, encoding: Optional[str] = None) -> str:
+        name = digest if encoding is None else f'{digest}.{encoding}'
+        return os.path.join(self.root, digest[:2], name)
+
+    def exists(self, digest: str, encoding: Optional[str] = None) -> bool:
+        return os.path.exists(self.path(digest, encoding))
+
+    def put(self, data: bytes, encoding: Optional[str] = None, digest: Optional[str] = None) -> str:
+        '''
+        Stores a file, unless it's already stored.
+
+        Args:
+            data (bytes): The file's contents.
+            encoding (str | None, optional): The encoding, if this is a compressed version of another file
+                (or what it is, eg. thumbnail.svg, if it's derived from something else). Defaults to None.
+            digest (str | None, optional): The digest of what this is derived from. Defaults to the hash of data.
+
+        Returns:
+            str: The digest the file is stored under.
+        '''
+
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest, encoding)
+        if os.path.exists(path):
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temporary file first, so a half-written file is never served
+        fd, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as temporary_file:
+                temporary_file.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+        return digest
@@ -0,0 +1,256 @@
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import subprocess
+import tempfile
+import threading
+import urllib.parse
+from functools import partial
+from html import escape
+from html.parser import HTMLParser
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from .store import ContentStore
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_MEDIA_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+# thumbnails are a quarter of a 1280x800 window
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_HEIGHT = 200
+WINDOW_WIDTH = 1280
+WINDOW_HEIGHT = 800
+RENDER_TIMEOUT_SECONDS = 20
+# where pages are rendered from. .invalid is reserved, so it's never a real host
+THUMBNAIL_ORIGIN = 'thumbnail.invalid'
+
+# colours from a page's CSS are only used if they look like one of these, since they end up in an SVG attribute
+CSS_COLOUR = re.compile(r'#[0-9a-f]{3,8}|[a-z]{3,20}|rgba?\(\s*[\d.%]+\s*,\s*[\d.%]+\s*,\s*[\d.%]+\s*(,\s*[\d.%]+\s*)?\)', re.IGNORECASE)
+BODY_RULE = re.compile(r'(?<![\w.#:-])(?:html|body)\s*\{([^}]*)\}', re.IGNORECASE)
+SKIPPED_TAGS = {'script', 'style', 'template', 'noscript'}
+HEADING_TAGS = {'h1', 'h2', 'h3'}
+BLOCK_TAGS = {'p', 'div', 'li', 'h4', 'h5', 'h6', 'td', 'blockquote', 'pre', 'section', 'article'}
+
+
+def find_renderer() -> Optional[str]:
+    '''
+    Returns the path to the headless browser (eg. chromium) to render thumbnails with, from THUMBNAIL_RENDERER.
+    A browser that happens to be installed isn't used unless it's chosen, since it runs students' pages.
+    '''
+
+    return os.getenv('THUMBNAIL_RENDERER') or None
+
+
+def site_version(files: dict[str, str], renderer: Optional[str]) -> str:
+    '''
+    Hashes a website's files (and what renders them), so a thumbnail is only rendered once for each version of a website.
+    '''
+
+    version = hashlib.sha256(b'png' if renderer else b'svg')
+    for path in sorted(files):
+        version.update(path.encode() + b'\0' + hashlib.sha256(files[path].encode()).digest())
+    return version.hexdigest()
+
+
+class PagePreview(HTMLParser):
+    # the parts of a page that are drawn in its thumbnail
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ''
+        self.heading = ''
+        self.lines: list[str] = []
+        self.images = 0
+        self.style = ''
+        self.stylesheets: list[str] = []
+        self.skipping = 0
+        self.current: Optional[str] = None
+        self.text: list[str] = []
+
+    def end_block(self):
+        text = ' '.join(''.join(self.text).split())
+        if text and self.current in HEADING_TAGS and not self.heading:
+            self.heading = text
+        elif text and self.current == 'title':
+            self.title = text
+        elif text and self.current != 'title':
+            self.lines.append(text)
+        self.text = []
+
+    def handle_starttag(self, tag, attrs):
+        attributes = dict(attrs)
+        if tag in SKIPPED_TAGS:
+            self.skipping += 1
+        elif tag == 'img':
+            self.images += 1
+        elif tag == 'link' and (attributes.get('rel') or '').lower() == 'stylesheet' and attributes.get('href'):
+            self.stylesheets.append(attributes['href'])
+        elif tag == 'body' and attributes.get('style'):
+            self.style += f'body {{ {attributes["style"]} }}'
+        if tag in HEADING_TAGS or tag in BLOCK_TAGS or tag == 'title':
+            self.end_block()
+            self.current = tag
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skipping = max(0, self.skipping - 1)
+        elif tag in HEADING_TAGS or tag in BLOCK_TAGS or tag == 'title':
+            self.end_block()
+            self.current = None
+
+    def handle_data(self, data):
+        if self.skipping and self.lasttag == 'style':
+            self.style += data
+        elif not self.skipping:
+            self.text.append(data)
+
+
+def body_colour(css: str, properties: tuple[str, ...]) -> Optional[str]:
+    # the last matching declaration wins, as it would in the browser
+    colour = None
+    for rule in BODY_RULE.finditer(css):
+        for declaration in rule.group(1).split(';'):
+            name, _, value = declaration.partition(':')
+            value = value.replace('!important', '').strip()
+            if name.strip().lower() in properties and CSS_COLOUR.fullmatch(value):
+                colour = value
+    return colour
+
+
+def svg_thumbnail(files: dict[str, str]) -> bytes:
+    '''
+    Draws a simplified picture of a website's index page as an SVG, without a browser: its background
+    and text colours, its title or first heading, its first few lines of text, and a box for each of its first images.
+    '''
+
+    page = PagePreview()
+    page.feed(files['index.html'])
+    page.close()
+    page.end_block()
+
+    css = '\n'.join(files.get(posixpath.normpath(href), '') for href in page.stylesheets if ':' not in href) + '\n' + page.style
+    background = body_colour(css, ('background', 'background-color')) or '#ffffff'
+    colour = body_colour(css, ('color',)) or '#222222'
+
+    def clip(text: str, length: int) -> str:
+        return escape(text if len(text) <= length else text[:length - 1] + '…')
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{THUMBNAIL_WIDTH}" height="{THUMBNAIL_HEIGHT}" viewBox="0 0 {THUMBNAIL_WIDTH} {THUMBNAIL_HEIGHT}">',
+             f'<rect width="100%" height="100%" fill="{background}"/>',
+             f'<g fill="{colour}" font-family="sans-serif">',
+             f'<text x="12" y="30" font-size="18" font-weight="bold">{clip(page.heading or page.title, 28)}</text>']
+    y = 52
+    for line in page.lines[:6]:
+        parts.append(f'<text x="12" y="{y}" font-size="10">{clip(line, 56)}</text>')
+        y += 16
+    parts.append('</g>')
+    for image in range(min(page.images, 3)):
+        parts.append(f'<rect x="{12 + image * 102}" y="{max(y, 130)}" width="92" height="56" rx="4" fill="{colour}" fill-opacity="0.15"/>')
+    parts.append('</svg>')
+    return ''.join(parts).encode()
+
+
+class SiteProxyHandler(SimpleHTTPRequestHandler):
+    '''
+    Serves a website's files to the browser rendering it, as the browser's proxy, so that every request the
+    page makes (including to other ports on loopback) comes here. Only the website's own origin is answered.
+    '''
+
+    def do_GET(self):
+        if self.own_origin():
+            super().do_GET()
+
+    def do_HEAD(self):
+        if self.own_origin():
+            super().do_HEAD()
+
+    def own_origin(self) -> bool:
+        # requests to a proxy have the whole URL in them. https is a CONNECT, which isn't answered at all
+        url = urllib.parse.urlsplit(self.path)
+        if url.scheme != 'http' or url.netloc != THUMBNAIL_ORIGIN:
+            self.send_error(403)
+            return False
+        self.path = urllib.parse.urlunsplit(('', '', url.path or '/', url.query, ''))
+        return True
+
+    # the browser's requests aren't worth logging
+    def log_message(self, format, *args):
+        pass
+
+
+def screenshot_thumbnail(files: dict[str, str], renderer: str) -> bytes:
+    '''
+    Renders a website's index page with a headless browser. The page is rendered at a quarter of its
+    size, so the screenshot is already thumbnail sized.
+
+    The page isn't opened as a file, since a file: page can load any other file the server can read
+    (eg. /proc/self/environ) into the screenshot. It's loaded from a made up origin instead, through a proxy
+    on loopback that serves its files and turns everything else away, so it can't reach the network or
+    anything else on the server either.
+    '''
+
+    with tempfile.TemporaryDirectory() as directory:
+        site = os.path.join(directory, 'site')
+        for path, contents in files.items():
+            full_path = os.path.join(site, posixpath.normpath('/' + path).lstrip('/'))
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, 'w', encoding='utf-8') as file:
+                file.write(contents)
+        # next to the served files, rather than among them
+        screenshot = os.path.join(directory, 'thumbnail.png')
+
+        proxy = ThreadingHTTPServer(('127.0.0.1', 0), partial(SiteProxyHandler, directory=site))
+        serving = threading.Thread(target=proxy.serve_forever, daemon=True)
+        serving.start()
+        try:
+            subprocess.run([
+                renderer, '--headless', '--disable-gpu', '--hide-scrollbars', '--mute-audio',
+                # loopback is usually sent around the proxy, so that's turned off. and nothing's looked up
+                f'--proxy-server=http://127.0.0.1:{proxy.server_address[1]}', '--proxy-bypass-list=<-loopback>',
+                '--host-resolver-rules=MAP * ~NOTFOUND, EXCLUDE 127.0.0.1', '--virtual-time-budget=2000',
+                f'--window-size={WINDOW_WIDTH},{WINDOW_HEIGHT}',
+                f'--force-device-scale-factor={THUMBNAIL_WIDTH / WINDOW_WIDTH}',
+                f'--screenshot={screenshot}', f'http://{THUMBNAIL_ORIGIN}/index.html'
+            ], check=True, capture_output=True, timeout=RENDER_TIMEOUT_SECONDS)
+        finally:
+            proxy.shutdown()
+            proxy.server_close()
+        with open(screenshot, 'rb') as file:
+            return file.read()
+
+
+def render_thumbnail(files: dict[str, str], store_root: str, renderer: Optional[str] = None) -> Optional[dict]:
+    '''
+    Renders a thumbnail of a website's index page into a content store, unless that version of the website
+    already has one there. This is meant to be run in a worker process.
+
+    Args:
+        files (dict[str, str]): The website's files' contents, by filename.
+        store_root (str): The content store's directory.
+        renderer (str | None, optional): The headless browser to render with. Defaults to None, ie. drawing an SVG.
+
+    Returns:
+        dict | None: The thumbnail's version and extension, or None if the website doesn't have an index page.
+    '''
+
+    if 'index.html' not in files:
+        return None
+    store = ContentStore(store_root)
+
+    if renderer:
+        version = site_version(files, renderer)
+        if store.exists(version, 'thumbnail.png'):
+            return {'version': version, 'extension': 'png'}
+        try:
+            store.put(screenshot_thumbnail(files, renderer), encoding='thumbnail.png', digest=version)
+            return {'version': version, 'extension': 'png'}
+        except (OSError, subprocess.SubprocessError):
+            # eg. the browser crashed or took too long, so the website gets a drawing instead
+            logger.exception('Could not render a thumbnail with %s', renderer)
+
+    version = site_version(files, None)
+    if not store.exists(version, 'thumbnail.svg'):
+        store.put(svg_thumbnail(files), encoding='thumbnail.svg', digest=version)
+    return {'version': version, 'extension': 'svg'}
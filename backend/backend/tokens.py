@@ -0,0 +1,112 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from jose import JWTError, jwk, jwt
+from jose.exceptions import ExpiredSignatureError
+
+
+class TokenVerifier:
+    '''
+    Signs and verifies JWTs with a set of keys identified by their 'kid', so that keys can be rotated.
+
+    Keys are constructed once, up front, rather than on every call. Verified tokens are remembered
+    (by digest) along with their claims until they expire, so a client presenting the same token on
+    every request only pays for its signature to be checked the first time.
+    '''
+
+    def __init__(self, keys: dict[str, str], current_kid: str, algorithm: str = 'HS256', max_size: int = 4096):
+        '''
+        Args:
+            keys (dict[str, str]): The secret for each key ID that tokens may be signed with.
+            current_kid (str): The key ID new tokens are signed with.
+            algorithm (str, optional): The signing algorithm. Defaults to 'HS256'.
+            max_size (int, optional): How many verified tokens are remembered. Defaults to 4096.
+        '''
+
+        self.algorithm = algorithm
+        self.max_size = max_size
+        # digest -> (claims, expiry as a unix timestamp, key ID)
+        self.cache: OrderedDict[bytes, tuple[dict, float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.set_keys(keys, current_kid)
+
+    def set_keys(self, keys: dict[str, str], current_kid: str):
+        '''
+        Replaces the keys tokens are signed and verified with. Remembered tokens stay remembered,
+        unless the key they were signed with has been removed.
+        '''
+
+        if current_kid not in keys:
+            raise ValueError(f'No key has the ID {current_kid}.')
+        self.keys = {kid: jwk.construct(secret, self.algorithm) for kid, secret in keys.items()}
+        self.current_kid = current_kid
+        for digest in [digest for digest, (_, _, kid) in self.cache.items() if kid not in self.keys]:
+            del self.cache[digest]
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self.keys[self.current_kid], algorithm=self.algorithm, headers={'kid': self.current_kid})
+
+    def decode(self, token: str) -> dict:
+        '''
+        Verifies a token and returns its claims.
+
+        Args:
+            token (str): The encoded token.
+
+        Returns:
+            dict: The token's claims.
+
+        Raises:
+            JWTError: If the token is malformed, expired, or wasn't signed with any of the keys.
+        '''
+
+        digest = hashlib.sha256(token.encode()).digest()
+        cached = self.cache.get(digest)
+        if cached is not None:
+            claims, expiry, _ = cached
+            if expiry > time.time():
+                self.hits += 1
+                self.cache.move_to_end(digest)
+                return claims
+            del self.cache[digest]
+            raise ExpiredSignatureError('Signature has expired.')
+
+        self.misses += 1
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            # tokens from before keys had IDs were signed with one of the current keys
+            candidates = list(self.keys.items())
+        elif kid in self.keys:
+            candidates = [(kid, self.keys[kid])]
+        else:
+            raise JWTError('Token was signed with an unknown key.')
+
+        error: Optional[JWTError] = None
+        for candidate_kid, key in candidates:
+            try:
+                claims = jwt.decode(token, key, algorithms=[self.algorithm])
+            except JWTError as e:
+                error = e
+                continue
+            if 'exp' in claims:
+                self.remember(digest, claims, claims['exp'], candidate_kid)
+            return claims
+        raise error
+
+    def remember(self, digest: bytes, claims: dict, expiry: float, kid: str):
+        self.cache[digest] = (claims, expiry, kid)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+
+def parse_keys(keys: Optional[str]) -> dict[str, str]:
+    '''
+    Parses keys in the form 'kid:secret,kid:secret' (as PREVIOUS_SECRET_KEYS is given).
+    '''
+
+    if not keys:
+        return {}
+    return dict(key.strip().split(':', 1) for key in keys.split(',') if key.strip())
@@ -0,0 +1,54 @@
+'''
+Measures the search query's latency for each kind of account, against whatever is in the database
+(eg. a million webpages from `database/generate_dataset.py`).
+
+Run with `poetry run python benchmarks/search.py`.
+'''
+
+import os
+import statistics
+import sys
+import time
+
+import psycopg
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from backend import queries  # noqa: E402
+
+SEARCHES = ['dinosaurs', 'minecraft castles', 'space rockets', 'pizza -pineapple', 'my website', 'olivia', 'welcme']
+REPEATS = 20
+
+# the account in each role that can see the most websites, ie. the slowest case
+ACCOUNTS = {
+    'student': 'select student_id from Friendship group by student_id order by count(*) desc limit 1',
+    'administrator': 'select administrator_id from Teaches group by administrator_id order by count(*) desc limit 1',
+    'guardian': 'select guardian_id from Has_Child group by guardian_id order by count(*) desc limit 1',
+    'viewer': 'select account_id from Can_View_Website group by account_id order by count(*) desc limit 1',
+}
+
+
+def main():
+    load_dotenv()
+    conninfo = f'host={os.getenv("DB_HOST")} port={os.getenv("DB_PORT")} dbname={os.getenv("DB_NAME")} user={os.getenv("DB_USER")} password={os.getenv("DB_PASSWORD")}'
+
+    with psycopg.connect(conninfo) as conn:
+        webpages = conn.execute('select count(*) from Webpage').fetchone()[0]
+        trigrams = conn.execute(queries.QUERIES['has_extension'], {'name': 'pg_trgm'}).fetchone()[0]
+        query = queries.QUERIES['search' if trigrams else 'search_without_trigrams']
+        print(f'{webpages} webpages, {"with" if trigrams else "without"} pg_trgm')
+
+        for role, account_query in ACCOUNTS.items():
+            account_id = conn.execute(account_query).fetchone()[0]
+            latencies = []
+            for _ in range(REPEATS):
+                for search in SEARCHES:
+                    start = time.perf_counter()
+                    conn.execute(query, {'account_id': account_id, 'query': search, 'username_prefix': search + '%', 'limit': 20}, prepare=True).fetchall()
+                    latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            print(f'{role:14} p50 {statistics.median(latencies):6.2f} ms   p99 {latencies[int(len(latencies) * 0.99) - 1]:6.2f} ms   max {latencies[-1]:6.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+'''
+Fills every table in schema.sql with a large, realistic dataset for benchmarks and query plans.
+The same seed and sizes always produce the same data.
+
+Usage:
+    python database/generate_dataset.py [--seed 0] [--accounts 100000] [--camps 10000] [--webpages 1000000] [--truncate]
+
+Every account's password is 'password'.
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+import psycopg
+from dotenv import load_dotenv
+from passlib.context import CryptContext
+
+GIVEN_NAMES = ['Olivia', 'Noah', 'Charlotte', 'Oliver', 'Amelia', 'Leo', 'Isla', 'Henry', 'Mia', 'Jack',
+               'Ava', 'William', 'Grace', 'Lucas', 'Chloe', 'Thomas', 'Zoe', 'Hudson', 'Ruby', 'James',
+               'Aarav', 'Mei', 'Priya', 'Wei', 'Sofia', 'Mateo', 'Aisha', 'Kai', 'Neffie', 'Lachlan']
+FAMILY_NAMES = ['Smith', 'Nguyen', 'Williams', 'Brown', 'Wilson', 'Taylor', 'Johnson', 'White', 'Martin',
+                'Anderson', 'Thompson', 'Lee', 'Walker', 'Harris', 'Ryan', 'Robinson', 'Kelly', 'King',
+                'Chen', 'Singh', 'Patel', 'Wang', 'Kim', 'Rossi', 'Shoesmith', 'Denile']
+WORDS = ['my', 'favourite', 'game', 'is', 'minecraft', 'and', 'i', 'like', 'to', 'build', 'castles', 'with',
+         'friends', 'this', 'website', 'about', 'dogs', 'cats', 'space', 'rockets', 'planets', 'soccer',
+         'dinosaurs', 'are', 'cool', 'the', 'best', 'pizza', 'has', 'pineapple', 'on', 'it', 'when', 'grow',
+         'up', 'want', 'be', 'a', 'programmer', 'scientist', 'welcome', 'page', 'hello', 'world', 'colours']
+TITLES = ['My Website', 'All About Me', 'Space Explorer', 'Dino World', 'Cool Cats', 'Soccer Stars',
+          'My Minecraft Builds', 'Pizza Reviews', 'Rocket Lab', 'Puppy Paradise', 'Art Gallery', 'My Hobbies']
+EXTRA_FILENAMES = ['styles.css', 'script.js', 'about.html', 'hobbies.html', 'gallery.html', 'contact.html']
+
+PASSWORD = 'password'
+FIRST_CAMP = datetime(2024, 1, 6, 9)
+
+# lower than the server's default, so tens of thousands of hashes don't take hours. passlib
+# reads the rounds from the hash, so logging in as a generated account still works
+pwd_context = CryptContext(schemes=['bcrypt'], bcrypt__rounds=4)
+BCRYPT_ALPHABET = './ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+
+TABLES = ['Audit_Log', 'Website_Views', 'Website_Stats', 'Published_File', 'Website_Thumbnail', 'Storage_Usage', 'Can_View_Website',
+          'Student_Owns_Website', 'Administrator_Owns_Website', 'Webpage', 'Website',
+          'Friendship', 'Has_Child', 'Attends', 'Camp', 'Teaches', 'Viewer', 'Guardian', 'Student', 'Administrator',
+          'Full_Account', 'Refresh_Token', 'Account']
+
+
+def lognormal_sizes(rng: random.Random, count: int, sigma: float) -> list[float]:
+    return [rng.lognormvariate(0, sigma) for _ in range(count)]
+
+
+def sentence(rng: random.Random, length: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.'
+
+
+def html_page(rng: random.Random, title: str, size: int) -> tuple[str, str]:
+    paragraphs = []
+    total = 0
+    while total < size:
+        paragraph = ' '.join(sentence(rng, rng.randint(4, 14)) for _ in range(rng.randint(1, 5)))
+        paragraphs.append(paragraph)
+        total += len(paragraph)
+    body = ''.join(f'    <p>{paragraph}</p>\n' for paragraph in paragraphs)
+    contents = ('<!DOCTYPE html>\n<html lang="en">\n  <head>\n'
+                f'    <title>{title}</title>\n    <link rel="stylesheet" href="styles.css" />\n'
+                f'  </head>\n  <body>\n    <h1>{title}</h1>\n{body}'
+                '    <script src="script.js"></script>\n  </body>\n</html>\n')
+    # the same text the server would index, ie. what's left without the HTML
+    return contents, ' '.join([title] + paragraphs)
+
+
+def css_page(rng: random.Random, size: int) -> str:
+    rules = []
+    total = 0
+    while total < size:
+        rule = (f'.{rng.choice(WORDS)}-{len(rules)} {{\n  color: #{rng.randrange(0x1000000):06x};\n'
+                f'  margin: {rng.randint(0, 32)}px;\n  font-size: {rng.randint(10, 48)}px;\n}}\n')
+        rules.append(rule)
+        total += len(rule)
+    return ''.join(rules)
+
+
+def js_page(rng: random.Random, size: int) -> str:
+    lines = []
+    total = 0
+    while total < size:
+        line = f"document.querySelector('h1').addEventListener('click', () => alert('{sentence(rng, 5)}'));\n"
+        lines.append(line)
+        total += len(line)
+    return ''.join(lines)
+
+
+def page_contents(rng: random.Random, filename: str, title: str) -> tuple[str, str]:
+    '''
+    Returns a page's contents, and the text it's searched by.
+    '''
+
+    # most pages are small, and a few students write a lot
+    size = int(min(rng.lognormvariate(6.5, 0.8), 50000))
+    if filename.endswith('.css'):
+        return css_page(rng, size), ''
+    if filename.endswith('.js'):
+        return js_page(rng, size), ''
+    return html_page(rng, title, size)
+
+
+def copy_rows(cur: psycopg.Cursor, table: str, columns: list[str], rows):
+    start = time.monotonic()
+    count = 0
+    with cur.copy(f'copy {table} ({", ".join(columns)}) from stdin') as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    print(f'{table}: {count} rows in {time.monotonic() - start:.1f}s')
+
+
+def generate(conn: psycopg.Connection, seed: int = 0, accounts: int = 100000, camps: int = 10000, webpages: int = 1000000):
+    '''
+    Fills every table with generated data, in one transaction. The tables must be empty.
+
+    Args:
+        conn (psycopg.Connection): The database to fill.
+        seed (int, optional): Seeds the generator. Defaults to 0.
+        accounts (int, optional): How many accounts to create, across all account types. Defaults to 100000.
+        camps (int, optional): How many camps to create. Each has its own administrator. Defaults to 10000.
+        webpages (int, optional): How many webpages to create, across all websites. Defaults to 1000000.
+    '''
+
+    if camps > accounts:
+        raise ValueError('There must be at least as many accounts as camps.')
+
+    rng = random.Random(seed)
+
+    # everyone else is split between students, guardians and viewers
+    others = accounts - camps
+    students = int(others * 0.8)
+    guardians = int(others * 0.15)
+    viewers = others - students - guardians
+
+    administrator_ids = list(range(1, camps + 1))
+    student_ids = list(range(camps + 1, camps + students + 1))
+    guardian_ids = list(range(camps + students + 1, camps + students + guardians + 1))
+    viewer_ids = list(range(camps + students + guardians + 1, accounts + 1))
+
+    # camps happen on Saturdays, and their class sizes vary
+    camp_times = [FIRST_CAMP + timedelta(weeks=camp // 20, minutes=camp % 20) for camp in range(camps)]
+    camp_of_student = rng.choices(range(camps), weights=lognormal_sizes(rng, camps, 0.5), k=students)
+    camp_students: list[list[int]] = [[] for _ in range(camps)]
+    for student_id, camp in zip(student_ids, camp_of_student):
+        camp_students[camp].append(student_id)
+
+    def registration_time(account_id: int) -> datetime:
+        if account_id <= camps:
+            return camp_times[account_id - 1] - timedelta(days=7)
+        if account_id <= camps + students:
+            return camp_times[camp_of_student[account_id - camps - 1]]
+        return camp_times[(account_id * 7919) % camps] + timedelta(hours=2)
+
+    # the salt includes the registration time, so each distinct time needs its own hash
+    password_hashes: dict[datetime, str] = {}
+
+    def hashed_password(registered: datetime) -> str:
+        if registered not in password_hashes:
+            # bcrypt's salt is taken from the seed too, otherwise the hashes would differ between runs
+            # (the last character only carries two bits, so it's one of the four with the rest zeroed)
+            salt = ''.join(rng.choice(BCRYPT_ALPHABET) for _ in range(21)) + rng.choice('.Oeu')
+            bcrypt = pwd_context.handler('bcrypt').using(salt=salt, rounds=4)
+            password_hashes[registered] = bcrypt.hash(PASSWORD + str(registered))
+        return password_hashes[registered]
+
+    def account_rows():
+        for account_id in range(1, accounts + 1):
+            given_name = rng.choice(GIVEN_NAMES)
+            family_name = rng.choice(FAMILY_NAMES)
+            registered = registration_time(account_id)
+            username = f'{given_name.lower()[:10]}{account_id}'
+            yield (account_id, given_name, family_name, username, hashed_password(registered), registered)
+
+    with conn.cursor() as cur:
+        copy_rows(cur, 'Account', ['id', 'given_name', 'family_name', 'username', 'hashed_password', 'registration_time'], account_rows())
+        copy_rows(cur, 'Full_Account', ['id', 'email', 'phone_number'],
+                  ((account_id, f'user{account_id}@example.com', f'04{account_id:08d}')
+                   for account_id in administrator_ids + guardian_ids))
+        copy_rows(cur, 'Administrator', ['id'], ((account_id,) for account_id in administrator_ids))
+        copy_rows(cur, 'Student', ['id'], ((account_id,) for account_id in student_ids))
+        copy_rows(cur, 'Guardian', ['id'], ((account_id,) for account_id in guardian_ids))
+        copy_rows(cur, 'Viewer', ['id'], ((account_id,) for account_id in viewer_ids))
+        copy_rows(cur, 'Teaches', ['administrator_id', 'student_id'],
+                  ((administrator_ids[camp], student_id) for student_id, camp in zip(student_ids, camp_of_student)))
+        copy_rows(cur, 'Camp', ['id', 'administrator_id', 'title', 'start_time'],
+                  ((camp + 1, administrator_ids[camp], f'Camp {camp + 1}', camp_times[camp]) for camp in range(camps)))
+        copy_rows(cur, 'Attends', ['student_id', 'camp_id'],
+                  ((student_id, camp + 1) for student_id, camp in zip(student_ids, camp_of_student)))
+
+        def child_rows():
+            for guardian_id in guardian_ids:
+                for student_id in set(rng.choices(student_ids, k=rng.choice([1, 1, 1, 2, 2, 3]))):
+                    yield (student_id, guardian_id)
+        copy_rows(cur, 'Has_Child', ['student_id', 'guardian_id'], child_rows())
+
+        def friendship_rows():
+            # most friends are classmates, and some are viewers (eg. friends from school)
+            for student_id, camp in zip(student_ids, camp_of_student):
+                friends = set()
+                for _ in range(min(int(rng.expovariate(1 / 3)), 20)):
+                    if viewer_ids and rng.random() < 0.1:
+                        friends.add(rng.choice(viewer_ids))
+                    else:
+                        friends.add(rng.choice(camp_students[camp]))
+                friends.discard(student_id)
+                for friend_id in friends:
+                    yield (student_id, friend_id)
+        copy_rows(cur, 'Friendship', ['student_id', 'friend_id'], friendship_rows())
+
+        # most students make one website, some make a few, and administrators make examples
+        website_owners: list[tuple[str, int]] = []
+        for student_id in student_ids:
+            website_owners += [('student', student_id)] * min(1 + int(rng.expovariate(2)), 10)
+        for administrator_id in administrator_ids:
+            website_owners += [('administrator', administrator_id)] * rng.choice([0, 0, 1, 2])
+        if webpages < len(website_owners):
+            website_owners = website_owners[:webpages]
+        website_ids = list(range(1, len(website_owners) + 1))
+
+        copy_rows(cur, 'Website', ['id', 'title'], ((website_id, rng.choice(TITLES)) for website_id in website_ids))
+        copy_rows(cur, 'Student_Owns_Website', ['student_id', 'website_id'],
+                  ((owner_id, website_id) for website_id, (owner_type, owner_id) in zip(website_ids, website_owners)
+                   if owner_type == 'student'))
+        copy_rows(cur, 'Administrator_Owns_Website', ['administrator_id', 'website_id'],
+                  ((owner_id, website_id) for website_id, (owner_type, owner_id) in zip(website_ids, website_owners)
+                   if owner_type == 'administrator'))
+
+        # every website has an index.html, and the rest of the pages are spread unevenly
+        page_counts = [1] * len(website_ids)
+        for index in rng.choices(range(len(website_ids)), weights=lognormal_sizes(rng, len(website_ids), 1), k=webpages - len(website_ids)):
+            page_counts[index] += 1
+
+        def webpage_rows():
+            webpage_id = 0
+            for website_id, page_count in zip(website_ids, page_counts):
+                title = rng.choice(TITLES)
+                for page in range(page_count):
+                    webpage_id += 1
+                    if page == 0:
+                        filename = 'index.html'
+                    elif page <= len(EXTRA_FILENAMES):
+                        filename = EXTRA_FILENAMES[page - 1]
+                    else:
+                        filename = f'page{page}.html'
+                    contents, text = page_contents(rng, filename, title)
+                    yield (webpage_id, website_id, filename, filename, contents, zlib.crc32(contents.encode()), text)
+        # pages go through a staging table, so their search vectors are built as they're inserted
+        # (with the same function uploads use) rather than by updating every row afterwards
+        cur.execute('create temporary table Generated_Webpage (id integer, website_id integer, title text, filename text, contents text, crc32 bigint, text text) on commit drop')
+        copy_rows(cur, 'Generated_Webpage', ['id', 'website_id', 'title', 'filename', 'contents', 'crc32', 'text'], webpage_rows())
+        start = time.monotonic()
+        cur.execute('''
+            insert into Webpage (id, website_id, title, filename, contents, crc32, search_vector)
+            select  id, website_id, title, filename, contents, crc32, webpage_search_vector(title, text)
+            from    Generated_Webpage
+        ''')
+        print(f'Webpage: {cur.rowcount} rows in {time.monotonic() - start:.1f}s')
+
+        def viewing_rows():
+            # guardians see their children's websites, and viewers are shared a few
+            children: dict[int, list[int]] = {}
+            cur.execute('select guardian_id, student_id from Has_Child order by guardian_id, student_id')
+            for guardian_id, student_id in cur.fetchall():
+                children.setdefault(guardian_id, []).append(student_id)
+            websites_of_student: dict[int, list[int]] = {}
+            for website_id, (owner_type, owner_id) in zip(website_ids, website_owners):
+                if owner_type == 'student':
+                    websites_of_student.setdefault(owner_id, []).append(website_id)
+
+            for guardian_id in guardian_ids:
+                for student_id in children.get(guardian_id, []):
+                    for website_id in websites_of_student.get(student_id, []):
+                        yield (guardian_id, website_id)
+            for viewer_id in viewer_ids:
+                for website_id in set(rng.choices(website_ids, k=rng.randint(1, 5))):
+                    yield (viewer_id, website_id)
+        copy_rows(cur, 'Can_View_Website', ['account_id', 'website_id'], list(viewing_rows()))
+
+        # the app keeps these counters up to date as things are uploaded, so they're worked out once here
+        cur.execute('''
+            insert into Storage_Usage (account_id, bytes, files, websites)
+            select  o.owner_id, coalesce(sum(p.bytes), 0), coalesce(sum(p.files), 0), count(*)
+            from    (select administrator_id as owner_id, website_id from Administrator_Owns_Website
+                     union all
+                     select student_id, website_id from Student_Owns_Website) o
+            left join (select website_id, sum(octet_length(contents)) as bytes, count(*) as files
+                       from Webpage group by website_id) p
+            on      p.website_id = o.website_id
+            group by o.owner_id
+        ''')
+
+        # the ids were given explicitly, so the sequences need to catch up
+        for table in ['Account', 'Camp', 'Website', 'Webpage']:
+            cur.execute(f"select setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) from {table}")
+
+        for table in TABLES:
+            cur.execute(f'analyze {table}')
+
+    conn.commit()
+
+
+def truncate(conn: psycopg.Connection):
+    with conn.cursor() as cur:
+        cur.execute(f'truncate {", ".join(TABLES)} restart identity cascade')
+    conn.commit()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fills the database with a large, reproducible dataset.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--accounts', type=int, default=100000)
+    parser.add_argument('--camps', type=int, default=10000)
+    parser.add_argument('--webpages', type=int, default=1000000)
+    parser.add_argument('--truncate', action='store_true', help='empty every table first')
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    if not os.getenv("DB_HOST") or not os.getenv("DB_PORT") or not os.getenv("DB_NAME") or not os.getenv("DB_USER") or not os.getenv("DB_PASSWORD"):
+        sys.exit("Could not find required database environment variables (ie. DB_HOST, DB_PORT, DB_NAME, DB_USER, or DB_PASSWORD).")
+
+    conninfo = f'host={os.getenv("DB_HOST")} port={os.getenv("DB_PORT")} dbname={os.getenv("DB_NAME")} user={os.getenv("DB_USER")} password={os.getenv("DB_PASSWORD")}'
+
+    with psycopg.connect(conninfo) as conn:
+        if args.truncate:
+            truncate(conn)
+        generate(conn, seed=args.seed, accounts=args.accounts, camps=args.camps, webpages=args.webpages)
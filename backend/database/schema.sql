@@ -46,6 +46,33 @@ create table Teaches (
 	primary key			(administrator_id, student_id)
 );
 
+/* a camp is one day's class. its students' logins are made all at once when it's created, and once
+   it's over it can be archived (its students can't log in, but their websites stay up) or purged.
+   the big tables aren't partitioned by camp - most of their rows (administrators' websites, viewers,
+   students who registered themselves) don't belong to one, and a unique username can't be enforced
+   across partitions. instead a camp's rows are found through Attends, and deleted a batch at a time */
+create table Camp (
+	id					serial,
+	administrator_id	integer					not null,
+	title				text					not null,
+	start_time			timestamp				not null	default		current_timestamp,
+	archived_time		timestamp,
+	primary key			(id),
+	foreign key			(administrator_id)		references	Administrator(id)
+);
+
+create index on Camp (administrator_id);
+
+create table Attends (
+	student_id			integer,
+	camp_id				integer					not null,
+	primary key			(student_id),
+	foreign key			(student_id)			references	Student(id),
+	foreign key			(camp_id)				references	Camp(id)
+);
+
+create index on Attends (camp_id);
+
 create table Guardian (
 	id					serial,
 	primary key			(id),
@@ -77,7 +104,7 @@ create table Friendship (
 /* a student may be friends with either another student or a viewer */
 create or replace function check_friendship() returns trigger as $$
 begin
-	if new.friend_id in (select id from Student) or (select id from Viewer) then
+	if exists (select 1 from Student where id = new.friend_id) or exists (select 1 from Viewer where id = new.friend_id) then
 		return new;
 	else
 		raise exception 'Friend must be either a student or a viewer';
@@ -87,12 +114,42 @@ $$ language plpgsql;
 
 create or replace trigger check_friendship before insert or update on Friendship for each row execute procedure check_friendship();
 
+/* the reverse lookups, for finding the websites an account can see */
+create index on Has_Child (guardian_id);
+create index on Friendship (friend_id);
+
+/* refresh tokens are only stored hashed. each is used once, and replaced by the next token
+   in its family - presenting a used token again revokes the whole family */
+create table Refresh_Token (
+	id					serial,
+	account_id			integer					not null,
+	family				text					not null,
+	token_hash			text					not null	unique,
+	expiry_time			timestamp				not null,
+	used				boolean					not null	default		false,
+	revoked				boolean					not null	default		false,
+	primary key			(id),
+	foreign key			(account_id)			references	Account(id)
+);
+
+create index on Refresh_Token (family);
+create index on Refresh_Token (account_id);
+
 create table Website (
 	id					serial,
 	title				text					not null,
+	search_vector		tsvector				generated always as (to_tsvector('english', title)) stored,
 	primary key			(id)
 );
 
+create index on Website using gin (search_vector);
+
+/* a webpage is searched by its title and its text, ie. its contents with the HTML stripped
+   (which the server does on upload). matches in the title rank higher */
+create or replace function webpage_search_vector(title text, body text) returns tsvector as $$
+	select setweight(to_tsvector('english', coalesce(title, '')), 'A') || setweight(to_tsvector('english', coalesce(body, '')), 'B');
+$$ language sql immutable;
+
 create table Webpage (
 	id					serial,
 	website_id			serial,
@@ -100,10 +157,104 @@ create table Webpage (
 	filename			text					not null,
 	-- url to HTML file
 	contents			text					not null,
+	-- of the contents (as UTF-8), so a zip of the website can be laid out without reading every file
+	crc32				bigint					not null,
+	search_vector		tsvector				not null	default		'',
 	primary key			(id),
-	foreign key			(website_id)				references	Website(id)
+	foreign key			(website_id)				references	Website(id),
+	unique				(website_id, filename)
 );
 
+create index on Webpage using gin (search_vector);
+
+/* how much each account stores, kept up to date as websites are created and files are uploaded
+   (in the same transaction), so checking a quota never means adding up every file */
+create table Storage_Usage (
+	account_id			integer,
+	bytes				bigint					not null	default		0,
+	files				integer					not null	default		0,
+	websites			integer					not null	default		0,
+	primary key			(account_id),
+	foreign key			(account_id)			references	Account(id)
+);
+
+/* what each website's files were last published (ie. optimized) as. the optimized files, and their
+   compressed versions, are kept in a content store on disk under their digest */
+create table Published_File (
+	website_id			integer					not null,
+	path				text					not null,
+	source				text					not null,
+	digest				text					not null,
+	media_type			text					not null,
+	original_size		integer					not null,
+	size				integer					not null,
+	gzip_size			integer,
+	brotli_size			integer,
+	published_time		timestamp				not null	default		current_timestamp,
+	primary key			(website_id, path),
+	foreign key			(website_id)			references	Website(id)
+);
+
+/* a picture of each website's index page, for galleries. it's kept in the content store under the
+   version (ie. the hash of the files) of the website it's of, so it's only rendered once per version */
+create table Website_Thumbnail (
+	website_id			integer,
+	version				text					not null,
+	extension			text					not null,
+	rendered_time		timestamp				not null	default		current_timestamp,
+	primary key			(website_id),
+	foreign key			(website_id)			references	Website(id)
+);
+
+/* logins, registrations, new websites and page views, written in batches by the server (with copy).
+   there are no foreign keys, since the log is kept after the accounts and websites in it are deleted */
+create table Audit_Log (
+	occurred_time		timestamp				not null,
+	kind				text					not null,
+	account_id			integer,
+	website_id			integer,
+	detail				text
+);
+
+/* rows are only ever appended, in time order, so a brin index is tiny and still finds a time range quickly */
+create index on Audit_Log using brin (occurred_time);
+
+/* each website's page views per day, rolled up from each batch of the log as it's written */
+create table Website_Views (
+	website_id			integer,
+	day					date,
+	views				bigint					not null	default		0,
+	primary key			(website_id, day),
+	foreign key			(website_id)			references	Website(id)
+);
+
+/* each website's viewers as a HyperLogLog (a byte per register), so unique viewers can be estimated
+   without keeping who they were. they're counted in memory, and combined with these every few seconds.
+   (its hits are its views, in Website_Views) */
+create table Website_Stats (
+	website_id			integer,
+	viewers				bytea					not null,
+	primary key			(website_id),
+	foreign key			(website_id)			references	Website(id)
+);
+
+/* combines two HyperLogLogs (of the same size) by taking the larger of each register */
+create or replace function hll_merge(a bytea, b bytea) returns bytea as $$
+	select decode(string_agg(lpad(to_hex(greatest(get_byte(a, i), get_byte(b, i))), 2, '0'), '' order by i), 'hex')
+	from generate_series(0, length(a) - 1) as i;
+$$ language sql immutable;
+
+/* titles and usernames are fuzzy matched with trigrams, when pg_trgm is available.
+   without it, search still works, but only matches whole words and username prefixes */
+do $$
+begin
+	create extension if not exists pg_trgm;
+	create index if not exists website_title_trgm_idx on Website using gin (title gin_trgm_ops);
+	create index if not exists account_username_trgm_idx on Account using gin (username gin_trgm_ops);
+exception when others then
+	raise notice 'pg_trgm is unavailable, so titles and usernames will not be fuzzy matched';
+end $$;
+
 create table Administrator_Owns_Website (
     administrator_id		serial,
     website_id 			serial,
@@ -120,6 +271,10 @@ create table Student_Owns_Website (
 	primary key			(student_id, website_id)
 );
 
+/* websites' owners are looked up from the website when searching */
+create index on Administrator_Owns_Website (website_id);
+create index on Student_Owns_Website (website_id);
+
 create table Can_View_Website (
 	account_id			serial,
 	website_id			serial,
@@ -130,7 +285,7 @@ create table Can_View_Website (
 
 create or replace function check_viewer_of_website() returns trigger as $$
 begin
-	if new.account_id in (select id from Viewer) or (select id from Guardian) then
+	if exists (select 1 from Viewer where id = new.account_id) or exists (select 1 from Guardian where id = new.account_id) then
 		return new;
 	else
 		raise exception 'Additional viewers of a website must be either a guardian or a viewer';
@@ -1,23 +1,128 @@
+import hashlib
 import pytest
 import psycopg
 import os
 
+from asgi_lifespan import LifespanManager
 from dotenv import load_dotenv
+from httpx import AsyncClient
 
 load_dotenv()
 
+from backend import main  # noqa: E402
+from . import testhelpers  # noqa: E402
 
-@pytest.fixture
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'database', 'schema.sql')
+
+
+def conninfo(dbname: str) -> str:
+    return f'host={os.getenv("DB_HOST")} port={os.getenv("DB_PORT")} dbname={dbname} user={os.getenv("DB_USER")} password={os.getenv("DB_PASSWORD")}'
+
+
+@pytest.fixture(scope='session')
 def anyio_backend():
+    # session scoped, so that the app (and its pool) can outlive a single test's event loop
     return 'asyncio'
 
 
+@pytest.fixture(scope='session')
+def database():
+    '''
+    Gives each test process (ie. each pytest-xdist worker) its own database, cloned from a
+    template that's only rebuilt when schema.sql changes. The app and any helpers connect to it
+    through DB_NAME, so tests never touch the database in .env.
+    '''
+
+    base_name = os.getenv('DB_NAME')
+    template_name = f'{base_name}_test_template'
+    database_name = f'{base_name}_test_{os.getenv("PYTEST_XDIST_WORKER", "main")}'
+
+    with open(SCHEMA_PATH, 'rb') as schema_file:
+        schema = schema_file.read()
+    schema_hash = hashlib.sha256(schema).hexdigest()
+
+    with psycopg.connect(conninfo(base_name), autocommit=True) as conn:
+        # workers start at the same time, so only one of them builds the template
+        conn.execute("select pg_advisory_lock(hashtext('webdevcamp tests'))")
+        res = conn.execute(
+            'select shobj_description(oid, \'pg_database\') from pg_database where datname = %s', (template_name,)).fetchone()
+        if res is None or res[0] != schema_hash:
+            conn.execute(f'drop database if exists {template_name} with (force)')
+            conn.execute(f'create database {template_name}')
+            with psycopg.connect(conninfo(template_name), autocommit=True) as template:
+                template.execute(schema)
+            conn.execute(f"comment on database {template_name} is '{schema_hash}'")
+
+        # a database left behind by an interrupted run is replaced
+        conn.execute(f'drop database if exists {database_name} with (force)')
+        conn.execute(f'create database {database_name} template {template_name}')
+        conn.execute("select pg_advisory_unlock(hashtext('webdevcamp tests'))")
+
+    os.environ['DB_NAME'] = database_name
+    try:
+        yield database_name
+    finally:
+        os.environ['DB_NAME'] = base_name
+        with psycopg.connect(conninfo(base_name), autocommit=True) as conn:
+            conn.execute(f'drop database if exists {database_name} with (force)')
+
+
+@pytest.fixture(scope='session')
+def truncate_statement(database) -> str:
+    with psycopg.connect(conninfo(database)) as conn:
+        tables = [row[0] for row in conn.execute("select tablename from pg_tables where schemaname = 'public' order by tablename")]
+    return f'truncate {", ".join(tables)} restart identity cascade'
+
+
+@pytest.fixture(scope='session')
+async def client(database, tmp_path_factory):
+    # bcrypt's work factor is the point in production, but it's most of the suite's running time
+    main.pwd_context.update(bcrypt__rounds=4)
+    # other test processes compete for the same CPU, which shouldn't make the app shed load.
+    # admission control is tested with its own detectors in test_admission.py
+    main.overload.max_pool_wait = main.overload.max_loop_lag = float('inf')
+    main.PUBLISHED_DIR = str(tmp_path_factory.mktemp('published'))
+
+    # the app starts once, rather than for every request a test makes. shutting it down can take as long
+    # as draining and flushing are allowed, which is longer than LifespanManager waits by default
+    async with LifespanManager(main.app, shutdown_timeout=main.SHUTDOWN_TIMEOUT_SECONDS + main.SHUTDOWN_FLUSH_SECONDS + 5):
+        # the event loop only runs during async tests, so the gaps between them would look like
+        # the loop stalling. the monitors are only left running while a test is (see app below)
+        await main.blocking_watchdog.stop()
+        await main.lag_monitor.stop()
+        async with AsyncClient(app=main.app, base_url='http://test') as ac:
+            testhelpers.client = ac
+            yield ac
+            testhelpers.client = None
+
+
+@pytest.fixture
+async def app(client):
+    main.lag_monitor.start()
+    main.blocking_watchdog.start()
+    yield main.app
+    await main.blocking_watchdog.stop()
+    await main.lag_monitor.stop()
+
+
+@pytest.fixture(autouse=True)
+def app_for_async_tests(request):
+    # tests that use the app (and so the database) have its monitors running while they do. the first one
+    # starts the app, which keeps the event loop open for the rest of the session. tests that don't use
+    # it, eg. the minifier's, don't need a database at all
+    if 'client' in request.fixturenames:
+        request.getfixturevalue('app')
+
+
 @pytest.fixture
-def test_db():
-    conninfo = f'host={os.getenv("DB_HOST")} port={os.getenv("DB_PORT")} dbname={os.getenv("DB_NAME")} user={os.getenv("DB_USER")} password={os.getenv("DB_PASSWORD")}'
-    with psycopg.connect(conninfo) as conn:
-        with conn.cursor() as cur:
-            # currently only deletes account and the tables that reference account
-            # ...which is (almost) all of them, i believe
-            cur.execute('truncate account cascade')
-            conn.commit()
+async def test_db(client, truncate_statement):
+    # the app commits through its own connections, so a test can't be wrapped in a transaction
+    # (or a savepoint) and rolled back. emptying every table through the app's pool is the next
+    # cheapest thing, and is much quicker than cloning the template again. publishes from
+    # the last test are finished first, so they don't write to the tables after they're emptied.
+    # so are its audit log and analytics, since a view of one test's website would be counted for the next one's
+    await main.publisher.idle()
+    await main.audit_log.flush()
+    await main.site_analytics.flush()
+    async with main.db_pool.connection() as conn:
+        await conn.execute(truncate_statement)
@@ -0,0 +1,165 @@
+import asyncio
+import time
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+from backend.admission import AdmissionMiddleware, ConcurrencyLimit, OverloadDetector
+from backend.monitoring import LoopLagMonitor
+
+
+def build_app(limits: dict[str, ConcurrencyLimit], default_limit: ConcurrencyLimit, detector: OverloadDetector = None):
+    app = FastAPI()
+    # the single CPU is modelled as a lock, so requests are served one at a time
+    cpu = asyncio.Lock()
+
+    @app.get('/work')
+    async def work():
+        async with cpu:
+            await asyncio.sleep(0.01)
+        return {'status': 'ok'}
+
+    @app.get('/healthcheck')
+    def healthcheck():
+        return {'status': 'ok'}
+
+    if detector is None:
+        detector = OverloadDetector(LoopLagMonitor())
+    return AdmissionMiddleware(app, limits=limits, default_limit=default_limit, detector=detector)
+
+
+async def timed_get(ac: AsyncClient, url: str):
+    start = time.monotonic()
+    res = await ac.get(url)
+    return res, time.monotonic() - start
+
+
+def p99(latencies: list[float]) -> float:
+    return sorted(latencies)[int(len(latencies) * 0.99) - 1]
+
+
+@pytest.mark.anyio
+async def test_concurrency_limit_queues_then_times_out():
+    limit = ConcurrencyLimit(concurrency=1, queue_timeout=0.05)
+    assert await limit.acquire()
+    # the second request waits, and gives up once the queue timeout passes
+    assert not await limit.acquire()
+    limit.release()
+    assert await limit.acquire()
+
+
+@pytest.mark.anyio
+async def test_concurrency_limit_hands_over_turns():
+    limit = ConcurrencyLimit(concurrency=1, queue_timeout=1)
+    assert await limit.acquire()
+    waiting = asyncio.ensure_future(limit.acquire())
+    await asyncio.sleep(0)
+    limit.release()
+
+    assert await waiting
+    assert limit.active == 1
+    assert not limit.waiters
+
+
+@pytest.mark.anyio
+async def test_concurrency_limit_rejects_when_queue_is_full():
+    limit = ConcurrencyLimit(concurrency=1, queue_timeout=1, max_queue=1)
+    assert await limit.acquire()
+    waiting = asyncio.ensure_future(limit.acquire())
+    await asyncio.sleep(0)
+
+    assert not await limit.acquire()
+    limit.release()
+    assert await waiting
+
+
+@pytest.mark.anyio
+async def test_p99_stays_bounded_under_overload():
+    concurrency = 200
+    urls = ['/work'] * concurrency
+
+    # without admission control, every request queues behind every other one
+    unbounded = build_app({}, ConcurrencyLimit(concurrency=concurrency, queue_timeout=60))
+    async with AsyncClient(app=unbounded, base_url='http://test') as ac:
+        results = await asyncio.gather(*(timed_get(ac, url) for url in urls))
+    unbounded_p99 = p99([latency for _, latency in results])
+
+    bounded = build_app({}, ConcurrencyLimit(concurrency=2, queue_timeout=0.1, max_queue=8))
+    async with AsyncClient(app=bounded, base_url='http://test') as ac:
+        results = await asyncio.gather(*(timed_get(ac, url) for url in urls))
+    bounded_p99 = p99([latency for _, latency in results])
+    statuses = [res.status_code for res, _ in results]
+
+    assert 200 in statuses
+    assert 503 in statuses
+    assert all(res.headers['retry-after'] for res, _ in results if res.status_code == 503)
+    # requests are either served within the queue timeout or turned away quickly
+    assert bounded_p99 < 0.5, bounded_p99
+    assert bounded_p99 < unbounded_p99 / 2, (bounded_p99, unbounded_p99)
+
+
+@pytest.mark.anyio
+async def test_routes_have_their_own_limits():
+    app = build_app({'/work': ConcurrencyLimit(concurrency=1, queue_timeout=0.01, max_queue=0)},
+                    ConcurrencyLimit(concurrency=50, queue_timeout=1))
+    async with AsyncClient(app=app, base_url='http://test') as ac:
+        responses = await asyncio.gather(*(ac.get('/work') for _ in range(10)), *(ac.get('/healthcheck') for _ in range(10)))
+
+    work_statuses = [res.status_code for res in responses[:10]]
+    assert 503 in work_statuses
+    assert all(res.status_code == 200 for res in responses[10:])
+
+
+@pytest.mark.anyio
+async def test_overloaded_server_sheds_load():
+    detector = OverloadDetector(LoopLagMonitor(), max_pool_wait=0.1)
+    app = build_app({'/healthcheck': ConcurrencyLimit(concurrency=10, queue_timeout=1, sheddable=False)},
+                    ConcurrencyLimit(concurrency=10, queue_timeout=1),
+                    detector)
+
+    for _ in range(20):
+        detector.record_pool_wait(1)
+    assert detector.overloaded()
+
+    async with AsyncClient(app=app, base_url='http://test') as ac:
+        res = await ac.get('/work')
+        assert res.status_code == 503
+        assert res.headers['retry-after'] == '1'
+
+        # the health check is never shed, so the machine isn't restarted for being busy
+        res = await ac.get('/healthcheck')
+        assert res.status_code == 200
+
+    for _ in range(50):
+        detector.record_pool_wait(0)
+    assert not detector.overloaded()
+
+
+@pytest.mark.anyio
+async def test_shedding_stops_once_the_overload_clears():
+    detector = OverloadDetector(LoopLagMonitor(), max_pool_wait=0.1, half_life=0.05)
+    app = build_app({}, ConcurrencyLimit(concurrency=10, queue_timeout=1), detector)
+    for _ in range(20):
+        detector.record_pool_wait(1)
+
+    async with AsyncClient(app=app, base_url='http://test') as ac:
+        res = await ac.get('/work')
+        assert res.status_code == 503
+
+        # shed requests never borrow a connection, so there are no new waits to bring the average down.
+        # it comes down on its own instead, and requests are served again
+        await asyncio.sleep(0.5)
+        assert not detector.overloaded()
+        res = await ac.get('/work')
+        assert res.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_loop_lag_monitor_notices_blocked_loop():
+    monitor = LoopLagMonitor(interval=0.01, smoothing=1)
+    monitor.start()
+    await asyncio.sleep(0.02)
+    time.sleep(0.1)
+    await asyncio.sleep(0.02)
+    await monitor.stop()
+
+    assert monitor.max_lag >= 0.05
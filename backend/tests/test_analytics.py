@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+from backend import main
+from backend.analytics import HyperLogLog, SiteAnalytics
+from . import testhelpers
+from .test_audit import viewed_website
+
+
+def test_hyperloglog():
+    for viewers in (0, 1, 50, 5000):
+        hll = HyperLogLog()
+        for viewer in range(viewers):
+            # viewers who come back aren't counted again
+            hll.add(f'viewer {viewer}')
+            hll.add(f'viewer {viewer}')
+        assert abs(hll.count() - viewers) <= viewers * 0.05
+
+    # combining two counts only counts the viewers they share once
+    first, second = HyperLogLog(), HyperLogLog()
+    for viewer in range(2000):
+        first.add(f'viewer {viewer}')
+        second.add(f'viewer {viewer + 1000}')
+    first.merge(second)
+    assert abs(first.count() - 3000) <= 150
+
+
+@pytest.mark.anyio
+async def test_viewers_are_saved_together():
+    saves = []
+    failing = True
+
+    async def save(viewers):
+        if failing:
+            raise ConnectionError('database is down')
+        saves.append({website_id: hll.count() for website_id, hll in viewers.items()})
+
+    analytics = SiteAnalytics(save, max_websites=2)
+    for viewer in ('a', 'b', 'a'):
+        analytics.record(1, viewer)
+    analytics.record(2, 'a')
+    # there isn't room for a third website
+    analytics.record(3, 'a')
+    assert analytics.dropped == 1
+    assert not await analytics.flush()
+
+    # viewers that couldn't be saved are kept, and added to
+    analytics.record(1, 'c')
+    assert analytics.unsaved(1).count() == 3
+    failing = False
+    assert await analytics.flush()
+    assert saves == [{1: 3, 2: 1}]
+    assert analytics.unsaved(1).count() == 0
+
+
+@pytest.mark.anyio
+async def test_cancelled_saves_are_kept():
+    async def save(viewers):
+        await asyncio.Event().wait()
+
+    analytics = SiteAnalytics(save)
+    analytics.record(1, 'a')
+    saving = asyncio.create_task(analytics.flush())
+    await asyncio.sleep(0.01)
+    analytics.record(1, 'b')
+    saving.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await saving
+    assert analytics.pending[1].count() == 2
+    assert analytics.saving == {}
+
+
+@pytest.mark.anyio
+async def test_website_stats(test_db):
+    _, website_id = await viewed_website()
+
+    # counts that haven't been saved are included
+    res = await testhelpers.get(f'/website/{website_id}/stats')
+    assert res.status_code == 200, res.text
+    assert res.json() == {'website_id': website_id, 'hits': 2, 'unique_viewers': 1}
+
+    await main.site_analytics.flush()
+    await testhelpers.client.get(f'/website/{website_id}/index.html', headers={'User-Agent': 'another browser'})
+    res = await testhelpers.get(f'/website/{website_id}/stats')
+    assert res.json() == {'website_id': website_id, 'hits': 3, 'unique_viewers': 2}
+
+    # once they're all saved, they're added to what was
+    await main.site_analytics.flush()
+    for _ in range(2):
+        await testhelpers.client.get(f'/website/{website_id}/index.html', headers={'User-Agent': 'another browser'})
+    await main.site_analytics.flush()
+    res = await testhelpers.get(f'/website/{website_id}/stats')
+    assert res.json() == {'website_id': website_id, 'hits': 5, 'unique_viewers': 2}
+
+    res = await testhelpers.get('/website/999/stats')
+    assert res.status_code == 404
@@ -0,0 +1,227 @@
+import asyncio
+import gzip
+import os
+import pytest
+from backend import main
+from backend.assets import minify_css, minify_html, minify_js, optimize_site
+from backend.publishing import Publisher
+from backend.store import ContentStore
+from .testdata import TestData as d
+from .testhelpers import register_administrator, login, create_website, upload_webpage, get
+
+PAGE = b'''<!DOCTYPE html>
+<html>
+  <head>
+    <!-- the stylesheet -->
+    <link rel="stylesheet" href="styles.css" />
+  </head>
+  <body>
+    <h1>My   Website</h1>
+    <pre>  spaced
+    out</pre>
+    <script src="./script.js"></script>
+  </body>
+</html>
+'''
+STYLES = b'''/* colours */
+body {
+  background: url("bg.svg");
+  font-family: "Comic Sans MS", cursive;
+  width: calc(100% - 2px);
+}
+''' * 20
+SCRIPT = b'''// says hello
+const greeting = 'hello // world';
+let halves = 10 / 2 / 1;
+const pattern = /\\/\\//g;
+document.querySelector('h1').addEventListener('click', () => {
+    alert(`${greeting}
+    !`);
+});
+''' * 20
+
+
+def test_minify_css():
+    assert minify_css(STYLES.decode()[:STYLES.index(b'}') + 1]) == \
+        'body{background:url("bg.svg");font-family:"Comic Sans MS",cursive;width:calc(100% - 2px)}'
+    # spaces that separate selectors are kept, but not those around a declaration's colon
+    assert minify_css('a :hover , ul  li > b { color : red ; margin : 0 }') == 'a :hover,ul li>b{color:red;margin:0}'
+    assert minify_css('@media screen { a :hover { color : red } }') == '@media screen{a :hover{color:red}}'
+    assert minify_css('a[title="x;y"] :hover { content : "a ; b" }') == 'a[title="x;y"] :hover{content:"a ; b"}'
+
+
+def test_minify_js():
+    minified = minify_js(SCRIPT.decode()[:SCRIPT.index(b'});') + 3])
+    assert minified == ("const greeting='hello // world';\n"
+                        "let halves=10 / 2 / 1;\n"
+                        "const pattern=/\\/\\//g;\n"
+                        "document.querySelector('h1').addEventListener('click',()=>{\n"
+                        "alert(`${greeting}\n    !`);\n"
+                        "});")
+    # line breaks are kept, since statements can end at them
+    assert minify_js('let a = 1\nlet b = 2') == 'let a=1\nlet b=2'
+    assert minify_js('a = b + +c - -d') == 'a=b + +c - -d'
+    assert minify_js('return /x/.test(y)') == 'return /x/.test(y)'
+
+
+def test_minify_html():
+    assert minify_html(PAGE.decode()) == ('<!DOCTYPE html> <html> <head> <link rel="stylesheet" href="styles.css" /> </head> '
+                                          '<body> <h1>My Website</h1> <pre>  spaced\n    out</pre> '
+                                          '<script src="./script.js"></script> </body> </html>')
+    assert minify_html('<style> p { color: red; } </style><script type="text/template"> <b> x </b> </script>') == \
+        '<style>p{color:red}</style><script type="text/template"> <b> x </b> </script>'
+    # attribute values and preformatted text are shown as they're written
+    assert minify_html('<img  alt="two  spaces"\n  title=\'a\n b\'>  <input value=" x  " data-x="<!-- y -->">') == \
+        '<img alt="two  spaces" title=\'a\n b\'> <input value=" x  " data-x="<!-- y -->">'
+    assert minify_html('<pre title="a  b">  x\n  y</pre>\n<!-- z -->\n<textarea>  z  </textarea>') == \
+        '<pre title="a  b">  x\n  y</pre> <textarea>  z  </textarea>'
+    assert minify_html("<p>don't  \"quote\"   me</p>") == "<p>don't \"quote\" me</p>"
+
+
+def test_optimize_site(tmp_path):
+    files = {'index.html': PAGE.decode(), 'styles.css': STYLES.decode(), 'script.js': SCRIPT.decode(),
+             'bg.svg': '<svg>\n  <!-- background -->\n  <rect />\n</svg>'}
+    manifest = {entry['source']: entry for entry in optimize_site(files, str(tmp_path))}
+    store = ContentStore(str(tmp_path))
+
+    # everything but the page gets a content-hashed name
+    assert manifest['index.html']['path'] == 'index.html'
+    for source in ('styles.css', 'script.js', 'bg.svg'):
+        stem, extension = os.path.splitext(source)
+        assert manifest[source]['path'].startswith(stem + '.')
+        assert manifest[source]['path'].endswith(extension)
+        assert manifest[source]['size'] < manifest[source]['original_size']
+
+    # and references to those files are rewritten, including the stylesheet's reference to the image
+    with open(store.path(manifest['index.html']['digest']), 'rb') as page_file:
+        page = page_file.read().decode()
+    assert f'href="{manifest["styles.css"]["path"]}"' in page
+    assert f'src="{manifest["script.js"]["path"]}"' in page
+    with open(store.path(manifest['styles.css']['digest']), 'rb') as styles_file:
+        assert f'url("{manifest["bg.svg"]["path"]}")' in styles_file.read().decode()
+
+    # compressed versions are stored alongside, and only when they're smaller
+    with open(store.path(manifest['script.js']['digest'], 'gzip'), 'rb') as gzip_file:
+        assert gzip.decompress(gzip_file.read()) == minify_js(SCRIPT.decode()).encode()
+    assert manifest['script.js']['brotli_size'] < manifest['script.js']['gzip_size'] < manifest['script.js']['size']
+    assert manifest['bg.svg']['gzip_size'] is None
+
+
+def test_unchanged_files_keep_their_names(tmp_path):
+    files = {'index.html': PAGE.decode(), 'styles.css': STYLES.decode(), 'script.js': SCRIPT.decode()}
+    first = {entry['source']: entry['path'] for entry in optimize_site(files, str(tmp_path))}
+    files['script.js'] += 'console.log(1);'
+    second = {entry['source']: entry['path'] for entry in optimize_site(files, str(tmp_path))}
+
+    assert first['styles.css'] == second['styles.css']
+    assert first['script.js'] != second['script.js']
+
+
+@pytest.mark.anyio
+async def test_changes_during_a_publish_are_coalesced(tmp_path):
+    loads = []
+    saved = []
+    loading = asyncio.Event()
+    release = asyncio.Event()
+
+    async def load_files(website_id):
+        loads.append(website_id)
+        loading.set()
+        await release.wait()
+        return {'index.html': '<p>hello</p>'}
+
+    async def save_manifest(website_id, manifest):
+        saved.append((website_id, manifest[0]['path']))
+
+    publisher = Publisher(load_files, save_manifest)
+    publisher.start(str(tmp_path))
+    try:
+        publisher.request(1)
+        await loading.wait()
+        for _ in range(4):
+            publisher.request(1)
+        publisher.request(2)
+        release.set()
+        await publisher.idle()
+    finally:
+        await publisher.stop()
+
+    # the four requests made while the first publish ran only publish once more
+    assert sorted(loads) == [1, 1, 2]
+    assert publisher.published == 3
+    assert sorted(saved) == [(1, 'index.html'), (1, 'index.html'), (2, 'index.html')]
+
+
+async def published_website():
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    for filename, contents in (('index.html', PAGE), ('styles.css', STYLES), ('script.js', SCRIPT)):
+        res = await upload_webpage(token, website_id, {'webpage': (filename, contents)})
+        assert res.status_code == 200, res.text
+    await main.publisher.idle()
+    return website_id
+
+
+@pytest.mark.anyio
+async def test_publication_report(test_db):
+    website_id = await published_website()
+
+    res = await get(f'/published/{website_id}')
+    assert res.status_code == 200, res.text
+    report = res.json()
+    assert {file['source'] for file in report['files']} == {'index.html', 'styles.css', 'script.js'}
+    assert report['original_bytes'] == len(PAGE) + len(STYLES) + len(SCRIPT)
+    assert report['transferred_bytes'] < report['optimized_bytes'] < report['original_bytes']
+    assert report['saved_bytes'] == report['original_bytes'] - report['transferred_bytes']
+
+    res = await get('/published/0')
+    assert res.status_code == 404, res.text
+
+
+@pytest.mark.anyio
+async def test_published_files_are_served_precompressed(test_db):
+    website_id = await published_website()
+
+    res = await get(f'/published/{website_id}/index.html', headers={'Accept-Encoding': 'identity'})
+    assert res.status_code == 200, res.text
+    assert res.headers['cache-control'] == 'no-cache'
+    assert '<h1>My Website</h1>' in res.text
+    files = {file['source']: file['path'] for file in (await get(f'/published/{website_id}')).json()['files']}
+    assert files['script.js'] in res.text
+
+    res = await get(f'/published/{website_id}/{files["script.js"]}', headers={'Accept-Encoding': 'br'})
+    assert res.status_code == 200, res.text
+    assert res.headers['content-encoding'] == 'br'
+    assert res.headers['cache-control'] == 'public, max-age=31536000, immutable'
+    assert res.headers['content-type'].startswith('text/javascript')
+    # httpx decompresses the body itself
+    assert res.content == minify_js(SCRIPT.decode()).encode()
+
+    res = await get(f'/published/{website_id}/{files["script.js"]}', headers={'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['etag']})
+    assert res.status_code == 304, res.text
+
+    # the original names aren't published, only the hashed ones
+    res = await get(f'/published/{website_id}/script.js')
+    assert res.status_code == 404, res.text
+
+
+@pytest.mark.anyio
+async def test_uploads_republish_the_website(test_db):
+    website_id = await published_website()
+    res = await get(f'/published/{website_id}')
+    old_path = next(file['path'] for file in res.json()['files'] if file['source'] == 'styles.css')
+
+    res = await login(d.logging_in_administrator)
+    res = await upload_webpage(res.json()['access_token'], website_id, {'webpage': ('styles.css', b'body { color: red; }')})
+    assert res.status_code == 200, res.text
+    await main.publisher.idle()
+
+    res = await get(f'/published/{website_id}')
+    new_path = next(file['path'] for file in res.json()['files'] if file['source'] == 'styles.css')
+    assert new_path != old_path
+    res = await get(f'/published/{website_id}/index.html')
+    assert new_path in res.text
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import pytest
+from backend import main
+from backend.audit import AuditLog, RotatingFileSink
+from .testdata import TestData as d
+from .testhelpers import register_administrator, login, create_website, upload_webpage, get_webpage, get
+
+
+@pytest.mark.anyio
+async def test_full_buffer_drops_the_oldest_events():
+    batches = []
+
+    async def write(events):
+        batches.append(events)
+
+    log = AuditLog(write, capacity=3, batch_size=2)
+    for website_id in range(5):
+        log.record('view', website_id=website_id)
+    assert log.dropped == 2
+
+    assert await log.flush()
+    # the count of what was lost goes with the next batch
+    assert [[(event.kind, event.website_id, event.detail) for event in batch] for batch in batches] == [
+        [('view', 2, None), ('view', 3, None), ('dropped', None, '2')],
+        [('view', 4, None)]
+    ]
+    assert log.written == 4
+
+
+@pytest.mark.anyio
+async def test_unwritten_events_are_kept():
+    written = []
+    failing = True
+
+    async def write(events):
+        if failing:
+            raise ConnectionError('database is down')
+        written.extend(events)
+
+    log = AuditLog(write, capacity=3)
+    log.record('login', account_id=1)
+    log.record('login', account_id=2)
+    assert not await log.flush()
+
+    # the failed batch goes back in front of newer events, as far as there's room
+    log.record('login', account_id=3)
+    log.record('login', account_id=4)
+    failing = False
+    assert await log.flush()
+    assert [(event.kind, event.account_id, event.detail) for event in written] == [
+        ('login', 2, None), ('login', 3, None), ('login', 4, None), ('dropped', None, '1')]
+
+
+@pytest.mark.anyio
+async def test_cancelled_writes_are_kept():
+    writing = asyncio.Event()
+
+    async def write(events):
+        writing.set()
+        await asyncio.Event().wait()
+
+    log = AuditLog(write)
+    log.record('login', account_id=1)
+    flushing = asyncio.create_task(log.flush())
+    await writing.wait()
+    flushing.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await flushing
+    assert [event.account_id for event in log.buffer] == [1]
+    assert log.dropped == 0
+    assert log.writing == []
+
+
+@pytest.mark.anyio
+async def test_rotating_file_sink(tmp_path):
+    path = str(tmp_path / 'audit.log')
+    sink = RotatingFileSink(path, max_bytes=300, backups=2)
+    log = AuditLog(sink.write)
+    for batch in range(6):
+        log.record('login', account_id=batch, detail='x' * 50)
+        await log.flush()
+
+    # only the newest files are kept, and none of them are over the limit
+    assert sorted(file.name for file in tmp_path.iterdir()) == ['audit.log', 'audit.log.1', 'audit.log.2']
+    with open(path) as file:
+        lines = [json.loads(line) for line in file]
+    assert lines[-1]['account_id'] == 5
+    assert lines[-1]['kind'] == 'login'
+    assert all(file.stat().st_size <= 300 for file in tmp_path.iterdir())
+
+
+async def audit_rows() -> list[tuple]:
+    await main.audit_log.flush()
+    async with main.db_pool.connection() as conn:
+        res = await conn.execute('select kind, account_id, website_id, detail from Audit_Log order by occurred_time')
+        return await res.fetchall()
+
+
+async def viewed_website() -> tuple[int, int]:
+    res = await register_administrator()
+    account_id = res.json()['account_id']
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+    res = await create_website(token, {'title': 'Dinosaurs'})
+    website_id = res.json()['website_id']
+    await upload_webpage(token, website_id, {'webpage': ('index.html', b'<p>roar</p>')})
+    await upload_webpage(token, website_id, {'webpage': ('styles.css', b'p { color: green; }')})
+
+    for filename in ('index.html', 'index.html', 'styles.css'):
+        res = await get_webpage(website_id, filename)
+        assert res.status_code == 200
+    return account_id, website_id
+
+
+@pytest.mark.anyio
+async def test_events_are_logged(test_db):
+    res = await login({'username': 'nobody', 'password': 'password'})
+    assert res.status_code == 400
+    account_id, website_id = await viewed_website()
+    res = await login({'username': d.logging_in_administrator['username'], 'password': 'wrong'})
+    assert res.status_code == 400
+
+    assert await audit_rows() == [
+        ('login_failed', None, None, 'nobody'),
+        ('register', account_id, None, 'administrator'),
+        ('login', account_id, None, None),
+        ('create_website', account_id, website_id, None),
+        # stylesheets aren't views
+        ('view', None, website_id, 'index.html'),
+        ('view', None, website_id, 'index.html'),
+        ('login_failed', account_id, None, d.logging_in_administrator['username']),
+    ]
+
+
+@pytest.mark.anyio
+async def test_website_views(test_db):
+    _, website_id = await viewed_website()
+    await main.publisher.idle()
+    res = await get(f'/published/{website_id}/index.html')
+    assert res.status_code == 200
+    await main.audit_log.flush()
+
+    res = await get(f'/website/{website_id}/views')
+    assert res.status_code == 200, res.text
+    views = res.json()
+    assert views['total'] == 3
+    assert [day['views'] for day in views['days']] == [3]
+
+    # more views are added to the day's count
+    await get_webpage(website_id, 'index.html')
+    await main.audit_log.flush()
+    res = await get(f'/website/{website_id}/views?days=1')
+    assert res.json()['total'] == 4
+
+    res = await get(f'/website/{website_id}/views?days=0')
+    assert res.status_code == 400
+    res = await get('/website/999/views')
+    assert res.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_audit_log_file(test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'audit_file', RotatingFileSink(str(tmp_path / 'audit.log')))
+    _, website_id = await viewed_website()
+
+    # the log goes to the file instead, but views are still counted
+    assert await audit_rows() == []
+    with open(tmp_path / 'audit.log') as file:
+        assert [json.loads(line)['kind'] for line in file] == ['register', 'login', 'create_website', 'view', 'view']
+    res = await get(f'/website/{website_id}/views')
+    assert res.json()['total'] == 2
+
+    # a batch the file couldn't take is written again, but its views are only counted once
+    sink = main.audit_file
+    sink_write = sink.write
+    failing = True
+
+    async def write(events):
+        if failing:
+            raise OSError('disk full')
+        await sink_write(events)
+
+    monkeypatch.setattr(sink, 'write', write)
+    await get_webpage(website_id, 'index.html')
+    assert not await main.audit_log.flush()
+    failing = False
+    assert await main.audit_log.flush()
+    res = await get(f'/website/{website_id}/views')
+    assert res.json()['total'] == 3
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from backend.batching import BatchFlusher
+
+
+class ListFlusher(BatchFlusher):
+    # writes numbers to a list, once it's let
+    def __init__(self):
+        super().__init__(interval=0.01)
+        self.pending = []
+        self.written = []
+        self.writing = asyncio.Event()
+        self.release = asyncio.Event()
+
+    async def write_pending(self) -> bool:
+        if not self.pending:
+            return True
+        batch, self.pending = self.pending, []
+        self.writing.set()
+        try:
+            await self.release.wait()
+        except BaseException:
+            self.pending = batch + self.pending
+            raise
+        self.written.extend(batch)
+        return True
+
+
+@pytest.mark.anyio
+async def test_stopping_waits_for_a_write():
+    flusher = ListFlusher()
+    flusher.start()
+    flusher.pending = [1, 2]
+    await flusher.writing.wait()
+
+    # the write that's under way isn't cut off, and what came in meanwhile is written after it
+    stopping = asyncio.create_task(flusher.stop())
+    await asyncio.sleep(0.05)
+    assert not stopping.done()
+    flusher.pending.append(3)
+    flusher.release.set()
+    await stopping
+    assert flusher.written == [1, 2, 3]
+    assert flusher.task is None
+
+
+@pytest.mark.anyio
+async def test_ready_flushes_straight_away():
+    flusher = ListFlusher()
+    flusher.interval = 60
+    flusher.release.set()
+    flusher.start()
+    flusher.pending = [1]
+    flusher.ready.set()
+    await asyncio.wait_for(flusher.writing.wait(), 1)
+    await flusher.stop()
+    assert flusher.written == [1]
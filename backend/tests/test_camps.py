@@ -0,0 +1,224 @@
+import io
+import pytest
+import time
+import zipfile
+from backend import main
+from backend.admission import AdmissionMiddleware
+from .testdata import TestData as d
+from .testhelpers import register_administrator, login, create_website, upload_webpage, get_website, get, refresh_token
+from . import testhelpers
+from .test_search import other_administrator_token
+
+
+def auth(token: str) -> dict:
+    return {'Authorization': 'Bearer ' + token}
+
+
+async def create_camp(token: str, camp: dict):
+    return await testhelpers.client.post('/camp', json=camp, headers=auth(token))
+
+
+async def administrator_token() -> str:
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    return res.json()['access_token']
+
+
+async def camp_with_websites(token: str, students: int = 3, prefix: str = 'dinos') -> tuple[int, list[dict], list[int]]:
+    '''
+    Creates a camp where each student makes a website with a page on it.
+    Returns the camp's ID, its students' logins, and their websites' IDs.
+    '''
+
+    res = await create_camp(token, {'title': 'Dinosaur Day', 'students': students, 'username_prefix': prefix})
+    assert res.status_code == 200, res.text
+    camp = res.json()
+
+    website_ids = []
+    for student in camp['students']:
+        res = await login({'username': student['username'], 'password': student['password']})
+        assert res.status_code == 200, res.text
+        student['refresh_token'] = res.json()['refresh_token']
+        student_token = res.json()['access_token']
+        res = await create_website(student_token, {'title': f"{student['username']}'s Dinosaurs"})
+        website_id = res.json()['website_id']
+        await upload_webpage(student_token, website_id, {'webpage': ('index.html', f"<p>{student['username']}</p>".encode())})
+        website_ids.append(website_id)
+    return camp['camp_id'], camp['students'], website_ids
+
+
+@pytest.mark.anyio
+async def test_create_camp(test_db):
+    token = await administrator_token()
+    res = await create_camp(token, {'title': 'Dinosaur Day', 'students': 3})
+    assert res.status_code == 200, res.text
+    camp = res.json()
+    assert [student['username'] for student in camp['students']] == [f"camp{camp['camp_id']}-{n}" for n in (1, 2, 3)]
+    assert len({student['password'] for student in camp['students']}) == 3
+
+    # every student can log in, and is taught by the administrator
+    for student in camp['students']:
+        res = await login({'username': student['username'], 'password': student['password']})
+        assert res.status_code == 200, res.text
+        assert res.json()['account_id'] == student['student_id']
+    res = await get('/usage', headers=auth(token))
+    assert len(res.json()['students']) == 3
+
+
+@pytest.mark.anyio
+async def test_camp_passwords_are_hashed_a_few_at_a_time(test_db, monkeypatch):
+    hashing = 0
+    most_at_once = 0
+    get_password_hash = main.get_password_hash
+
+    def counting_hash(password, registration_time):
+        nonlocal hashing, most_at_once
+        hashing += 1
+        most_at_once = max(most_at_once, hashing)
+        try:
+            time.sleep(0.01)
+            return get_password_hash(password, registration_time)
+        finally:
+            hashing -= 1
+
+    monkeypatch.setattr(main, 'get_password_hash', counting_hash)
+    token = await administrator_token()
+    res = await create_camp(token, {'title': 'Dinosaur Day', 'students': 10})
+    assert res.status_code == 200, res.text
+    assert most_at_once == main.CAMP_HASHING_THREADS
+
+    # the students' numbers only go in their usernames, not their names
+    async with main.db_pool.connection() as conn:
+        res = await conn.execute('select distinct given_name, family_name from Account where id = any(%s)',
+                                 ([student['student_id'] for student in res.json()['students']],))
+        assert await res.fetchall() == [('Student', '')]
+
+    # creating a camp is bcrypt bound, like logging in, but the camp's other routes aren't
+    admission = AdmissionMiddleware(main.app, main.ROUTE_LIMITS, main.DEFAULT_LIMIT, main.overload)
+    assert admission.limit_for('/camp').concurrency == 1
+    assert admission.limit_for('/camp/1/export') is main.DEFAULT_LIMIT
+
+
+@pytest.mark.anyio
+async def test_create_camp_is_all_or_nothing(test_db):
+    token = await administrator_token()
+    res = await create_camp(token, {'title': 'First', 'students': 2, 'username_prefix': 'dinos'})
+    assert res.status_code == 200, res.text
+
+    # dinos-1 and dinos-2 are taken, so none of the second camp's students are made
+    res = await create_camp(token, {'title': 'Second', 'students': 3, 'username_prefix': 'dinos'})
+    assert res.status_code == 400
+    res = await get('/usage', headers=auth(token))
+    assert len(res.json()['students']) == 2
+
+    res = await create_camp(token, {'title': 'Bad', 'students': 1, 'username_prefix': '../oops'})
+    assert res.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_only_administrators_create_camps(test_db):
+    token = await administrator_token()
+    res = await create_camp(token, {'title': 'Dinosaur Day', 'students': 1})
+    student = res.json()['students'][0]
+    res = await login({'username': student['username'], 'password': student['password']})
+    res = await create_camp(res.json()['access_token'], {'title': 'My Camp', 'students': 1})
+    assert res.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_export_camp(test_db):
+    token = await administrator_token()
+    camp_id, students, website_ids = await camp_with_websites(token)
+
+    res = await get(f'/camp/{camp_id}/export', headers=auth(token))
+    assert res.status_code == 200
+    assert res.headers['content-type'] == 'application/zip'
+    assert res.headers['content-disposition'] == 'attachment; filename="dinosaur-day.zip"'
+    with zipfile.ZipFile(io.BytesIO(res.content)) as z:
+        expected = [f"{student['username']}/{website_id}-{student['username']}-s-dinosaurs/index.html"
+                    for student, website_id in zip(students, website_ids)]
+        assert z.namelist() == expected
+        assert z.read(expected[0]) == f"<p>{students[0]['username']}</p>".encode()
+
+    # only the camp's administrator can export it
+    res = await get(f'/camp/{camp_id}/export', headers=auth(await other_administrator_token()))
+    assert res.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_archive_camp(test_db, monkeypatch):
+    monkeypatch.setattr(main, 'CAMP_BATCH_SIZE', 2)
+    token = await administrator_token()
+    camp_id, students, website_ids = await camp_with_websites(token)
+
+    res = await testhelpers.client.post(f'/camp/{camp_id}/archive', headers=auth(token))
+    assert res.status_code == 200, res.text
+    assert res.json() == {'camp_id': camp_id, 'students': 3}
+
+    # the students are locked out, but their websites stay up
+    for student in students:
+        res = await login({'username': student['username'], 'password': student['password']})
+        assert res.status_code == 400
+        res = await refresh_token(student['refresh_token'])
+        assert res.status_code == 401
+    res = await get_website(website_ids[0])
+    assert res.status_code == 200
+
+    # archiving again doesn't lock anyone else out
+    res = await testhelpers.client.post(f'/camp/{camp_id}/archive', headers=auth(token))
+    assert res.json() == {'camp_id': camp_id, 'students': 0}
+
+
+@pytest.mark.anyio
+async def test_purge_camp(test_db, monkeypatch):
+    monkeypatch.setattr(main, 'CAMP_BATCH_SIZE', 2)
+    token = await administrator_token()
+    camp_id, students, website_ids = await camp_with_websites(token)
+    other_camp_id, other_students, other_website_ids = await camp_with_websites(token, students=1, prefix='comets')
+
+    res = await testhelpers.client.delete(f'/camp/{camp_id}', headers=auth(token))
+    assert res.status_code == 200, res.text
+    assert res.json() == {'camp_id': camp_id, 'students': 3}
+
+    for student, website_id in zip(students, website_ids):
+        res = await login({'username': student['username'], 'password': student['password']})
+        assert res.status_code == 400
+        res = await get_website(website_id)
+        assert res.status_code == 404
+    res = await get(f'/camp/{camp_id}/export', headers=auth(token))
+    assert res.status_code == 404
+
+    # the other camp, and the administrator, are untouched
+    res = await login({'username': other_students[0]['username'], 'password': other_students[0]['password']})
+    assert res.status_code == 200
+    res = await get_website(other_website_ids[0])
+    assert res.status_code == 200
+    res = await get('/usage', headers=auth(token))
+    assert [student['username'] for student in res.json()['students']] == ['comets-1']
+
+
+@pytest.mark.anyio
+async def test_purge_camp_keeps_shared_websites(test_db):
+    token = await administrator_token()
+    camp_id, _, website_ids = await camp_with_websites(token, students=2)
+    # the administrator helps with the first student's website
+    async with main.db_pool.connection() as conn:
+        await conn.execute('insert into Administrator_Owns_Website (administrator_id, website_id) select id, %s from Account where username = %s',
+                           (website_ids[0], d.logging_in_administrator['username']))
+    res = await upload_webpage(token, website_ids[0], {'webpage': ('help.html', b'<p>help</p>')})
+    assert res.status_code == 200, res.text
+    usage = (await get('/usage', headers=auth(token))).json()['administrator']
+    assert usage['files'] == 1
+
+    res = await testhelpers.client.delete(f'/camp/{camp_id}', headers=auth(token))
+    assert res.status_code == 200, res.text
+
+    # it's still theirs, so what they've stored on it is still counted
+    res = await get_website(website_ids[0])
+    assert res.status_code == 200, res.text
+    res = await get_website(website_ids[1])
+    assert res.status_code == 404
+    res = await get('/usage', headers=auth(token))
+    assert res.json()['administrator'] == usage
+    assert res.json()['students'] == []
+
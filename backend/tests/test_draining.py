@@ -0,0 +1,198 @@
+import asyncio
+import httpx
+import pytest
+import signal
+import socket
+import uvicorn
+from asgi_lifespan import LifespanManager
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from backend import main
+from backend.analytics import SiteAnalytics
+from backend.audit import AuditLog
+from backend.draining import Drainer, DrainMiddleware
+from backend.monitoring import LoopLagMonitor
+from backend.profiler import BlockingWatchdog
+from backend.publishing import Publisher
+from .test_audit import viewed_website
+from . import testhelpers
+
+REQUESTS = 50
+
+
+class ToyApp:
+    '''
+    A stand in for the real app, shutting down the same way: requests are drained, then the log is
+    flushed, then the pool is closed. Each request takes a while, and needs the pool to finish.
+    '''
+
+    def __init__(self):
+        self.drainer = Drainer()
+        self.written = []
+        self.log = AuditLog(self.write, interval=60)
+        self.pool_closed = False
+
+        @asynccontextmanager
+        async def lifespan(app: FastAPI):
+            self.log.start()
+            yield
+            await self.drainer.drain(5)
+            await self.log.stop()
+            self.pool_closed = True
+
+        self.app = FastAPI(lifespan=lifespan)
+        self.app.add_middleware(DrainMiddleware, drainer=self.drainer)
+
+        @self.app.get('/website/{website_id}')
+        async def view(website_id: int):
+            await asyncio.sleep(0.3)
+            if self.pool_closed:
+                raise RuntimeError('the pool is closed')
+            self.log.record('view', website_id=website_id)
+            return {'website_id': website_id}
+
+    async def write(self, events):
+        if self.pool_closed:
+            raise RuntimeError('the pool is closed')
+        self.written.extend(events)
+
+    async def all_in_flight(self):
+        while self.drainer.in_flight < REQUESTS:
+            await asyncio.sleep(0.01)
+
+
+class Server(uvicorn.Server):
+    # the test runner's signal handlers are left alone. handle_exit is called directly instead
+    def install_signal_handlers(self):
+        pass
+
+
+@pytest.mark.anyio
+async def test_shutdown_waits_for_requests():
+    toy = ToyApp()
+    manager = LifespanManager(toy.app)
+    await manager.__aenter__()
+    async with httpx.AsyncClient(app=toy.app, base_url='http://test') as client:
+        requests = [asyncio.create_task(client.get(f'/website/{n}')) for n in range(REQUESTS)]
+        await toy.all_in_flight()
+        shutdown = asyncio.create_task(manager.__aexit__(None, None, None))
+        while not toy.drainer.draining:
+            await asyncio.sleep(0)
+
+        # requests that come in while draining are turned away, to be retried on another machine
+        res = await client.get('/website/999')
+        assert res.status_code == 503
+        assert res.headers['connection'] == 'close'
+        assert res.headers['retry-after'] == '1'
+
+        responses = await asyncio.gather(*requests)
+        await shutdown
+
+    assert [res.status_code for res in responses] == [200] * REQUESTS
+    # everything the requests logged was written before the pool closed
+    assert sorted(event.website_id for event in toy.written) == list(range(REQUESTS))
+
+
+@pytest.mark.anyio
+async def test_no_requests_are_dropped_on_sigterm():
+    toy = ToyApp()
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    server = Server(uvicorn.Config(toy.app, lifespan='on', ws='none', log_level='warning'))
+    serving = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{port}', limits=httpx.Limits(max_connections=REQUESTS)) as client:
+        requests = [asyncio.create_task(client.get(f'/website/{n}')) for n in range(REQUESTS)]
+        await toy.all_in_flight()
+        server.handle_exit(signal.SIGTERM, None)
+        responses = await asyncio.gather(*requests)
+        await serving
+
+        # the server isn't taking new connections any more
+        with pytest.raises(httpx.ConnectError):
+            await client.get('/website/999')
+
+    assert [res.status_code for res in responses] == [200] * REQUESTS
+    assert sorted(event.website_id for event in toy.written) == list(range(REQUESTS))
+    assert toy.pool_closed
+
+
+@pytest.mark.anyio
+async def test_the_app_drains_on_shutdown(test_db, monkeypatch):
+    _, website_id = await viewed_website()
+    await main.audit_log.flush()
+    await main.site_analytics.flush()
+    pool = main.db_pool
+
+    # the app's own lifespan is run a second time, with its own pool and background tasks. the session's
+    # are put back afterwards, and the drainer (which the middleware already holds) is let go of again
+    monkeypatch.setattr(main, 'db_pool', None)
+    monkeypatch.setattr(main, 'read_pool', None)
+    monkeypatch.setattr(main, 'publisher', Publisher(main.load_website_files, main.save_published_files, main.save_website_thumbnail))
+    monkeypatch.setattr(main, 'audit_log', AuditLog(main.write_audit_events, interval=60))
+    monkeypatch.setattr(main, 'site_analytics', SiteAnalytics(main.save_website_stats, interval=60))
+    monkeypatch.setattr(main, 'lag_monitor', LoopLagMonitor())
+    monkeypatch.setattr(main, 'blocking_watchdog', BlockingWatchdog(main.BLOCKING_THRESHOLD_MS / 1000))
+    monkeypatch.setattr(main.drainer, 'draining', False)
+    manager = LifespanManager(main.app, shutdown_timeout=main.SHUTDOWN_TIMEOUT_SECONDS + main.SHUTDOWN_FLUSH_SECONDS + 5)
+    await manager.__aenter__()
+
+    # the requests are held up by a lock on the webpages, until after shutdown has begun
+    locked = asyncio.Event()
+    unlock = asyncio.Event()
+
+    async def hold_lock():
+        async with pool.connection() as conn:
+            await conn.execute('lock table Webpage in access exclusive mode')
+            locked.set()
+            await unlock.wait()
+
+    holding = asyncio.create_task(hold_lock())
+    await locked.wait()
+    requests = [asyncio.create_task(testhelpers.get_webpage(website_id, 'index.html')) for _ in range(REQUESTS)]
+    while main.drainer.in_flight < REQUESTS:
+        await asyncio.sleep(0.01)
+    shutdown = asyncio.create_task(manager.__aexit__(None, None, None))
+    while not main.drainer.draining:
+        await asyncio.sleep(0)
+
+    res = await testhelpers.get_webpage(website_id, 'index.html')
+    assert res.status_code == 503
+    unlock.set()
+    await holding
+    responses = await asyncio.gather(*requests)
+    await shutdown
+    assert [res.status_code for res in responses] == [200] * REQUESTS
+
+    # their views and viewers were written before the app's pool was closed
+    async with pool.connection() as conn:
+        res = await conn.execute("select count(*) from Audit_Log where kind = 'view' and website_id = %s", (website_id,))
+        assert (await res.fetchone())[0] == REQUESTS + 2
+        res = await conn.execute('select sum(views) from Website_Views where website_id = %s', (website_id,))
+        assert (await res.fetchone())[0] == REQUESTS + 2
+    assert not main.site_analytics.pending
+
+
+@pytest.mark.anyio
+async def test_draining_has_a_deadline(tmp_path):
+    drainer = Drainer()
+    drainer.enter()
+    assert not await drainer.drain(0.05)
+    drainer.exit()
+    assert await drainer.drain(0.05)
+
+    async def load_files(website_id):
+        # a publish that never finishes
+        await asyncio.Event().wait()
+
+    async def save_manifest(website_id, manifest):
+        pass
+
+    publisher = Publisher(load_files, save_manifest)
+    publisher.start(str(tmp_path))
+    publisher.request(1)
+    assert not await publisher.stop(timeout=0.05)
+    assert not publisher.tasks and not publisher.running
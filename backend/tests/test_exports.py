@@ -0,0 +1,162 @@
+import io
+import pytest
+import zipfile
+import zlib
+from backend import main
+from backend.exports import ArchiveChanged, ZipEntry, ZipLayout, archive_path, parse_range
+from .testdata import TestData as d
+from .testhelpers import login, create_website, upload_webpage, get
+from .test_search import student_with_website, DINOSAUR_PAGE
+
+FILES = {
+    'site/index.html': b'<p>hello</p>',
+    'site/empty.txt': b'',
+    'site/styles.css': b'p { color: red; }' * 50,
+}
+
+
+def layout_of(files: dict[str, bytes]) -> ZipLayout:
+    return ZipLayout([ZipEntry(path, len(data), zlib.crc32(data)) for path, data in files.items()])
+
+
+async def read(layout: ZipLayout, start: int, end: int, files: dict[str, bytes]) -> bytes:
+    async def contents():
+        for index in layout.files_in(start, end):
+            yield files[layout.entries[index].path]
+    return b''.join([chunk async for chunk in layout.stream(start, end, contents())])
+
+
+@pytest.mark.anyio
+async def test_zip_layout():
+    layout = layout_of(FILES)
+    data = await read(layout, 0, layout.length, FILES)
+    assert len(data) == layout.length
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        assert z.testzip() is None
+        assert {name: z.read(name) for name in z.namelist()} == FILES
+
+    # any range of the archive is the same as that part of the whole archive
+    for start, end in ((0, 10), (5, 100), (40, 500), (100, layout.length), (layout.length - 1, layout.length)):
+        assert await read(layout, start, end, FILES) == data[start:end]
+    # files outside the range aren't read
+    assert layout.files_in(layout.length - 10, layout.length) == []
+
+    # the same files always make the same archive
+    assert layout_of(dict(FILES)).etag == layout.etag
+    assert layout_of(FILES | {'site/index.html': b'<p>bye</p>'}).etag != layout.etag
+
+    with pytest.raises(ArchiveChanged):
+        await read(layout, 0, layout.length, FILES | {'site/index.html': b'<p>HELLO</p>'})
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range('bytes=0-9', 100) == (0, 10)
+    assert parse_range('bytes=90-', 100) == (90, 100)
+    assert parse_range('bytes=90-200', 100) == (90, 100)
+    assert parse_range('bytes=-10', 100) == (90, 100)
+    assert parse_range('bytes=-200', 100) == (0, 100)
+    # ranges this doesn't understand mean the whole thing is sent
+    assert parse_range('bytes=0-9, 20-29', 100) is None
+    assert parse_range('bytes=9-0', 100) is None
+    assert parse_range('lines=0-9', 100) is None
+    with pytest.raises(ValueError):
+        parse_range('bytes=100-', 100)
+
+
+def test_archive_path():
+    # filenames can't escape their folder
+    assert archive_path('student', '1-site', '../../etc/passwd') == 'student/1-site/etc/passwd'
+
+
+@pytest.mark.anyio
+async def test_export_website(test_db, monkeypatch):
+    # small enough that the files are read in several chunks
+    monkeypatch.setattr(main, 'EXPORT_CHUNK_BYTES', 100)
+    _, student_token, website_id = await student_with_website()
+    await upload_webpage(student_token, website_id, {'webpage': ('styles.css', FILES['site/styles.css'])})
+
+    res = await get(f'/website/{website_id}/export')
+    assert res.status_code == 200
+    assert res.headers['content-disposition'] == f'attachment; filename="{website_id}-prehistoric-times.zip"'
+    assert res.headers['accept-ranges'] == 'bytes'
+    assert int(res.headers['content-length']) == len(res.content)
+    whole = res.content
+    with zipfile.ZipFile(io.BytesIO(whole)) as z:
+        folder = f'{website_id}-prehistoric-times'
+        assert z.namelist() == [f'{folder}/index.html', f'{folder}/styles.css']
+        assert z.read(f'{folder}/index.html') == DINOSAUR_PAGE
+
+    # a download can be resumed, as long as the zip hasn't changed
+    etag = res.headers['etag']
+    res = await get(f'/website/{website_id}/export', headers={'Range': 'bytes=100-', 'If-Range': etag})
+    assert res.status_code == 206
+    assert res.headers['content-range'] == f'bytes 100-{len(whole) - 1}/{len(whole)}'
+    assert res.content == whole[100:]
+
+    res = await get(f'/website/{website_id}/export', headers={'Range': f'bytes={len(whole)}-'})
+    assert res.status_code == 416
+    assert res.headers['content-range'] == f'bytes */{len(whole)}'
+
+    await upload_webpage(student_token, website_id, {'webpage': ('index.html', b'<p>new</p>')})
+    res = await get(f'/website/{website_id}/export', headers={'Range': 'bytes=100-', 'If-Range': etag})
+    assert res.status_code == 200
+    assert res.headers['etag'] != etag
+
+    res = await get('/website/999/export')
+    assert res.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_exports_give_connections_back(test_db, monkeypatch):
+    monkeypatch.setattr(main, 'EXPORT_CHUNK_BYTES', 1)
+    _, student_token, website_id = await student_with_website()
+    await upload_webpage(student_token, website_id, {'webpage': ('styles.css', FILES['site/styles.css'])})
+    await main.publisher.idle()
+    async with main.db_pool.connection() as conn:
+        res = await conn.execute('select id, octet_length(contents) from Webpage where website_id = %s order by filename', (website_id,))
+        webpage_ids, sizes = map(list, zip(*await res.fetchall()))
+
+    # a download that's stalled part way through isn't holding a connection
+    contents = main.webpages_contents(main.db_pool, webpage_ids, sizes)
+    assert await anext(contents) == DINOSAUR_PAGE
+    stats = main.db_pool.get_stats()
+    assert stats['pool_available'] == stats['pool_size']
+    assert await anext(contents) == FILES['site/styles.css']
+    assert await anext(contents, None) is None
+
+
+@pytest.mark.anyio
+async def test_export_student(test_db):
+    _, student_token, website_id = await student_with_website()
+    res = await create_website(student_token, {'title': 'Empty'})
+    empty_website_id = res.json()['website_id']
+    res = await create_website(student_token, {'title': 'Volcanoes!'})
+    other_website_id = res.json()['website_id']
+    await upload_webpage(student_token, other_website_id, {'webpage': ('index.html', b'<p>lava</p>')})
+
+    res = await login(d.logging_in_student)
+    student_id = res.json()['account_id']
+
+    res = await get(f'/student/{student_id}/export')
+    assert res.status_code == 200, res.text
+    assert res.headers['content-disposition'] == f'attachment; filename="{d.logging_in_student["username"]}.zip"'
+    with zipfile.ZipFile(io.BytesIO(res.content)) as z:
+        assert z.namelist() == [f'{website_id}-prehistoric-times/index.html', f'{other_website_id}-volcanoes/index.html']
+        assert z.read(f'{other_website_id}-volcanoes/index.html') == b'<p>lava</p>'
+
+    # a website without files is an empty zip
+    res = await get(f'/website/{empty_website_id}/export')
+    with zipfile.ZipFile(io.BytesIO(res.content)) as z:
+        assert z.namelist() == []
+
+    # a username that can't go in a header as it is becomes one that can
+    async with main.db_pool.connection() as conn:
+        await conn.execute('update Account set username = %s where id = %s', ('Nef "fie" tä', student_id))
+    res = await get(f'/student/{student_id}/export')
+    assert res.status_code == 200, res.text
+    assert res.headers['content-disposition'] == 'attachment; filename="nef-fie-t.zip"'
+
+    # administrators aren't students
+    res = await get(f'/student/{student_id - 1}/export')
+    assert res.status_code == 404
@@ -0,0 +1,78 @@
+import importlib.util
+import os
+import psycopg
+import pytest
+import zlib
+from .conftest import conninfo
+
+spec = importlib.util.spec_from_file_location(
+    'generate_dataset', os.path.join(os.path.dirname(__file__), '..', 'database', 'generate_dataset.py'))
+generate_dataset = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(generate_dataset)
+
+
+@pytest.fixture
+def conn(database):
+    with psycopg.connect(conninfo(database)) as conn:
+        generate_dataset.truncate(conn)
+        yield conn
+        generate_dataset.truncate(conn)
+
+
+def snapshot(conn: psycopg.Connection) -> dict[str, list[tuple]]:
+    with conn.cursor() as cur:
+        tables = {}
+        for table in generate_dataset.TABLES:
+            cur.execute(f'select * from {table}')
+            tables[table] = sorted(cur.fetchall())
+        return tables
+
+
+def test_generated_dataset_is_reproducible(conn):
+    generate_dataset.generate(conn, seed=1, accounts=200, camps=10, webpages=500)
+    first = snapshot(conn)
+    generate_dataset.truncate(conn)
+    generate_dataset.generate(conn, seed=1, accounts=200, camps=10, webpages=500)
+    assert snapshot(conn) == first
+
+    generate_dataset.truncate(conn)
+    generate_dataset.generate(conn, seed=2, accounts=200, camps=10, webpages=500)
+    assert snapshot(conn) != first
+
+
+def test_generated_dataset_sizes(conn):
+    generate_dataset.generate(conn, seed=0, accounts=200, camps=10, webpages=500)
+    tables = snapshot(conn)
+
+    assert len(tables['Account']) == 200
+    assert len(tables['Administrator']) == 10
+    assert len(tables['Webpage']) == 500
+    assert len(tables['Student']) + len(tables['Guardian']) + len(tables['Viewer']) == 190
+    assert len(tables['Teaches']) == len(tables['Student'])
+    assert len(tables['Camp']) == 10
+    # each student attends the camp run by the administrator who teaches them
+    camp_administrators = {camp_id: administrator_id for camp_id, administrator_id, *_ in tables['Camp']}
+    assert sorted((camp_administrators[camp_id], student_id) for student_id, camp_id in tables['Attends']) == tables['Teaches']
+    assert len(tables['Friendship']) > 0
+    assert len(tables['Can_View_Website']) > 0
+
+    # every account can log in with the same password
+    _, _, _, _, hashed_password, registration_time = tables['Account'][-1]
+    assert generate_dataset.pwd_context.verify(generate_dataset.PASSWORD + str(registration_time), hashed_password)
+
+    # pages' checksums match their contents, so they can be exported
+    assert all(row[5] == zlib.crc32(row[4].encode()) for row in tables['Webpage'])
+
+    # every website has an index page
+    with conn.cursor() as cur:
+        cur.execute("select count(*) from Website where not exists (select 1 from Webpage where website_id = Website.id and filename = 'index.html')")
+        assert cur.fetchone()[0] == 0
+
+        # storage usage adds up to what each account owns
+        cur.execute('select sum(bytes), sum(files), sum(websites) from Storage_Usage')
+        assert cur.fetchone() == (sum(len(row[4].encode()) for row in tables['Webpage']), 500, len(tables['Website']))
+
+        # the sequences continue after the generated ids
+        cur.execute("insert into Website (title) values ('New') returning id")
+        assert cur.fetchone()[0] == len(tables['Website']) + 1
+        conn.rollback()
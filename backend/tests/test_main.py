@@ -3,7 +3,7 @@ from httpx import AsyncClient
 from copy import deepcopy
 from backend import main
 from .testdata import TestData as d
-from .testhelpers import register_administrator, register_student, login, create_website, upload_webpage
+from .testhelpers import register_administrator, register_student, login, create_website, upload_webpage, get_website, get_webpage, refresh_token
 
 
 @pytest.mark.anyio
@@ -55,6 +55,24 @@ async def test_register_administrator_with_same_phone_number(test_db):
     assert res.json()['detail'] == 'Phone number taken.'
 
 
+@pytest.mark.anyio
+async def test_register_administrator_with_same_phone_number_does_not_create_account(test_db):
+    res = await register_administrator()
+    assert res.status_code == 200
+
+    administrator = deepcopy(d.registering_administrator_data)
+    administrator['username'] = 'different_username'
+    administrator['email'] = 'different_email@gmail.com'
+
+    res = await register_administrator(administrator)
+    assert res.status_code == 400, res.text
+
+    # the failed registration shouldn't have left the username taken
+    administrator['phone_number'] = '098-765-4321'
+    res = await register_administrator(administrator)
+    assert res.status_code == 200, res.text
+
+
 @pytest.mark.anyio
 async def test_register_student(test_db):
     res = await register_administrator()
@@ -376,6 +394,132 @@ async def test_login_administrator_with_incorrect_structure(test_db):
     assert res.status_code == 422, res.text
 
 
+@pytest.mark.anyio
+async def test_login_expiry_is_jittered(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    assert res.status_code == 200, res.text
+
+    expires_in = res.json()['expires_in']
+    assert main.ACCESS_TOKEN_EXPIRE_MINUTES * 60 * (1 - main.ACCESS_TOKEN_EXPIRE_JITTER) - 1 <= expires_in
+    assert expires_in <= main.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+
+@pytest.mark.anyio
+async def test_refresh_token(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    old_refresh_token = res.json()['refresh_token']
+
+    res = await refresh_token(old_refresh_token)
+    assert res.status_code == 200, res.text
+    assert res.json()['refresh_token'] != old_refresh_token
+
+    # the new access token works like the one from logging in
+    res = await create_website(res.json()['access_token'], d.proposed_website)
+    assert res.status_code == 200, res.text
+
+
+@pytest.mark.anyio
+async def test_refresh_token_chain(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+
+    for _ in range(3):
+        res = await refresh_token(res.json()['refresh_token'])
+        assert res.status_code == 200, res.text
+
+
+@pytest.mark.anyio
+async def test_reused_refresh_token_revokes_family(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    old_refresh_token = res.json()['refresh_token']
+
+    res = await refresh_token(old_refresh_token)
+    new_refresh_token = res.json()['refresh_token']
+
+    res = await refresh_token(old_refresh_token)
+    assert res.status_code == 401, res.text
+
+    # the legitimate holder's token was revoked along with the rest of its family
+    res = await refresh_token(new_refresh_token)
+    assert res.status_code == 401, res.text
+
+
+@pytest.mark.anyio
+async def test_reused_refresh_token_does_not_revoke_other_logins(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    first_refresh_token = res.json()['refresh_token']
+    res = await login(d.logging_in_administrator)
+    second_refresh_token = res.json()['refresh_token']
+
+    await refresh_token(first_refresh_token)
+    res = await refresh_token(first_refresh_token)
+    assert res.status_code == 401, res.text
+
+    res = await refresh_token(second_refresh_token)
+    assert res.status_code == 200, res.text
+
+
+async def refresh_token_count() -> int:
+    async with main.db_pool.connection() as conn:
+        res = await conn.execute('select count(*) from Refresh_Token')
+        return (await res.fetchone())[0]
+
+
+@pytest.mark.anyio
+async def test_expired_refresh_tokens_are_deleted(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    for _ in range(2):
+        res = await refresh_token(res.json()['refresh_token'])
+    await login(d.logging_in_administrator)
+    assert await refresh_token_count() == 4
+
+    # rotating deletes its family's expired tokens
+    async with main.db_pool.connection() as conn:
+        await conn.execute("update Refresh_Token set expiry_time = current_timestamp - interval '1 hour' where used")
+    res = await refresh_token(res.json()['refresh_token'])
+    assert res.status_code == 200, res.text
+    assert await refresh_token_count() == 3
+
+    # logging in deletes the rest of the account's
+    async with main.db_pool.connection() as conn:
+        await conn.execute("update Refresh_Token set expiry_time = current_timestamp - interval '1 hour'")
+    await login(d.logging_in_administrator)
+    assert await refresh_token_count() == 1
+
+
+@pytest.mark.anyio
+async def test_refreshing_keeps_the_login_expiry(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    async with main.db_pool.connection() as conn:
+        rows = await conn.execute('select expiry_time from Refresh_Token')
+        (expiry_time,), = await rows.fetchall()
+
+    for _ in range(2):
+        res = await refresh_token(res.json()['refresh_token'])
+        assert res.status_code == 200, res.text
+    async with main.db_pool.connection() as conn:
+        rows = await conn.execute('select distinct expiry_time from Refresh_Token')
+        assert await rows.fetchall() == [(expiry_time,)]
+
+    # once the login's lifetime is up, refreshing can't extend it
+    async with main.db_pool.connection() as conn:
+        await conn.execute("update Refresh_Token set expiry_time = current_timestamp - interval '1 second'")
+    res = await refresh_token(res.json()['refresh_token'])
+    assert res.status_code == 401, res.text
+
+
+@pytest.mark.anyio
+async def test_invalid_refresh_token(test_db):
+    res = await refresh_token('not a refresh token')
+    assert res.status_code == 401, res.text
+
+
 @pytest.mark.anyio
 async def test_create_website_as_student(test_db):
     administrator = await register_administrator()
@@ -411,6 +555,27 @@ async def test_create_website_as_administrator(test_db):
     assert 'website_id' in res.json()
 
 
+@pytest.mark.anyio
+async def test_get_website(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    res = await get_website(website_id)
+    assert res.status_code == 200, res.text
+    assert res.json()['title'] == d.proposed_website['title']
+
+
+@pytest.mark.anyio
+async def test_get_nonexistent_website(test_db):
+    # website ids start at 1
+    res = await get_website(0)
+    assert res.status_code == 404, res.text
+
+
 @pytest.mark.anyio
 async def test_create_website_without_token(test_db):
     res = await create_website('invalid token', d.proposed_website)
@@ -474,3 +639,87 @@ async def test_upload_webpage(test_db):
         files = {'webpage': file_data}
         res = await upload_webpage(token, website_id, files)
         assert res.status_code == 200, res.text
+
+
+@pytest.mark.anyio
+async def test_get_uploaded_webpage(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    with open('./tests/assets/sample.html', 'rb') as file_data:
+        res = await upload_webpage(token, website_id, {'webpage': file_data})
+        assert res.status_code == 200, res.text
+
+    res = await get_webpage(website_id, 'sample.html')
+    assert res.status_code == 200, res.text
+    assert res.headers['content-type'].startswith('text/html')
+    assert '<h1>Hello</h1>' in res.text
+
+
+@pytest.mark.anyio
+async def test_upload_webpage_replaces_existing_webpage(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    res = await upload_webpage(token, website_id, {'webpage': ('index.html', b'<p>first</p>')})
+    first_webpage_id = res.json()['webpage_id']
+    res = await upload_webpage(token, website_id, {'webpage': ('index.html', b'<p>second</p>')})
+    assert res.status_code == 200, res.text
+    assert res.json()['webpage_id'] == first_webpage_id
+
+    res = await get_webpage(website_id, 'index.html')
+    assert res.text == '<p>second</p>'
+
+
+@pytest.mark.anyio
+async def test_upload_webpage_to_another_users_website(test_db):
+    administrator = await register_administrator()
+    res = await login(d.logging_in_administrator)
+    administrator_token = res.json()['access_token']
+
+    res = await create_website(administrator_token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    student_data = deepcopy(d.registering_student)
+    student_data['administrator_id'] = administrator.json()['account_id']
+    await register_student(student_data)
+    res = await login(d.logging_in_student)
+    student_token = res.json()['access_token']
+
+    with open('./tests/assets/sample.css', 'rb') as file_data:
+        res = await upload_webpage(student_token, website_id, {'webpage': file_data})
+        assert res.status_code == 403, res.text
+
+
+@pytest.mark.anyio
+async def test_upload_binary_webpage(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    res = await upload_webpage(token, website_id, {'webpage': ('image.png', b'\x89PNG\r\n\x1a\n\xff\xfe')})
+    assert res.status_code == 400, res.text
+
+
+@pytest.mark.anyio
+async def test_get_nonexistent_webpage(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    res = await get_webpage(website_id, 'missing.html')
+    assert res.status_code == 404, res.text
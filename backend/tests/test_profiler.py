@@ -0,0 +1,112 @@
+import asyncio
+import sys
+import threading
+import time
+import pytest
+from backend import main
+from backend.profiler import BlockingWatchdog, collapse_stack, format_collapsed, sample_stacks
+from .testhelpers import get
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_collapse_stack():
+    stack = collapse_stack(sys._getframe())
+    assert stack.endswith(';test_profiler.py:test_collapse_stack')
+    assert ' ' not in stack.split(';')[-1]
+
+
+def test_sample_stacks():
+    done = threading.Event()
+
+    def busy():
+        while not done.is_set():
+            block_the_loop(0.001)
+
+    thread = threading.Thread(target=busy)
+    thread.start()
+    try:
+        samples = sample_stacks(thread.ident, seconds=0.1, interval=0.001)
+    finally:
+        done.set()
+        thread.join()
+
+    assert sum(samples.values()) > 10
+    assert any('test_profiler.py:block_the_loop' in stack for stack in samples)
+
+    collapsed = format_collapsed(samples)
+    for line in collapsed.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+
+
+@pytest.mark.anyio
+async def test_watchdog_reports_blocked_loop():
+    watchdog = BlockingWatchdog(threshold=0.05)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.05)
+        block_the_loop(0.3)
+        await asyncio.sleep(0.1)
+    finally:
+        await watchdog.stop()
+
+    assert len(watchdog.stalls) == 1
+    stall = watchdog.stalls[0]
+    assert stall['duration_ms'] >= 200
+    assert 'block_the_loop' in stall['stack']
+
+
+@pytest.mark.anyio
+async def test_watchdog_ignores_short_blocks():
+    watchdog = BlockingWatchdog(threshold=0.2)
+    watchdog.start()
+    try:
+        await asyncio.sleep(0.05)
+        block_the_loop(0.01)
+        await asyncio.sleep(0.1)
+    finally:
+        await watchdog.stop()
+
+    assert not watchdog.stalls
+
+
+@pytest.mark.anyio
+async def test_profiler_endpoints_are_disabled_without_token(client, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILER_TOKEN', None)
+    res = await get('/debug/profile?seconds=0.1')
+    assert res.status_code == 404, res.text
+
+
+@pytest.mark.anyio
+async def test_profiler_endpoints_require_token(client, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILER_TOKEN', 'secret')
+    res = await get('/debug/profile?seconds=0.1')
+    assert res.status_code == 403, res.text
+    res = await get('/debug/loop', headers={'X-Profiler-Token': 'wrong'})
+    assert res.status_code == 403, res.text
+
+
+@pytest.mark.anyio
+async def test_profile(client, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILER_TOKEN', 'secret')
+    res = await get('/debug/profile?seconds=0.2&interval_ms=1', headers={'X-Profiler-Token': 'secret'})
+    assert res.status_code == 200, res.text
+    assert res.text
+    for line in res.text.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+
+    res = await get('/debug/profile?seconds=600', headers={'X-Profiler-Token': 'secret'})
+    assert res.status_code == 400, res.text
+
+
+@pytest.mark.anyio
+async def test_loop_stats(client, monkeypatch):
+    monkeypatch.setattr(main, 'PROFILER_TOKEN', 'secret')
+    res = await get('/debug/loop', headers={'X-Profiler-Token': 'secret'})
+    assert res.status_code == 200, res.text
+    assert 'lag_ms' in res.json()
+    assert 'stalls' in res.json()
@@ -0,0 +1,123 @@
+import pytest
+from copy import deepcopy
+from backend import main
+from backend.models import StorageLimits
+from .testdata import TestData as d
+from .testhelpers import register_administrator, register_student, login, create_website, upload_webpage, get
+from . import testhelpers
+
+
+@pytest.fixture
+def small_limits(monkeypatch):
+    monkeypatch.setitem(main.STORAGE_LIMITS, 'student', StorageLimits(bytes=1000, files=3, websites=2))
+    monkeypatch.setattr(main, 'MAX_WEBPAGE_BYTES', 600)
+
+
+async def student_tokens():
+    administrator = await register_administrator()
+    res = await login(d.logging_in_administrator)
+    administrator_token = res.json()['access_token']
+
+    student_data = deepcopy(d.registering_student)
+    student_data['administrator_id'] = administrator.json()['account_id']
+    await register_student(student_data)
+    res = await login(d.logging_in_student)
+    return administrator_token, res.json()['access_token']
+
+
+async def usage(administrator_token: str) -> dict:
+    res = await get('/usage', headers={'Authorization': 'Bearer ' + administrator_token})
+    assert res.status_code == 200, res.text
+    return res.json()
+
+
+@pytest.mark.anyio
+async def test_byte_quota(test_db, small_limits):
+    administrator_token, student_token = await student_tokens()
+    res = await create_website(student_token, {'title': 'Quota'})
+    website_id = res.json()['website_id']
+
+    res = await upload_webpage(student_token, website_id, {'webpage': ('index.html', b'a' * 500)})
+    assert res.status_code == 200, res.text
+    res = await upload_webpage(student_token, website_id, {'webpage': ('about.html', b'b' * 400)})
+    assert res.status_code == 200, res.text
+
+    # 500 + 400 + 200 is over the 1000 byte quota
+    res = await upload_webpage(student_token, website_id, {'webpage': ('contact.html', b'c' * 200)})
+    assert res.status_code == 413
+    # a file over the per-file limit is turned away however much space is left
+    res = await upload_webpage(student_token, website_id, {'webpage': ('big.html', b'd' * 700)})
+    assert res.status_code == 413
+
+    # replacing a file only counts the difference in size
+    res = await upload_webpage(student_token, website_id, {'webpage': ('index.html', b'a' * 550)})
+    assert res.status_code == 200, res.text
+    res = await upload_webpage(student_token, website_id, {'webpage': ('index.html', b'a' * 100)})
+    assert res.status_code == 200, res.text
+    res = await upload_webpage(student_token, website_id, {'webpage': ('contact.html', b'c' * 200)})
+    assert res.status_code == 200, res.text
+
+    report = await usage(administrator_token)
+    assert report['students'][0]['bytes'] == 700
+    assert report['students'][0]['files'] == 3
+
+
+@pytest.mark.anyio
+async def test_uploads_rejected_by_content_length(test_db, small_limits):
+    _, student_token = await student_tokens()
+    res = await create_website(student_token, {'title': 'Quota'})
+    website_id = res.json()['website_id']
+
+    res = await testhelpers.client.post('/website/' + str(website_id), content=b'x' * 5000, headers={
+        'Authorization': 'Bearer ' + student_token,
+        'Content-Type': 'multipart/form-data; boundary=boundary'
+    })
+    assert res.status_code == 413
+
+    res = await upload_webpage(student_token, website_id, {'other': ('index.html', b'<p>hi</p>')})
+    assert res.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_file_and_website_limits(test_db, small_limits):
+    administrator_token, student_token = await student_tokens()
+    res = await create_website(student_token, {'title': 'First'})
+    website_id = res.json()['website_id']
+    res = await create_website(student_token, {'title': 'Second'})
+    assert res.status_code == 200, res.text
+    res = await create_website(student_token, {'title': 'Third'})
+    assert res.status_code == 403
+
+    for filename in ('a.html', 'b.html', 'c.html'):
+        res = await upload_webpage(student_token, website_id, {'webpage': (filename, b'<p>hi</p>')})
+        assert res.status_code == 200, res.text
+    res = await upload_webpage(student_token, website_id, {'webpage': ('d.html', b'<p>hi</p>')})
+    assert res.status_code == 403
+    # replacing a file doesn't add to the count
+    res = await upload_webpage(student_token, website_id, {'webpage': ('a.html', b'<p>hello</p>')})
+    assert res.status_code == 200, res.text
+
+    report = await usage(administrator_token)
+    assert report['students'][0]['websites'] == 2
+    assert report['students'][0]['files'] == 3
+    assert report['students'][0]['limits'] == {'bytes': 1000, 'files': 3, 'websites': 2}
+
+
+@pytest.mark.anyio
+async def test_usage_report(test_db):
+    administrator_token, student_token = await student_tokens()
+    res = await create_website(administrator_token, {'title': 'Teacher'})
+    website_id = res.json()['website_id']
+    await upload_webpage(administrator_token, website_id, {'webpage': ('index.html', '<p>héllo</p>'.encode())})
+
+    report = await usage(administrator_token)
+    assert report['administrator']['username'] == d.logging_in_administrator['username']
+    # sizes are counted in bytes, not characters
+    assert report['administrator']['bytes'] == len('<p>héllo</p>'.encode())
+    assert report['administrator']['websites'] == 1
+    assert report['administrator']['limits'] == main.STORAGE_LIMITS['administrator'].model_dump()
+    assert [student['username'] for student in report['students']] == [d.logging_in_student['username']]
+    assert report['students'][0]['bytes'] == 0
+
+    res = await get('/usage', headers={'Authorization': 'Bearer ' + student_token})
+    assert res.status_code == 403
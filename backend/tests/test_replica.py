@@ -0,0 +1,101 @@
+import asyncio
+import os
+import pytest
+import time
+from contextlib import asynccontextmanager
+from psycopg_pool import AsyncConnectionPool
+from backend import main
+from .testdata import TestData as d
+from .testhelpers import register_administrator, login, create_website, get_website
+
+
+class RecordingPool:
+    def __init__(self, name):
+        self.name = name
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self.name
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    monkeypatch.setattr(main, 'db_pool', RecordingPool('primary'))
+    monkeypatch.setattr(main, 'read_pool', RecordingPool('replica'))
+    monkeypatch.setattr(main, 'recent_writes', {})
+
+
+async def read_connection(token=None):
+    return await main.get_read_connection(token).__anext__()
+
+
+@pytest.mark.anyio
+async def test_reads_go_to_replica(pools):
+    assert await read_connection() == 'replica'
+
+    token = main.create_access_token({'sub': 'neffieta'})
+    assert await read_connection(token) == 'replica'
+
+
+@pytest.mark.anyio
+async def test_reads_after_write_go_to_primary(pools):
+    token = main.create_access_token({'sub': 'neffieta'})
+    main.record_write('neffieta')
+
+    assert await read_connection(token) == 'primary'
+    # other readers aren't affected by someone else's write
+    assert await read_connection() == 'replica'
+    assert await read_connection(main.create_access_token({'sub': 'lachlantula'})) == 'replica'
+
+
+@pytest.mark.anyio
+async def test_reads_return_to_replica_after_sticky_window(pools, monkeypatch):
+    monkeypatch.setattr(main, 'REPLICA_STICKY_SECONDS', 0)
+    token = main.create_access_token({'sub': 'neffieta'})
+    main.record_write('neffieta')
+
+    assert await read_connection(token) == 'replica'
+
+
+@pytest.mark.anyio
+async def test_reads_without_replica_go_to_primary(pools, monkeypatch):
+    monkeypatch.setattr(main, 'read_pool', None)
+    assert await read_connection() == 'primary'
+
+
+@pytest.fixture
+async def replica_pool(monkeypatch):
+    # point DB_REPLICA_HOST (and DB_REPLICA_PORT) at a streaming replica to test against one,
+    # otherwise the primary stands in for it. the app is already running, so the pool is swapped in
+    replica_conninfo = f'host={os.getenv("DB_REPLICA_HOST", os.getenv("DB_HOST"))} port={os.getenv("DB_REPLICA_PORT", os.getenv("DB_PORT"))} dbname={os.getenv("DB_NAME")} user={os.getenv("DB_USER")} password={os.getenv("DB_PASSWORD")}'
+    async with AsyncConnectionPool(replica_conninfo, min_size=1, max_size=2) as pool:
+        monkeypatch.setattr(main, 'read_pool', pool)
+        yield pool
+
+
+async def wait_for_replica(pool: AsyncConnectionPool, website_id: int, timeout: float = 10):
+    # a streaming replica is a little behind the primary, so reads that skip the primary wait for it to catch up
+    deadline = time.monotonic() + timeout
+    while True:
+        async with pool.connection() as conn:
+            res = await conn.execute('select 1 from Website where id = %s', (website_id,))
+            if await res.fetchone():
+                return
+        assert time.monotonic() < deadline, 'The replica did not catch up.'
+        await asyncio.sleep(0.05)
+
+
+@pytest.mark.anyio
+async def test_get_website_from_replica(test_db, replica_pool):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+
+    res = await create_website(token, d.proposed_website)
+    assert res.status_code == 200, res.text
+    website_id = res.json()['website_id']
+
+    await wait_for_replica(replica_pool, website_id)
+    res = await get_website(website_id)
+    assert res.status_code == 200, res.text
+    assert res.json()['title'] == d.proposed_website['title']
@@ -0,0 +1,158 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from httpx import AsyncClient
+from backend.responses import CompressedBodyCache, CompressionMiddleware, choose_encoding, etag_matches, weak_etag
+from .testdata import TestData as d
+from .testhelpers import register_administrator, login, create_website, upload_webpage, get
+
+
+def test_choose_encoding():
+    assert choose_encoding('gzip, deflate, br') == 'br'
+    assert choose_encoding('gzip, deflate') == 'gzip'
+    assert choose_encoding('br;q=0, gzip') == 'gzip'
+    assert choose_encoding('*') == 'br'
+    assert choose_encoding('identity') is None
+    assert choose_encoding('') is None
+
+
+def test_etag_matches():
+    etag = weak_etag('webpage', 1, 1234)
+    assert etag == 'W/"webpage-1-1234"'
+    assert etag_matches(etag, etag)
+    assert etag_matches(etag, '"webpage-1-1234"')
+    assert etag_matches(etag, 'W/"webpage-2-1", W/"webpage-1-1234"')
+    assert etag_matches(etag, '*')
+    assert not etag_matches(etag, 'W/"webpage-1-1235"')
+    assert not etag_matches(etag, None)
+
+
+def test_compressed_body_cache_evicts_least_recently_used():
+    cache = CompressedBodyCache(max_bytes=10)
+    cache.put(('a', 'gzip'), b'1234')
+    cache.put(('b', 'gzip'), b'1234')
+    cache.get(('a', 'gzip'))
+    cache.put(('c', 'gzip'), b'1234')
+
+    assert cache.get(('a', 'gzip')) == b'1234'
+    assert cache.get(('b', 'gzip')) is None
+    assert cache.get(('c', 'gzip')) == b'1234'
+    assert cache.size == 8
+
+
+compression_app = FastAPI()
+compression_app.add_middleware(CompressionMiddleware, minimum_size=500)
+large_text = 'webdevcamp ' * 200
+
+
+@compression_app.get('/large')
+def large():
+    return PlainTextResponse(large_text)
+
+
+@compression_app.get('/small')
+def small():
+    return PlainTextResponse('hello')
+
+
+@compression_app.get('/stream')
+def stream():
+    return StreamingResponse(iter([large_text.encode()] * 3), media_type='text/plain')
+
+
+@pytest.mark.anyio
+async def test_large_responses_are_compressed():
+    async with AsyncClient(app=compression_app, base_url='http://test') as ac:
+        res = await ac.get('/large', headers={'Accept-Encoding': 'gzip'})
+        assert res.headers['content-encoding'] == 'gzip'
+        assert int(res.headers['content-length']) < len(large_text)
+        assert 'Accept-Encoding' in res.headers['vary']
+        assert res.text == large_text
+
+        res = await ac.get('/large', headers={'Accept-Encoding': 'br'})
+        assert res.headers['content-encoding'] == 'br'
+        assert res.text == large_text
+
+
+@pytest.mark.anyio
+async def test_small_and_unaccepted_responses_are_not_compressed():
+    async with AsyncClient(app=compression_app, base_url='http://test') as ac:
+        res = await ac.get('/small', headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in res.headers
+
+        res = await ac.get('/large', headers={'Accept-Encoding': 'identity'})
+        assert 'content-encoding' not in res.headers
+        assert res.text == large_text
+
+        # whether or not they were compressed, they depend on what the client accepts
+        for path, accept_encoding in (('/small', 'gzip'), ('/large', 'identity'), ('/large', '')):
+            res = await ac.get(path, headers={'Accept-Encoding': accept_encoding})
+            assert res.headers['vary'] == 'Accept-Encoding', (path, accept_encoding)
+
+
+@pytest.mark.anyio
+async def test_streamed_responses_are_not_compressed():
+    async with AsyncClient(app=compression_app, base_url='http://test') as ac:
+        res = await ac.get('/stream', headers={'Accept-Encoding': 'gzip'})
+        assert 'content-encoding' not in res.headers
+        assert res.text == large_text * 3
+
+
+versioned_app = FastAPI()
+
+
+@versioned_app.get('/versioned')
+def versioned():
+    return JSONResponse({'contents': large_text}, headers={'ETag': weak_etag('test', 1)})
+
+
+@pytest.mark.anyio
+async def test_responses_with_etags_are_cached():
+    middleware = CompressionMiddleware(versioned_app)
+    async with AsyncClient(app=middleware, base_url='http://test') as ac:
+        first = await ac.get('/versioned', headers={'Accept-Encoding': 'gzip'})
+        assert (weak_etag('test', 1), 'gzip') in middleware.cache.bodies
+        second = await ac.get('/versioned', headers={'Accept-Encoding': 'gzip'})
+        assert first.content == second.content
+
+
+@pytest.mark.anyio
+async def test_webpage_conditional_get(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+    res = await upload_webpage(token, website_id, {'webpage': ('index.html', large_text.encode())})
+    assert res.status_code == 200, res.text
+
+    res = await get(f'/website/{website_id}/index.html', headers={'Accept-Encoding': 'gzip'})
+    assert res.status_code == 200, res.text
+    assert res.headers['content-encoding'] == 'gzip'
+    etag = res.headers['etag']
+    assert etag.startswith('W/')
+
+    res = await get(f'/website/{website_id}/index.html', headers={'If-None-Match': etag})
+    assert res.status_code == 304, res.text
+    assert res.content == b''
+
+    # uploading a new version changes the ETag
+    res = await upload_webpage(token, website_id, {'webpage': ('index.html', b'<p>new</p>')})
+    res = await get(f'/website/{website_id}/index.html', headers={'If-None-Match': etag})
+    assert res.status_code == 200, res.text
+    assert res.text == '<p>new</p>'
+
+
+@pytest.mark.anyio
+async def test_website_conditional_get(test_db):
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+
+    res = await get(f'/website/{website_id}')
+    etag = res.headers['etag']
+
+    res = await get(f'/website/{website_id}', headers={'If-None-Match': etag})
+    assert res.status_code == 304, res.text
@@ -0,0 +1,143 @@
+import pytest
+from copy import deepcopy
+from backend import main
+from backend.search import searchable_text
+from .testdata import TestData as d
+from .testhelpers import register_administrator, register_student, login, create_website, upload_webpage, search
+
+DINOSAUR_PAGE = b'''<!DOCTYPE html>
+<html>
+  <head><title>Ignored</title><style>.dinosaurs { color: green; }</style></head>
+  <body>
+    <h1>Dino&nbsp;World</h1>
+    <p>My favourite <b>dinosaurs</b> are the really big ones.</p>
+    <img src="rex.png" alt="a tyrannosaurus" />
+    <script>alert('volcano')</script>
+  </body>
+</html>'''
+
+
+def test_searchable_text():
+    text = searchable_text('index.html', DINOSAUR_PAGE.decode())
+    assert text == 'Dino World My favourite dinosaurs are the really big ones. a tyrannosaurus'
+    assert 'volcano' not in text
+    assert 'color' not in text
+
+    assert searchable_text('notes.txt', 'just some text') == 'just some text'
+    assert searchable_text('styles.css', 'h1 { color: red; }') == ''
+    assert searchable_text('script.js', "alert('hello')") == ''
+
+
+async def student_with_website():
+    '''
+    Registers an administrator and their student, who makes a website about dinosaurs.
+    Returns the administrator's token, the student's token and the website's ID.
+    '''
+
+    administrator = await register_administrator()
+    res = await login(d.logging_in_administrator)
+    administrator_token = res.json()['access_token']
+
+    student_data = deepcopy(d.registering_student)
+    student_data['administrator_id'] = administrator.json()['account_id']
+    await register_student(student_data)
+    res = await login(d.logging_in_student)
+    student_token = res.json()['access_token']
+
+    res = await create_website(student_token, {'title': 'Prehistoric Times'})
+    website_id = res.json()['website_id']
+    res = await upload_webpage(student_token, website_id, {'webpage': ('index.html', DINOSAUR_PAGE)})
+    assert res.status_code == 200, res.text
+    return administrator_token, student_token, website_id
+
+
+async def other_administrator_token():
+    administrator_data = deepcopy(d.registering_administrator_data)
+    administrator_data.update(username='otheradmin', email='other@example.com', phone_number='987-654-3210')
+    await register_administrator(administrator_data)
+    res = await login({'username': 'otheradmin', 'password': administrator_data['hashed_password']})
+    return res.json()['access_token']
+
+
+@pytest.mark.anyio
+async def test_search_webpage_text(test_db):
+    administrator_token, student_token, website_id = await student_with_website()
+
+    # words are stemmed, so 'dinosaur' finds 'dinosaurs'
+    for token in (student_token, administrator_token):
+        res = await search(token, 'dinosaur')
+        assert res.status_code == 200, res.text
+        results = res.json()
+        assert len(results) == 1
+        assert results[0]['website_id'] == website_id
+        assert results[0]['filename'] == 'index.html'
+        assert results[0]['title'] == 'Prehistoric Times'
+        assert results[0]['owner_username'] == d.logging_in_student['username']
+
+    # text in scripts, styles and tags isn't searched
+    for query in ('volcano', 'color', 'Ignored', 'rex.png'):
+        res = await search(student_token, query)
+        assert res.json() == [], query
+
+    res = await search(student_token, 'tyrannosaurus')
+    assert len(res.json()) == 1
+
+
+@pytest.mark.anyio
+async def test_search_website_title_and_username(test_db):
+    administrator_token, _, website_id = await student_with_website()
+
+    res = await search(administrator_token, 'prehistoric')
+    assert [(result['website_id'], result['filename']) for result in res.json()] == [(website_id, None)]
+
+    res = await search(administrator_token, d.logging_in_student['username'])
+    assert [(result['website_id'], result['filename']) for result in res.json()] == [(website_id, None)]
+
+
+@pytest.mark.anyio
+async def test_shared_websites_are_found_once(test_db):
+    administrator_token, _, website_id = await student_with_website()
+    async with main.db_pool.connection() as conn:
+        await conn.execute('insert into Administrator_Owns_Website (administrator_id, website_id) select id, %s from Account where username = %s',
+                           (website_id, d.logging_in_administrator['username']))
+
+    # and are shown as the student's
+    res = await search(administrator_token, 'dinosaur')
+    assert [(result['website_id'], result['owner_username']) for result in res.json()] == [(website_id, d.logging_in_student['username'])]
+
+
+@pytest.mark.anyio
+async def test_search_only_finds_visible_websites(test_db):
+    await student_with_website()
+    token = await other_administrator_token()
+
+    for query in ('dinosaur', 'prehistoric', d.logging_in_student['username']):
+        res = await search(token, query)
+        assert res.status_code == 200, res.text
+        assert res.json() == [], query
+
+
+@pytest.mark.anyio
+async def test_replaced_webpage_is_reindexed(test_db):
+    _, student_token, website_id = await student_with_website()
+
+    res = await upload_webpage(student_token, website_id, {'webpage': ('index.html', b'<p>I like volcanoes now.</p>')})
+    assert res.status_code == 200, res.text
+
+    res = await search(student_token, 'dinosaur')
+    assert res.json() == []
+    res = await search(student_token, 'volcano')
+    assert [(result['website_id'], result['filename']) for result in res.json()] == [(website_id, 'index.html')]
+
+
+@pytest.mark.anyio
+async def test_search_requires_query_and_login(test_db):
+    _, student_token, _ = await student_with_website()
+
+    res = await search(student_token, '   ')
+    assert res.status_code == 400, res.text
+    res = await search(student_token, 'dinosaur', limit=1000)
+    assert res.status_code == 400, res.text
+
+    res = await search('not a token', 'dinosaur')
+    assert res.status_code == 401, res.text
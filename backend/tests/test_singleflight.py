@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from backend import main
+from backend.singleflight import SingleFlight
+from .testdata import TestData as d
+from .testhelpers import register_administrator, login, create_website, upload_webpage
+
+
+@pytest.mark.anyio
+async def test_concurrent_calls_are_coalesced():
+    flight = SingleFlight()
+    runs = 0
+
+    async def fetch():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return runs
+
+    results = await asyncio.gather(*(flight.do('key', fetch) for _ in range(10)))
+
+    assert results == [1] * 10
+    assert flight.calls == 1
+    assert flight.coalesced == 9
+    assert not flight.in_flight
+
+
+@pytest.mark.anyio
+async def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+
+    async def fetch(key):
+        await asyncio.sleep(0.01)
+        return key
+
+    results = await asyncio.gather(*(flight.do(key, lambda key=key: fetch(key)) for key in range(3)))
+
+    assert results == [0, 1, 2]
+    assert flight.calls == 3
+    assert flight.coalesced == 0
+
+
+@pytest.mark.anyio
+async def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+
+    async def fetch():
+        return 'result'
+
+    await flight.do('key', fetch)
+    await flight.do('key', fetch)
+
+    assert flight.calls == 2
+    assert flight.coalesced == 0
+
+
+@pytest.mark.anyio
+async def test_exceptions_are_shared():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    results = await asyncio.gather(*(flight.do('key', fetch) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flight.calls == 1
+    assert not flight.in_flight
+
+
+@pytest.mark.anyio
+async def test_cancelled_caller_does_not_cancel_others():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    first = asyncio.ensure_future(flight.do('key', fetch))
+    second = asyncio.ensure_future(flight.do('key', fetch))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == 'result'
+
+
+@pytest.mark.anyio
+async def test_pool_pressure_stays_flat_under_concurrent_reads(test_db, client, monkeypatch):
+    # admit the whole burst at once, so that this measures coalescing rather than admission control
+    monkeypatch.setattr(main.DEFAULT_LIMIT, 'concurrency', 1000)
+    await register_administrator()
+    res = await login(d.logging_in_administrator)
+    token = res.json()['access_token']
+    res = await create_website(token, d.proposed_website)
+    website_id = res.json()['website_id']
+    with open('./tests/assets/sample.html', 'rb') as file_data:
+        res = await upload_webpage(token, website_id, {'webpage': file_data})
+        assert res.status_code == 200, res.text
+
+    pool_requests = {}
+    for concurrency in (10, 100, 500):
+        before = main.db_pool.get_stats().get('requests_num', 0)
+        responses = await asyncio.gather(*(
+            client.get(f'/website/{website_id}/sample.html' if i % 2 else f'/website/{website_id}')
+            for i in range(concurrency)))
+        assert all(res.status_code == 200 for res in responses)
+        pool_requests[concurrency] = main.db_pool.get_stats().get('requests_num', 0) - before
+
+    # a burst borrows a handful of connections however many viewers are in it
+    assert pool_requests[500] <= max(pool_requests[10], 2) * 2, pool_requests
+    assert main.website_reads.coalesced > 0
+    assert main.webpage_reads.coalesced > 0
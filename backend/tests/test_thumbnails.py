@@ -0,0 +1,190 @@
+import os
+import pytest
+import stat
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from backend import main
+from backend.store import ContentStore
+from backend.thumbnails import THUMBNAIL_ORIGIN, find_renderer, render_thumbnail, svg_thumbnail
+from . import testhelpers
+from .testhelpers import get
+from .test_camps import administrator_token, auth, camp_with_websites
+
+PAGE = '''<!DOCTYPE html>
+<html>
+  <head>
+    <title>My Dinosaurs</title>
+    <link rel="stylesheet" href="styles.css" />
+    <script>document.write('not text')</script>
+  </head>
+  <body style="color: #333">
+    <h1>Dinosaurs &amp; <script>alert(1)</script>Me</h1>
+    <p>T-Rex is   my favourite.</p>
+    <img src="trex.png" />
+  </body>
+</html>
+'''
+
+
+def test_svg_thumbnail():
+    svg = svg_thumbnail({'index.html': PAGE, 'styles.css': 'h1 { color: red } body { background: #abcdef; }'}).decode()
+    assert 'fill="#abcdef"' in svg
+    assert 'fill="#333"' in svg
+    # text is escaped, and scripts aren't text
+    assert 'Dinosaurs &amp; Me' in svg
+    assert 'T-Rex is my favourite.' in svg
+    assert 'alert' not in svg and 'not text' not in svg
+    assert svg.count('fill-opacity') == 1
+
+    # colours that aren't colours can't get out of their attribute
+    svg = svg_thumbnail({'index.html': '<body style=\'background: red"/><script>alert(1)</script>\'><p>hi</p></body>'}).decode()
+    assert '<script' not in svg
+    assert 'fill="#ffffff"' in svg
+
+
+def test_render_thumbnail(tmp_path):
+    files = {'index.html': PAGE}
+    thumbnail = render_thumbnail(files, str(tmp_path))
+    assert thumbnail['extension'] == 'svg'
+    store = ContentStore(str(tmp_path))
+    path = store.path(thumbnail['version'], 'thumbnail.svg')
+    modified = os.stat(path).st_mtime_ns
+
+    # the same version of a website isn't rendered twice, but a new version is
+    assert render_thumbnail(dict(files), str(tmp_path)) == thumbnail
+    assert os.stat(path).st_mtime_ns == modified
+    assert render_thumbnail(files | {'styles.css': 'body { color: blue }'}, str(tmp_path))['version'] != thumbnail['version']
+
+    assert render_thumbnail({'about.html': '<p>hi</p>'}, str(tmp_path)) is None
+
+
+# a stand in for a browser, whose "screenshot" is the page it's given, as it was served. it goes
+# through the proxy it's given for everything, as chromium does when loopback isn't bypassed
+BROWSER = '''
+import os, sys, urllib.error, urllib.request
+args = dict(arg.partition("=")[::2] for arg in sys.argv[1:-1])
+assert "--no-sandbox" not in args and args["--proxy-bypass-list"] == "<-loopback>"
+opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": args["--proxy-server"]}))
+try:
+    opener.open(os.environ["SECRET_URL"])
+    secret = b"leaked"
+except urllib.error.HTTPError as error:
+    secret = str(error.code).encode()
+with opener.open(sys.argv[-1]) as res, open(args["--screenshot"], "wb") as file:
+    file.write(sys.argv[-1].encode() + b"\\n" + secret + b"\\n" + res.read())
+'''
+
+
+class SecretHandler(BaseHTTPRequestHandler):
+    # another service on the server, which pages mustn't be able to read
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'secret')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_render_thumbnail_with_a_browser(tmp_path, monkeypatch):
+    browser = tmp_path / 'browser'
+    browser.write_text(f'#!{sys.executable}\n' + BROWSER)
+    browser.chmod(browser.stat().st_mode | stat.S_IEXEC)
+    store_root = str(tmp_path / 'store')
+    secret = ThreadingHTTPServer(('127.0.0.1', 0), SecretHandler)
+    threading.Thread(target=secret.serve_forever, daemon=True).start()
+    monkeypatch.setenv('SECRET_URL', f'http://127.0.0.1:{secret.server_address[1]}/')
+    monkeypatch.setenv('no_proxy', '')
+
+    try:
+        thumbnail = render_thumbnail({'index.html': PAGE}, store_root, str(browser))
+    finally:
+        secret.shutdown()
+        secret.server_close()
+    assert thumbnail['extension'] == 'png'
+    with open(ContentStore(store_root).path(thumbnail['version'], 'thumbnail.png'), 'rb') as file:
+        url, status, page = file.read().decode().split('\n', 2)
+    # the page is served from its own origin, rather than opened as a file that could load other files,
+    # and other ports on loopback are turned away
+    assert url == f'http://{THUMBNAIL_ORIGIN}/index.html'
+    assert status == '403'
+    assert page == PAGE
+
+    # once a version has a screenshot, the browser isn't run again
+    assert render_thumbnail({'index.html': PAGE}, store_root, '/bin/false') == thumbnail
+    # but if the browser fails, the website gets a drawing instead
+    assert render_thumbnail({'index.html': '<p>new</p>'}, store_root, '/bin/false')['extension'] == 'svg'
+
+
+def test_a_renderer_has_to_be_chosen(tmp_path, monkeypatch):
+    # an installed browser isn't used just because it's there
+    chromium = tmp_path / 'chromium'
+    chromium.write_text('#!/bin/sh\n')
+    chromium.chmod(chromium.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', str(tmp_path))
+    monkeypatch.delenv('THUMBNAIL_RENDERER', raising=False)
+    assert find_renderer() is None
+
+    monkeypatch.setenv('THUMBNAIL_RENDERER', str(chromium))
+    assert find_renderer() == str(chromium)
+    monkeypatch.setenv('THUMBNAIL_RENDERER', '')
+    assert find_renderer() is None
+
+
+@pytest.mark.anyio
+async def test_camp_gallery(test_db, monkeypatch):
+    monkeypatch.setattr(main.publisher, 'renderer', None)
+    token = await administrator_token()
+    camp_id, students, website_ids = await camp_with_websites(token, students=2)
+    await main.publisher.idle()
+
+    res = await get(f'/camp/{camp_id}/gallery')
+    assert res.status_code == 200, res.text
+    gallery = res.json()
+    assert [website['website_id'] for website in gallery] == website_ids
+    assert [website['username'] for website in gallery] == [student['username'] for student in students]
+    assert gallery[0]['thumbnail'].startswith(f'/thumbnails/{website_ids[0]}/')
+
+    res = await get(gallery[0]['thumbnail'])
+    assert res.status_code == 200, res.text
+    assert res.headers['content-type'] == 'image/svg+xml'
+    assert res.headers['cache-control'] == 'public, max-age=31536000, immutable'
+    assert res.headers['content-security-policy'] == main.THUMBNAIL_CONTENT_SECURITY_POLICY
+    assert students[0]['username'] in res.text
+    res = await get(gallery[0]['thumbnail'], headers={'If-None-Match': res.headers['etag']})
+    assert res.status_code == 304
+
+    res = await get(f'/thumbnails/{website_ids[0]}')
+    assert res.status_code == 307
+    assert res.headers['location'] == gallery[0]['thumbnail']
+
+    res = await get(f'/thumbnails/{website_ids[0]}/{"0" * 64}.svg')
+    assert res.status_code == 404
+    res = await get(f'/thumbnails/{website_ids[0]}/../../secrets.svg')
+    assert res.status_code == 404
+    res = await get('/camp/999/gallery')
+    assert res.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_lost_thumbnails_are_rendered_again(test_db, monkeypatch):
+    monkeypatch.setattr(main.publisher, 'renderer', None)
+    token = await administrator_token()
+    camp_id, _, website_ids = await camp_with_websites(token, students=1)
+    await main.publisher.idle()
+    thumbnail = (await get(f'/camp/{camp_id}/gallery')).json()[0]['thumbnail']
+    version = thumbnail.rsplit('/', 1)[1].split('.')[0]
+    os.remove(main.publisher.store.path(version, 'thumbnail.svg'))
+
+    res = await get(thumbnail)
+    assert res.status_code == 503
+    await main.publisher.idle()
+    res = await get(thumbnail)
+    assert res.status_code == 200
+
+    # purging a camp deletes its websites' thumbnails too
+    res = await testhelpers.client.delete(f'/camp/{camp_id}', headers=auth(token))
+    assert res.status_code == 200, res.text
+    res = await get(f'/thumbnails/{website_ids[0]}')
+    assert res.status_code == 404
@@ -0,0 +1,91 @@
+import time
+import pytest
+from jose import JWTError, jwt
+from backend.tokens import TokenVerifier, parse_keys
+
+
+def expiring_in(seconds):
+    return int(time.time()) + seconds
+
+
+def test_encode_and_decode():
+    verifier = TokenVerifier({'1': 'secret'}, current_kid='1')
+    token = verifier.encode({'sub': 'neffieta', 'exp': expiring_in(60)})
+
+    assert jwt.get_unverified_header(token)['kid'] == '1'
+    assert verifier.decode(token)['sub'] == 'neffieta'
+
+
+def test_repeat_tokens_are_cached():
+    verifier = TokenVerifier({'1': 'secret'}, current_kid='1')
+    token = verifier.encode({'sub': 'neffieta', 'exp': expiring_in(60)})
+
+    for _ in range(5):
+        assert verifier.decode(token)['sub'] == 'neffieta'
+    assert verifier.misses == 1
+    assert verifier.hits == 4
+
+
+def test_cache_is_bounded():
+    verifier = TokenVerifier({'1': 'secret'}, current_kid='1', max_size=2)
+    for username in ('a', 'b', 'c'):
+        verifier.decode(verifier.encode({'sub': username, 'exp': expiring_in(60)}))
+    assert len(verifier.cache) == 2
+
+
+def test_expired_tokens_are_rejected():
+    verifier = TokenVerifier({'1': 'secret'}, current_kid='1')
+    with pytest.raises(JWTError):
+        verifier.decode(verifier.encode({'sub': 'neffieta', 'exp': expiring_in(-60)}))
+
+
+def test_cached_tokens_expire():
+    verifier = TokenVerifier({'1': 'secret'}, current_kid='1')
+    token = verifier.encode({'sub': 'neffieta', 'exp': expiring_in(1)})
+    verifier.decode(token)
+
+    time.sleep(1.1)
+    with pytest.raises(JWTError):
+        verifier.decode(token)
+
+
+def test_tampered_tokens_are_rejected():
+    verifier = TokenVerifier({'1': 'secret'}, current_kid='1')
+    forged = jwt.encode({'sub': 'neffieta', 'exp': expiring_in(60)}, 'not the secret', headers={'kid': '1'})
+    with pytest.raises(JWTError):
+        verifier.decode(forged)
+
+    unknown_key = jwt.encode({'sub': 'neffieta', 'exp': expiring_in(60)}, 'secret', headers={'kid': '2'})
+    with pytest.raises(JWTError):
+        verifier.decode(unknown_key)
+
+
+def test_tokens_without_kid_are_accepted():
+    verifier = TokenVerifier({'1': 'old', '2': 'new'}, current_kid='2')
+    token = jwt.encode({'sub': 'neffieta', 'exp': expiring_in(60)}, 'old', algorithm='HS256')
+    assert verifier.decode(token)['sub'] == 'neffieta'
+
+
+def test_key_rotation_keeps_cache_warm():
+    verifier = TokenVerifier({'1': 'old'}, current_kid='1')
+    old_token = verifier.encode({'sub': 'neffieta', 'exp': expiring_in(60)})
+    verifier.decode(old_token)
+
+    verifier.set_keys({'1': 'old', '2': 'new'}, current_kid='2')
+    new_token = verifier.encode({'sub': 'lachlantula', 'exp': expiring_in(60)})
+    assert jwt.get_unverified_header(new_token)['kid'] == '2'
+
+    assert verifier.decode(old_token)['sub'] == 'neffieta'
+    assert verifier.hits == 1
+    assert verifier.decode(new_token)['sub'] == 'lachlantula'
+
+    # retiring the old key forgets (and rejects) the tokens it signed
+    verifier.set_keys({'2': 'new'}, current_kid='2')
+    with pytest.raises(JWTError):
+        verifier.decode(old_token)
+    assert verifier.decode(new_token)['sub'] == 'lachlantula'
+
+
+def test_parse_keys():
+    assert parse_keys(None) == {}
+    assert parse_keys('1:abc, 2:d:e') == {'1': 'abc', '2': 'd:e'}
@@ -1,40 +1,48 @@
+from typing import Optional
 from httpx import AsyncClient
-from asgi_lifespan import LifespanManager
 from .testdata import TestData as d
-from backend import main, models
+from backend import models
+
+# set by the session's client fixture (in conftest.py) once the app has started
+client: Optional[AsyncClient] = None
 
 
 async def register_administrator(administrator_data=d.registering_administrator_data):
-    async with LifespanManager(main.app):
-        async with AsyncClient(app=main.app, base_url='http://test') as ac:
-            res = await ac.post('/register', json=administrator_data)
-            return res
+    return await client.post('/register', json=administrator_data)
 
 
 async def register_student(student_data=d.registering_student):
-    async with LifespanManager(main.app):
-        async with AsyncClient(app=main.app, base_url='http://test') as ac:
-            res = await ac.post('/register/student', json=student_data)
-            return res
+    return await client.post('/register/student', json=student_data)
 
 
 async def login(user_data: models.LoggingInUser):
-    async with LifespanManager(main.app):
-        async with AsyncClient(app=main.app, base_url='http://test') as ac:
-            print('attempting login')
-            res = await ac.post('/login', json=user_data)
-            return res
+    return await client.post('/login', json=user_data)
 
 
 async def create_website(access_token: str, website_data: models.ProposedWebsite = d.proposed_website):
-    async with LifespanManager(main.app):
-        async with AsyncClient(app=main.app, base_url='http://test') as ac:
-            res = await ac.post('/website', json=website_data, headers={'Authorization': 'Bearer ' + access_token})
-            return res
+    return await client.post('/website', json=website_data, headers={'Authorization': 'Bearer ' + access_token})
 
 
 async def upload_webpage(access_token: str, website_id: int, webpage_file):
-    async with LifespanManager(main.app):
-        async with AsyncClient(app=main.app, base_url='http://test') as ac:
-            res = await ac.post('/website/' + str(website_id), files=webpage_file, headers={'Authorization': 'Bearer ' + access_token})
-            return res
+    return await client.post('/website/' + str(website_id), files=webpage_file, headers={'Authorization': 'Bearer ' + access_token})
+
+
+async def get_website(website_id: int):
+    return await client.get('/website/' + str(website_id))
+
+
+async def get_webpage(website_id: int, filename: str):
+    return await client.get('/website/' + str(website_id) + '/' + filename)
+
+
+async def get(url: str, headers: Optional[dict] = None):
+    headers = headers or {}
+    return await client.get(url, headers=headers)
+
+
+async def refresh_token(refresh_token: str):
+    return await client.post('/token/refresh', json={'refresh_token': refresh_token})
+
+
+async def search(access_token: str, query: str, limit: int = 20):
+    return await client.get('/search', params={'q': query, 'limit': limit}, headers={'Authorization': 'Bearer ' + access_token})